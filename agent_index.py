@@ -0,0 +1,52 @@
+"""Integer indexing of the traffic light agents of a grid."""
+
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+
+class AgentIndex:
+    """ Bidirectional index between agent names and their position in the grid.
+
+    Agent center{i} has id i and sits at row i // cols and column i % cols, the layout
+    flow's TrafficLightGridNetwork uses. The index is built once per env, so the reward
+    hot path only does dict lookups and array indexing instead of parsing names.
+    """
+
+    def __init__(self, rows: int, cols: int):
+        self.rows = rows
+        self.cols = cols
+        self.num_agents = rows * cols
+        self.names: List[str] = [f"center{i}" for i in range(self.num_agents)]
+        self.ids: Dict[str, int] = {name: i for i, name in enumerate(self.names)}
+        self.agent_rows, self.agent_cols = np.divmod(np.arange(self.num_agents), cols)
+
+    def id_num(self, name: str) -> int:
+        return self.ids[name]
+
+    def name(self, id_num: int) -> str:
+        return self.names[id_num]
+
+    def position(self, id_num: int) -> Tuple[int, int]:
+        """ @returns the (row, column) of the agent in the grid """
+        return int(self.agent_rows[id_num]), int(self.agent_cols[id_num])
+
+    def to_array(self, values: Dict[str, float]) -> Tuple[np.ndarray, np.ndarray]:
+        """ Converts a mapping from agent name to value into a dense array.
+
+        Agents missing from values are set to 0.
+
+        @returns the ids of the agents in values, in iteration order, and an array of
+        num_agents values indexed by id
+        """
+        id_nums = np.fromiter(
+            (self.ids[name] for name in values), dtype=np.int64, count=len(values)
+        )
+        array = np.zeros(self.num_agents)
+        array[id_nums] = np.fromiter(values.values(), dtype=float, count=len(values))
+        return id_nums, array
+
+    def to_dict(self, array: np.ndarray, id_nums: np.ndarray) -> Dict[str, float]:
+        """ Inverse of to_array for the agents in id_nums """
+        names = self.names
+        return {names[i]: value for i, value in zip(id_nums, array[id_nums].tolist())}
@@ -0,0 +1,90 @@
+"""Sizing of rollout workers and batches from the hardware and a calibration rollout."""
+
+import os
+import time
+from typing import Callable, Dict, Optional
+
+import psutil
+
+# memory a rollout worker takes besides its envs, i.e. Python, Ray and TensorFlow
+WORKER_BYTES = 600 * 2 ** 20
+# rough cost of one forward pass of the small policy network, envs stepped by a
+# worker are batched into one pass until they take about this long per step
+INFERENCE_SECONDS = 0.002
+MAX_ENVS_PER_WORKER = 8
+# share of the available memory the workers may use
+MEMORY_FRACTION = 0.8
+
+
+class Calibration:
+    """ Measured cost of one env: seconds per step and bytes of memory, including the
+    simulator processes it starts
+    """
+
+    def __init__(self, step_seconds: float, env_bytes: int):
+        self.step_seconds = step_seconds
+        self.env_bytes = env_bytes
+
+
+def calibrate(create_env: Callable, steps: int = 50) -> Calibration:
+    """ Times a short rollout with random actions of an env from create_env """
+    process = psutil.Process()
+    before = _tree_rss(process)
+    env = create_env()
+    obs = env.reset()
+    start = time.perf_counter()
+    for _ in range(steps):
+        actions = {rl_id: env.action_space.sample() for rl_id in obs}
+        obs, _, dones, _ = env.step(actions)
+        if dones["__all__"]:
+            obs = env.reset()
+    step_seconds = (time.perf_counter() - start) / steps
+    env_bytes = max(_tree_rss(process) - before, 0)
+    env.terminate()
+    return Calibration(step_seconds, env_bytes)
+
+
+def plan(
+    calibration: Calibration,
+    horizon: int,
+    num_cpus: Optional[int] = None,
+    available_bytes: Optional[int] = None,
+) -> Dict[str, int]:
+    """ Picks the worker and batch sizes that saturate the machine.
+
+    Every CPU but the driver's gets a worker, as long as the workers fit in
+    MEMORY_FRACTION of the available memory. Envs that step faster than a policy
+    forward pass are batched per worker, so inference is amortized over them, and every
+    env contributes one episode to each training batch.
+
+    @returns num_cpus, num_workers, num_envs_per_worker and train_batch_size
+    """
+    if num_cpus is None:
+        num_cpus = len(os.sched_getaffinity(0))
+    if available_bytes is None:
+        available_bytes = psutil.virtual_memory().available
+
+    num_envs_per_worker = min(
+        MAX_ENVS_PER_WORKER,
+        max(1, int(INFERENCE_SECONDS / max(calibration.step_seconds, 1e-9))),
+    )
+    worker_bytes = WORKER_BYTES + num_envs_per_worker * calibration.env_bytes
+    num_workers = max(1, num_cpus - 1)
+    num_workers = max(1, min(num_workers, int(MEMORY_FRACTION * available_bytes // worker_bytes)))
+
+    return {
+        "num_cpus": num_cpus,
+        "num_workers": num_workers,
+        "num_envs_per_worker": num_envs_per_worker,
+        "train_batch_size": num_workers * num_envs_per_worker * horizon,
+    }
+
+
+def _tree_rss(process: psutil.Process) -> int:
+    rss = process.memory_info().rss
+    for child in process.children(recursive=True):
+        try:
+            rss += child.memory_info().rss
+        except psutil.NoSuchProcess:
+            pass
+    return rss
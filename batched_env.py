@@ -0,0 +1,70 @@
+"""Several independent traffic light grids stepped as one multiagent env."""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Tuple
+
+from ray.rllib.env.multi_agent_env import MultiAgentEnv
+
+
+class BatchedGridEnv(MultiAgentEnv):
+    """ Steps num_grids copies of a traffic light grid env together.
+
+    Agent center{i} of grid g is exposed as "g/center{i}", so RLlib computes the actions
+    of every agent of every grid in one forward pass per step. Each grid talks to its
+    own SUMO process, so the grids are stepped from a thread pool and their simulator
+    calls overlap.
+
+    All grids share the horizon and are reset together; the episode ends as soon as any
+    grid is done.
+    """
+
+    def __init__(self, create_env: Callable, num_grids: int, parallel: bool = True):
+        self.envs = [create_env() for _ in range(num_grids)]
+        self.observation_space = self.envs[0].observation_space
+        self.action_space = self.envs[0].action_space
+        self._pool = ThreadPoolExecutor(num_grids) if parallel and num_grids > 1 else None
+        self._agent_ids: Dict[str, Tuple[int, str]] = {}
+
+    @property
+    def agent_index(self):
+        return self.envs[0].agent_index
+
+    def reset(self):
+        return self._merge(self._map(lambda env, _: env.reset(), [None] * len(self.envs)))
+
+    def step(self, action_dict):
+        actions: List[dict] = [{} for _ in self.envs]
+        for agent_id, action in action_dict.items():
+            grid, rl_id = self._split(agent_id)
+            actions[grid][rl_id] = action
+
+        results = self._map(lambda env, grid_actions: env.step(grid_actions), actions)
+        obs, rewards, dones, infos = (self._merge(values) for values in zip(*results))
+        dones["__all__"] = any(result[2]["__all__"] for result in results)
+        return obs, rewards, dones, infos
+
+    def terminate(self):
+        for env in self.envs:
+            env.terminate()
+        if self._pool is not None:
+            self._pool.shutdown()
+
+    def _map(self, fn: Callable, args: list) -> list:
+        if self._pool is None:
+            return [fn(env, arg) for env, arg in zip(self.envs, args)]
+        return list(self._pool.map(fn, self.envs, args))
+
+    def _merge(self, values: List[dict]) -> dict:
+        return {
+            f"{grid}/{rl_id}": value
+            for grid, grid_values in enumerate(values)
+            for rl_id, value in grid_values.items()
+            if rl_id != "__all__"
+        }
+
+    def _split(self, agent_id: str) -> Tuple[int, str]:
+        split = self._agent_ids.get(agent_id)
+        if split is None:
+            grid, rl_id = agent_id.split("/", 1)
+            split = self._agent_ids[agent_id] = (int(grid), rl_id)
+        return split
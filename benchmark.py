@@ -0,0 +1,418 @@
+"""Benchmarks of reward sharing and env step throughput, without SUMO.
+
+flow's MultiTrafficLightGridPOEnv is replaced by StandInGridEnv before the project's
+env modules are imported, so the benchmarks run offline on CPU and only measure the
+project's own code on top of a trivial fake simulator.
+
+    python benchmark.py --output bench.json
+    python benchmark.py --output new.json --compare bench.json
+
+With --compare, the median time of every benchmark is compared to a previous run and
+the script exits with status 1 if any got slower by more than --tolerance.
+
+    python benchmark.py --import_budget 0.5
+
+checks instead that importing run_experiment in a fresh interpreter takes less than
+the budget in seconds and loads none of HEAVY_MODULES, and exits with status 1 if not.
+
+    python benchmark.py --algos PPO APPO --iterations 5 --num_workers 2
+
+trains each algorithm instead, set up like run_experiment.py with --simulator stub,
+and prints the env steps per second after the first iteration. This needs Ray, RLlib
+and flow.
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import timeit
+import types
+from types import SimpleNamespace
+
+import numpy as np
+
+GRID_SIZES = (3, 5, 10, 20, 50)
+ENV_CLASSES = (
+    ("basic_env", "BasicEnv"),
+    ("reward_sharing_env", "RewardSharingEnv"),
+    ("reward_sharing_env_neighborhoods", "RewardSharingEnvSimple"),
+    ("reward_sharing_env_knn", "RewardSharingEnvKNN"),
+)
+ADDITIONAL_PARAMS = {
+    "num_observed": 2,
+    "num_local_edges": 4,
+    "num_local_lights": 4,
+    "neighbor_weight": 0.1,
+    "k_nearest_neighbor": 5,
+    "temperature_factor": 0.5,
+}
+
+
+class StandInVehicles:
+    """ Stand-in for flow's vehicle kernel, with vehicles parked on random edges """
+
+    def __init__(self, edges, rng, per_edge=4):
+        self.ids = [f"veh{i}" for i in range(per_edge * len(edges))]
+        self.edges = dict(zip(self.ids, rng.choice(edges, len(self.ids)).tolist()))
+        self.positions = dict(zip(self.ids, (rng.rand(len(self.ids)) * 100).tolist()))
+        self.speeds = dict(zip(self.ids, (rng.rand(len(self.ids)) * 30).tolist()))
+
+    def get_ids(self):
+        return self.ids
+
+    def get_edge(self, veh_ids):
+        return [self.edges[veh_id] for veh_id in veh_ids]
+
+    def get_position(self, veh_ids):
+        return [self.positions[veh_id] for veh_id in veh_ids]
+
+    def get_speed(self, veh_ids):
+        return [self.speeds[veh_id] for veh_id in veh_ids]
+
+
+class StandInGridEnv:
+    """ Stand-in for flow's MultiTrafficLightGridPOEnv with a fake simulator.
+
+    It keeps the attributes and the step/reset/compute_reward structure the project's
+    envs rely on. The raw reward of every agent is random. Every intersection has four
+    incoming edges of 100m holding four parked vehicles each on average, enough for
+    the observation cache; the stand-in's own get_state returns zeros of the size flow
+    uses.
+    """
+
+    def __init__(self, env_params, sim_params, network, simulator="traci"):
+        self.env_params = env_params
+        self.rows = network.rows
+        self.cols = network.cols
+        self.num_traffic_lights = self.rows * self.cols
+        self.direction = np.zeros((self.num_traffic_lights, 1))
+        self.currently_yellow = np.zeros((self.num_traffic_lights, 1))
+        self.last_change = np.zeros((self.num_traffic_lights, 1))
+        params = env_params.additional_params
+        self.num_observed = params["num_observed"]
+        self.num_local_edges = params["num_local_edges"]
+        self.obs_size = (
+            3 * 4 * params["num_observed"]
+            + 2 * params["num_local_edges"]
+            + 2 * (1 + params["num_local_lights"])
+        )
+        self.horizon = 400
+        self.time_counter = 0
+        self._rng = np.random.RandomState(0)
+
+        edges = [f"in{i}_{side}" for i in range(self.num_traffic_lights) for side in range(4)]
+        # sorted by name like flow's TrafficLightGridNetwork.node_mapping
+        self.network = SimpleNamespace(
+            node_mapping=sorted(
+                (f"center{i}", edges[4 * i : 4 * i + 4])
+                for i in range(self.num_traffic_lights)
+            )
+        )
+        grid_array = {"short_length": 100, "long_length": 100, "inner_length": 100}
+        self.net_params = SimpleNamespace(additional_params={"grid_array": grid_array})
+        kernel_network = SimpleNamespace(
+            get_edge_list=lambda: edges,
+            edge_length=lambda edge: 100.0,
+            speed_limit=lambda edge: 30.0,
+            network=SimpleNamespace(num_edges=len(edges)),
+        )
+        self.k = SimpleNamespace(
+            network=kernel_network, vehicle=StandInVehicles(edges, self._rng)
+        )
+
+    def _convert_edge(self, edge):
+        node, side = edge[2:].split("_")
+        return 4 * int(node) + int(side) + 1
+
+    def _get_relative_node(self, agent_id, direction):
+        i = int(agent_id.split("center")[1])
+        row, col = divmod(i, self.cols)
+        row_offset, col_offset = {
+            "top": (1, 0), "bottom": (-1, 0), "left": (0, -1), "right": (0, 1)
+        }[direction]
+        if 0 <= row + row_offset < self.rows and 0 <= col + col_offset < self.cols:
+            return i + row_offset * self.cols + col_offset
+        return -1
+
+    def _apply_rl_actions(self, rl_actions):
+        for rl_id, rl_action in rl_actions.items():
+            i = int(rl_id.split("center")[1])
+            if rl_action > 0.0:
+                self.direction[i] = not self.direction[i]
+
+    def get_state(self):
+        return {
+            f"center{i}": np.zeros(self.obs_size) for i in range(self.num_traffic_lights)
+        }
+
+    def compute_reward(self, rl_actions, **kwargs):
+        if rl_actions is None:
+            return {}
+        rewards = -self._rng.rand(len(rl_actions))
+        return dict(zip(rl_actions, rewards.tolist()))
+
+    def step(self, rl_actions):
+        self.time_counter += 1
+        self._apply_rl_actions(rl_actions)
+        obs = self.get_state()
+        rewards = self.compute_reward(rl_actions)
+        done = {"__all__": self.time_counter >= self.horizon}
+        return obs, rewards, done, {rl_id: {} for rl_id in obs}
+
+    def reset(self):
+        self.time_counter = 0
+        return self.get_state()
+
+
+def stand_in_modules(modules=sys.modules) -> dict:
+    """ @returns the stand-in modules, by name, that make
+    flow.envs.multiagent.traffic_light_grid resolve to the stand-in env, along with the
+    flow and TraCI modules the project's envs import besides it that are missing from
+    modules
+    """
+    stand_ins = {}
+    for name in ("flow", "flow.envs", "flow.envs.multiagent", "flow.utils"):
+        if name not in modules:
+            stand_ins[name] = types.ModuleType(name)
+    module = types.ModuleType("flow.envs.multiagent.traffic_light_grid")
+    module.MultiTrafficLightGridPOEnv = StandInGridEnv
+    stand_ins[module.__name__] = module
+    exceptions = types.ModuleType("flow.utils.exceptions")
+    exceptions.FatalFlowError = Exception
+    stand_ins[exceptions.__name__] = exceptions
+
+    if "traci" not in modules:
+        traci = types.ModuleType("traci")
+        constants = types.ModuleType("traci.constants")
+        constants.LAST_STEP_VEHICLE_HALTING_NUMBER = 0x14
+        traci_exceptions = types.ModuleType("traci.exceptions")
+        traci_exceptions.TraCIException = type("TraCIException", (Exception,), {})
+        traci_exceptions.FatalTraCIError = type("FatalTraCIError", (Exception,), {})
+        # before Python 3.7, "import traci.constants as tc" reads the package attribute
+        traci.constants = constants
+        traci.exceptions = traci_exceptions
+        for stand_in in (traci, constants, traci_exceptions):
+            stand_ins[stand_in.__name__] = stand_in
+    return stand_ins
+
+
+def install_stand_in():
+    """ Installs stand_in_modules for the rest of the process """
+    sys.modules.update(stand_in_modules())
+
+
+def make_env(env_cls, size: int):
+    env_params = SimpleNamespace(additional_params=dict(ADDITIONAL_PARAMS))
+    network = SimpleNamespace(rows=size, cols=size)
+    return env_cls(env_params, None, network)
+
+
+def time_call(fn, min_time: float) -> dict:
+    """ @returns the median and best seconds per call of fn over 5 repeats """
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    times = np.array(timer.repeat(repeat=5, number=number)) / number
+    return {
+        "median_s": float(np.median(times)),
+        "best_s": float(times.min()),
+        "calls_per_s": float(1 / np.median(times)),
+    }
+
+
+def run_benchmarks(sizes, min_time: float) -> list:
+    install_stand_in()
+    results = []
+    for module_name, cls_name in ENV_CLASSES:
+        env_cls = getattr(__import__(module_name), cls_name)
+        for size in sizes:
+            env = make_env(env_cls, size)
+            actions = {f"center{i}": 1.0 for i in range(size * size)}
+
+            benchmarks = {
+                "compute_reward": lambda: env.compute_reward(actions),
+                "step": lambda: env.step(actions),
+            }
+            for benchmark, fn in benchmarks.items():
+                result = time_call(fn, min_time)
+                result.update({"benchmark": benchmark, "env": cls_name, "grid": size})
+                results.append(result)
+                print(
+                    f"{benchmark:>14} {cls_name:>22} {size:>3}x{size:<3} "
+                    f"{result['median_s'] * 1e6:12.1f} us {result['calls_per_s']:12.1f}/s"
+                )
+    return results
+
+
+def compare(results: list, baseline: list, tolerance: float) -> bool:
+    """ Prints the speed ratio to a baseline run of every benchmark.
+
+    @returns whether no benchmark got slower by more than tolerance
+    """
+    key = lambda result: (result["benchmark"], result["env"], result["grid"])
+    previous = {key(result): result for result in baseline}
+    ok = True
+    for result in results:
+        old = previous.get(key(result))
+        if old is None:
+            continue
+        ratio = result["median_s"] / old["median_s"]
+        regressed = ratio > 1 + tolerance
+        ok &= not regressed
+        print(
+            f"{'REGRESSION' if regressed else 'ok':>10} {key(result)} "
+            f"{ratio:.2f}x the baseline time"
+        )
+    return ok
+
+
+HEAVY_MODULES = ("ray", "tensorflow", "flow", "gym", "scipy", "psutil")
+
+
+def import_time(module: str = "run_experiment") -> tuple:
+    """ Imports module in a fresh interpreter, once the interpreter itself is up.
+
+    @returns the seconds the import took and the HEAVY_MODULES it loaded
+    """
+    script = (
+        "import json, sys, time\n"
+        "start = time.perf_counter()\n"
+        f"import {module}\n"
+        "elapsed = time.perf_counter() - start\n"
+        "loaded = {name.split('.')[0] for name in sys.modules}\n"
+        f"print(json.dumps([elapsed, sorted(loaded & set({list(HEAVY_MODULES)!r}))]))\n"
+    )
+    output = subprocess.check_output([sys.executable, "-c", script], universal_newlines=True)
+    elapsed, heavy = json.loads(output.strip().splitlines()[-1])
+    return elapsed, heavy
+
+
+def check_import_budget(budget: float, repeats: int = 3) -> bool:
+    """ @returns whether the best of repeats imports of run_experiment fits in budget
+    seconds without loading any of HEAVY_MODULES
+    """
+    timings = [import_time() for _ in range(repeats)]
+    elapsed = min(elapsed for elapsed, _ in timings)
+    heavy = timings[0][1]
+    print(f"import run_experiment: {elapsed * 1e3:.1f} ms, budget {budget * 1e3:.1f} ms")
+    if heavy:
+        print(f"import run_experiment loads heavy modules: {', '.join(heavy)}")
+    return elapsed <= budget and not heavy
+
+
+ALGOS = ("PPO", "APPO")
+
+
+def algo_throughput(algos, iterations: int, num_workers: int, size: int) -> list:
+    """ Trains every algorithm of algos on a size x size grid of the stub simulator
+    for iterations iterations, with run_experiment.py's default settings.
+
+    The first iteration builds the graphs and starts the workers, so it is left out.
+
+    @returns the env steps per second, seconds per iteration and env steps of every
+    algorithm after its first iteration
+    """
+    import ray
+    from curriculum import make_trainer
+
+    ray.init(num_cpus=num_workers + 1)
+    results = []
+    try:
+        for version, algo in enumerate(algos):
+            # run_experiment.py's defaults
+            args = SimpleNamespace(
+                algo=algo, env="BasicEnv", inflow_rate=300, k_nearest=5, temp=0.5,
+                neighbor_weight=0.1, lr=1e-4, num_workers=num_workers,
+                policy_classes="single", simulator="stub",
+            )
+            trainer = make_trainer(args, size, size, version)
+            first = trainer.train()
+            for _ in range(iterations - 1):
+                last = trainer.train()
+            trainer.stop()
+            seconds = last["time_total_s"] - first["time_total_s"]
+            steps = last["timesteps_total"] - first["timesteps_total"]
+            result = {
+                "algo": algo,
+                "grid": size,
+                "num_workers": num_workers,
+                "steps_per_s": steps / seconds,
+                "s_per_iteration": seconds / (iterations - 1),
+                "steps": int(steps),
+            }
+            results.append(result)
+            print(
+                f"{algo:>5} {size:>3}x{size:<3} {num_workers} workers "
+                f"{result['steps_per_s']:10.1f} steps/s "
+                f"{result['s_per_iteration']:8.1f} s/iteration {steps} steps",
+                flush=True,
+            )
+    finally:
+        ray.shutdown()
+    return results
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], universal_newlines=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(GRID_SIZES),
+                        help="Side lengths of the square grids to benchmark")
+    parser.add_argument("--min_time", type=float, default=0.2,
+                        help="Approximate seconds spent in every timing repeat")
+    parser.add_argument("--output", help="JSON file to write the results to")
+    parser.add_argument("--compare", help="JSON results of a previous run")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="Allowed relative slowdown against --compare")
+    parser.add_argument("--import_budget", type=float,
+                        help="Only check that importing run_experiment takes less "
+                        "than this many seconds and loads no heavy module")
+    parser.add_argument("--algos", nargs="+", choices=ALGOS,
+                        help="Only measure the training throughput of these algorithms "
+                        "on the stub simulator")
+    parser.add_argument("--iterations", type=int, default=5,
+                        help="Training iterations per algorithm, the first is not timed")
+    parser.add_argument("--num_workers", type=int, default=2,
+                        help="Rollout workers per algorithm")
+    parser.add_argument("--grid", type=int, default=3,
+                        help="Side length of the grid the algorithms train on")
+    args = parser.parse_args()
+
+    if args.import_budget is not None:
+        sys.exit(0 if check_import_budget(args.import_budget) else 1)
+
+    if args.algos:
+        if args.iterations < 2:
+            parser.error("--iterations must be at least 2, the first one is not timed.")
+        if args.compare:
+            parser.error("--compare only applies to the simulation benchmarks.")
+        results = algo_throughput(args.algos, args.iterations, args.num_workers, args.grid)
+    else:
+        results = run_benchmarks(args.sizes, args.min_time)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "revision": git_revision(),
+                    "python": platform.python_version(),
+                    "numpy": np.__version__,
+                    "machine": platform.machine(),
+                    "results": results,
+                },
+                f,
+                indent=4,
+            )
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)["results"]
+        if not compare(results, baseline, args.tolerance):
+            sys.exit(1)
@@ -0,0 +1,171 @@
+"""Starting and stopping a multi-node Ray cluster for run_experiment.py.
+
+A cluster spec is a JSON object with a "head" node, a list of "workers" and optional
+"port", "ssh_user", "setup" (a shell prefix run before ray on every node, e.g.
+"source ~/FlowProject/env/bin/activate &&") and "local_dir" (a results directory
+shared by all nodes, so that trials can resume from their checkpoints on any node),
+e.g.
+
+    {"head": {"host": "node0", "num_cpus": 4, "sumo_slots": 0},
+     "workers": [{"host": "node1", "num_cpus": 32, "sumo_slots": 31},
+                 {"host": "node2", "num_cpus": 32, "sumo_slots": 31}],
+     "local_dir": "/shared/ray_results"}
+
+Every node offers its "sumo_slots" as the custom resource SUMO_RESOURCE and every
+rollout worker requests one, so SUMO only runs where it is installed and the workers
+spread over the nodes. Nodes on "localhost" are started directly, other hosts over
+ssh. LocalCluster starts the nodes of a spec as separate Ray nodes on this machine
+instead, to try the cluster setup and node loss without any other machine.
+"""
+
+import json
+import os
+import random
+import shlex
+import subprocess
+import threading
+from typing import List, Optional
+
+from generate_password import randomString
+
+SUMO_RESOURCE = "sumo"
+DEFAULT_PORT = 6379
+NODE_KEYS = ("host", "num_cpus", "sumo_slots")
+
+
+def load_cluster(path: str) -> dict:
+    with open(path, "r") as f:
+        spec = json.load(f)
+    for node in [spec["head"]] + spec.get("workers", []):
+        missing = set(NODE_KEYS) - set(node)
+        if missing:
+            raise ValueError(f"Cluster node {node} is missing {sorted(missing)}.")
+    return spec
+
+
+def local_spec(num_cpus: int, num_nodes: int = 3) -> dict:
+    """ @returns a spec of num_nodes nodes on localhost sharing num_cpus, the head
+    keeping one CPU for the learners and no SUMO slot
+    """
+    worker_cpus = max(num_cpus - 1, num_nodes - 1) // (num_nodes - 1)
+    return {
+        "head": {"host": "localhost", "num_cpus": 1, "sumo_slots": 0},
+        "workers": [
+            {"host": "localhost", "num_cpus": worker_cpus, "sumo_slots": worker_cpus}
+            for _ in range(num_nodes - 1)
+        ],
+    }
+
+
+def read_password(path: str) -> str:
+    """ Reads the redis password from path, generating the file first if it is missing """
+    if not os.path.exists(path):
+        with open(path, "w") as f:
+            f.write(randomString())
+    with open(path, "r") as f:
+        return f.readline().rstrip("\n")
+
+
+def redis_address(spec: dict) -> str:
+    return f"{spec['head']['host']}:{spec.get('port', DEFAULT_PORT)}"
+
+
+def start_command(node: dict, spec: dict, password: str, head: bool) -> List[str]:
+    """ @returns the ray start command line of a node """
+    command = [
+        "ray",
+        "start",
+        f"--num-cpus={node['num_cpus']}",
+        f"--resources={json.dumps({SUMO_RESOURCE: node['sumo_slots']})}",
+        f"--redis-password={password}",
+    ]
+    if head:
+        command += ["--head", f"--redis-port={spec.get('port', DEFAULT_PORT)}"]
+    else:
+        command += [f"--redis-address={redis_address(spec)}"]
+    return command
+
+
+def run_on(host: str, command: List[str], spec: dict):
+    """ Runs command on host, directly on localhost and over ssh elsewhere """
+    if host == "localhost" and not spec.get("setup"):
+        subprocess.check_call(command)
+        return
+    shell_command = " ".join(shlex.quote(arg) for arg in command)
+    if spec.get("setup"):
+        shell_command = f"{spec['setup']} {shell_command}"
+    if host == "localhost":
+        subprocess.check_call(["bash", "-c", shell_command])
+        return
+    target = f"{spec['ssh_user']}@{host}" if spec.get("ssh_user") else host
+    subprocess.check_call(["ssh", target, shell_command])
+
+
+def start_cluster(spec: dict, password: str) -> str:
+    """ Starts the head, then every worker node of spec
+
+    @returns the redis address to connect to
+    """
+    run_on(spec["head"]["host"], start_command(spec["head"], spec, password, True), spec)
+    for node in spec.get("workers", []):
+        run_on(node["host"], start_command(node, spec, password, False), spec)
+    return redis_address(spec)
+
+
+def stop_cluster(spec: dict):
+    """ Stops ray on every node of spec, ignoring nodes that are already down """
+    for node in spec.get("workers", []) + [spec["head"]]:
+        try:
+            run_on(node["host"], ["ray", "stop"], spec)
+        except subprocess.CalledProcessError:
+            print(f"Could not stop ray on {node['host']}.")
+
+
+class LocalCluster:
+    """ The nodes of a cluster spec, started as separate Ray nodes on this machine
+
+    Hosts are ignored. Killing a worker node with kill_worker_after exercises the
+    recovery of trials from their checkpoints like the loss of a machine would.
+    """
+
+    def __init__(self, spec: dict, password: str):
+        try:
+            from ray.cluster_utils import Cluster
+        except ImportError:
+            from ray.tests.cluster_utils import Cluster
+
+        self.cluster = Cluster(
+            initialize_head=True, head_node_args=self._node_args(spec["head"], password)
+        )
+        self.workers = [
+            self.cluster.add_node(**self._node_args(node, password))
+            for node in spec.get("workers", [])
+        ]
+        self.redis_address = self.cluster.redis_address
+        self._timer: Optional[threading.Timer] = None
+
+    @staticmethod
+    def _node_args(node: dict, password: str) -> dict:
+        return {
+            "num_cpus": node["num_cpus"],
+            "resources": {SUMO_RESOURCE: node["sumo_slots"]},
+            "redis_password": password,
+        }
+
+    def kill_worker_after(self, seconds: float):
+        """ Removes a random worker node seconds from now """
+
+        def kill():
+            node = random.choice(self.workers)
+            print("Killing a worker node.")
+            self.workers.remove(node)
+            self.cluster.remove_node(node)
+
+        self._timer = threading.Timer(seconds, kill)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def shutdown(self):
+        if self._timer is not None:
+            self._timer.cancel()
+        self.cluster.shutdown()
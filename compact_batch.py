@@ -0,0 +1,437 @@
+"""Opt-in compact encoding of sample batches sent from rollout workers to the learner.
+
+Observations make up most of a traffic grid sample batch, and most of their 42
+float32 features need far less precision. The on_sample_end callback encodes the
+observations of every policy batch on the worker before Ray ships it, and the policy
+decodes them on the learner when it feeds a batch to its loss:
+
+* "uint8" quantizes the speed, distance, density and velocity features to 8 bits
+  and the edge numbers to 16 bits within the ranges of QUANTIZATION_RANGES, and packs
+  the light direction and yellow flags into bits, 42 bytes per observation instead
+  of 168
+* "float16" casts the observations to half precision, 84 bytes per observation
+
+Both drop new_obs, which repeats the next row's obs and is only read by the
+postprocessing on the worker, never by the PPO and APPO losses.
+
+    python compact_batch.py --sizes 3 10 30 [--rllib]
+
+measures on observations of the benchmark stand-in env the bytes of the observations
+and of a whole pickled sample batch, the learner memory while --queued batches wait
+for training, the encoding time, the error of every feature group, and the loss and
+KL of the first PPO update on the decoded batch against the original one. --rllib
+also runs that update with RLlib's PPOTFPolicy.
+"""
+
+import argparse
+import pickle
+import time
+import tracemalloc
+from typing import Dict
+
+import numpy as np
+
+COMPACT_MODES = ("none", "uint8", "float16")
+# the columns of a sample batch that the learner does not need
+DROPPED_COLUMNS = ("new_obs",)
+# dtypes of encoded observations, which no loss input may have
+ENCODED_DTYPES = (np.dtype(np.uint8), np.dtype(np.float16))
+# upper bound of every quantized feature group, beyond which values are clipped.
+# Vehicles may drive faster than the speed limit the speeds are normalized by, and
+# edge numbers are not normalized to 1 for every network
+QUANTIZATION_RANGES = {
+    "speed": 2.0,
+    "distance": 1.0,
+    "edge_number": 4.0,
+    "density": 1.0,
+    "velocity": 2.0,
+}
+
+
+class ObservationCodec:
+    """ Encoding of MultiTrafficLightGridPOEnv observations with four local edges and
+    lights, i.e. 3 * 4 * num_observed vehicle features, 8 edge features and 10 light
+    flags
+    """
+
+    def __init__(self, obs_dim: int, mode: str):
+        num_observed, remainder = divmod(obs_dim - 18, 12)
+        if remainder or num_observed < 1:
+            raise ValueError(f"{obs_dim} is not the size of a traffic grid observation.")
+        self.obs_dim = obs_dim
+        self.mode = mode
+        vehicles = 4 * num_observed
+        # the column of every feature group in the observation
+        self.groups = {
+            "speed": np.arange(vehicles),
+            "distance": np.arange(vehicles, 2 * vehicles),
+            "edge_number": np.arange(2 * vehicles, 3 * vehicles),
+            "density": np.arange(3 * vehicles, 3 * vehicles + 4),
+            "velocity": np.arange(3 * vehicles + 4, 3 * vehicles + 8),
+            "lights": np.arange(3 * vehicles + 8, obs_dim),
+        }
+        names_8 = ("speed", "distance", "density", "velocity")
+        self.bytes_8 = np.concatenate([self.groups[name] for name in names_8])
+        self.scale_8 = np.concatenate(
+            [np.full(len(self.groups[name]), QUANTIZATION_RANGES[name]) for name in names_8]
+        ).astype(np.float32)
+        self.bytes_16 = self.groups["edge_number"]
+        self.scale_16 = np.float32(QUANTIZATION_RANGES["edge_number"])
+        self.bits = self.groups["lights"]
+
+    @staticmethod
+    def mode_of(codes: np.ndarray) -> str:
+        """ @returns the mode that encoded codes, or "none" for plain observations """
+        if codes.dtype == np.uint8:
+            return "uint8"
+        if codes.dtype == np.float16:
+            return "float16"
+        return "none"
+
+    def encode(self, obs: np.ndarray) -> np.ndarray:
+        if self.mode == "float16":
+            return obs.astype(np.float16)
+        scaled_8 = np.clip(obs[:, self.bytes_8] / self.scale_8, 0, 1)
+        bytes_8 = np.rint(scaled_8 * 255).astype(np.uint8)
+        scaled_16 = np.clip(obs[:, self.bytes_16] / self.scale_16, 0, 1)
+        bytes_16 = np.ascontiguousarray(np.rint(scaled_16 * 65535).astype("<u2")).view(np.uint8)
+        bits = np.packbits(obs[:, self.bits] > 0.5, axis=1)
+        return np.concatenate([bytes_8, bytes_16, bits], axis=1)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        if self.mode == "float16":
+            return codes.astype(np.float32)
+        obs = np.empty((len(codes), self.obs_dim), dtype=np.float32)
+        n_8, n_16 = len(self.bytes_8), 2 * len(self.bytes_16)
+        obs[:, self.bytes_8] = codes[:, :n_8] * (self.scale_8 / 255)
+        obs[:, self.bytes_16] = np.ascontiguousarray(codes[:, n_8 : n_8 + n_16]).view(
+            "<u2"
+        ) * (self.scale_16 / 65535)
+        obs[:, self.bits] = np.unpackbits(codes[:, n_8 + n_16 :], axis=1)[:, : len(self.bits)]
+        return obs
+
+
+def encode_columns(data: dict, codec: ObservationCodec):
+    """ Encodes the obs column of a batch's columns in place and drops the columns
+    the learner does not need
+    """
+    data["obs"] = codec.encode(data["obs"])
+    for column in DROPPED_COLUMNS:
+        data.pop(column, None)
+
+
+def decode_columns(data, obs_dim: int):
+    """ Decodes the obs column of a batch in place if it is encoded """
+    mode = ObservationCodec.mode_of(data["obs"])
+    if mode != "none":
+        data["obs"] = ObservationCodec(obs_dim, mode).decode(data["obs"])
+
+
+def _policy_batches(samples) -> Dict:
+    """ @returns the batches of a MultiAgentBatch, or a SampleBatch as the only one """
+    return getattr(samples, "policy_batches", {None: samples})
+
+
+def make_encoder(mode: str):
+    """ @returns an on_sample_end callback that encodes the batches of a worker """
+    codecs = {}
+
+    def on_sample_end(info):
+        for batch in _policy_batches(info["samples"]).values():
+            obs = batch.data["obs"]
+            if obs.dtype != np.float32 and obs.dtype != np.float64:
+                continue
+            if obs.shape[1] not in codecs:
+                codecs[obs.shape[1]] = ObservationCodec(obs.shape[1], mode)
+            encode_columns(batch.data, codecs[obs.shape[1]])
+
+    return on_sample_end
+
+
+class CompactBatchMixin:
+    """ Decodes batches encoded by make_encoder before the policy's loss sees them.
+
+    RolloutWorker.learn_on_batch trains TF policies through _build_learn_on_batch
+    without calling their learn_on_batch, and the multi-GPU optimizer loads batches
+    on its own, but all of them take the loss inputs from _get_loss_inputs_dict.
+    Decoding replaces the obs column in place, so the next SGD iteration over the
+    same batch finds float32 observations and does not decode again.
+    """
+
+    def _get_loss_inputs_dict(self, batch, *args, **kwargs):
+        decode_columns(batch, self.observation_space.shape[0])
+        feed_dict = super()._get_loss_inputs_dict(batch, *args, **kwargs)
+        for value in feed_dict.values():
+            assert getattr(value, "dtype", None) not in ENCODED_DTYPES, (
+                "An encoded sample batch column reached the loss."
+            )
+        return feed_dict
+
+
+def compact_policy(policy_cls):
+    """ @returns policy_cls, decoding compact batches before learning on them """
+    return type(f"Compact{policy_cls.__name__}", (CompactBatchMixin, policy_cls), {})
+
+
+def sample_batch_columns(obs: np.ndarray, network, seed: int = 0) -> dict:
+    """ @returns the columns of the policy batch a PPO worker sends for obs, with
+    actions sampled from network and random rewards and advantages
+    """
+    rng = np.random.RandomState(seed)
+    n = len(obs)
+    logits = network.logits(obs).astype(np.float32)
+    mean, log_std = np.split(logits, 2, axis=1)
+    actions = (mean + np.exp(log_std) * rng.randn(*mean.shape)).astype(np.float32)
+    advantages = rng.randn(n).astype(np.float32)
+    return {
+        "t": np.arange(n),
+        "eps_id": np.zeros(n, dtype=np.int64),
+        "agent_index": np.arange(n) % 9,
+        "obs": obs,
+        "actions": actions,
+        "rewards": rng.randn(n).astype(np.float32),
+        "prev_actions": np.zeros_like(actions),
+        "prev_rewards": np.zeros(n, dtype=np.float32),
+        "dones": np.zeros(n, dtype=bool),
+        "new_obs": np.roll(obs, -1, axis=0),
+        "vf_preds": rng.randn(n).astype(np.float32),
+        "behaviour_logits": logits,
+        "action_prob": np.exp(_gaussian_logp(actions, mean, log_std)).astype(np.float32),
+        "advantages": (advantages - advantages.mean()) / advantages.std(),
+        "value_targets": rng.randn(n).astype(np.float32),
+        "unroll_id": np.zeros(n, dtype=np.int64),
+    }
+
+
+def _gaussian_logp(actions, mean, log_std) -> np.ndarray:
+    return -np.sum(
+        0.5 * np.square((actions - mean) / np.exp(log_std)) + 0.5 * np.log(2 * np.pi) + log_std,
+        axis=1,
+    )
+
+
+def ppo_stats(network, data: dict, clip_param: float = 0.3, kl_coeff: float = 0.2) -> dict:
+    """ @returns the surrogate policy loss, the total loss without the value function
+    term and the mean KL of RLlib's PPO loss, as the first update on the batch
+    reports them, i.e. before the weights change
+    """
+    # in double precision, to tell the KL of small drifts from rounding
+    mean, log_std = np.split(network.logits(data["obs"]).astype(np.float64), 2, axis=1)
+    behaviour_mean, behaviour_log_std = np.split(
+        data["behaviour_logits"].astype(np.float64), 2, axis=1
+    )
+    ratio = np.exp(
+        _gaussian_logp(data["actions"], mean, log_std)
+        - _gaussian_logp(data["actions"], behaviour_mean, behaviour_log_std)
+    )
+    advantages = data["advantages"]
+    surrogate = np.minimum(
+        advantages * ratio, advantages * np.clip(ratio, 1 - clip_param, 1 + clip_param)
+    )
+    # DiagGaussian.kl of the behaviour distribution to the current one
+    kl = np.sum(
+        log_std
+        - behaviour_log_std
+        + (np.exp(2 * behaviour_log_std) + np.square(behaviour_mean - mean))
+        / (2 * np.exp(2 * log_std))
+        - 0.5,
+        axis=1,
+    )
+    policy_loss = -float(surrogate.mean())
+    return {
+        "policy_loss": policy_loss,
+        "total_loss": policy_loss + kl_coeff * float(kl.mean()),
+        "kl": float(kl.mean()),
+        "max_ratio_error": float(np.abs(ratio - 1).max()),
+    }
+
+
+def validate_ppo(network, obs: np.ndarray, mode: str) -> dict:
+    """ @returns ppo_stats of a batch as sent and after decoding, and for uint8 also
+    undecoded, i.e. with the codes fed to the loss as if they were observations
+    """
+    data = sample_batch_columns(obs, network)
+    codec = ObservationCodec(obs.shape[1], mode)
+    codes = codec.encode(obs)
+    stats = {
+        "none": ppo_stats(network, data),
+        mode: ppo_stats(network, dict(data, obs=codec.decode(codes))),
+    }
+    if mode == "uint8":
+        stats["undecoded"] = ppo_stats(network, dict(data, obs=codes.astype(np.float32)))
+    return stats
+
+
+def rllib_update_check(obs: np.ndarray, mode: str, seed: int = 0) -> dict:
+    """ Runs the first PPO update of RLlib's PPOTFPolicy on a batch of obs the way
+    RolloutWorker.learn_on_batch does, once as sent and once encoded by make_encoder
+    and decoded by compact_policy, from the same weights
+
+    @returns the learner stats of both updates, by mode
+    """
+    import gym
+    import tensorflow as tf
+    from ray.rllib.agents.ppo.ppo import DEFAULT_CONFIG
+    from ray.rllib.agents.ppo.ppo_policy import PPOTFPolicy
+    from ray.rllib.policy.sample_batch import MultiAgentBatch, SampleBatch
+    from ray.rllib.utils.tf_run_builder import TFRunBuilder
+
+    obs_space = gym.spaces.Box(low=0.0, high=1.0, shape=(obs.shape[1],), dtype=np.float32)
+    act_space = gym.spaces.Box(low=-1.0, high=1.0, shape=(1,), dtype=np.float32)
+    config = dict(DEFAULT_CONFIG, model=dict(DEFAULT_CONFIG["model"], fcnet_hiddens=[32, 32]))
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.set_random_seed(seed)
+        session = tf.Session(graph=graph)
+        with session.as_default():
+            policy = compact_policy(PPOTFPolicy)(obs_space, act_space, config)
+
+    n = len(obs)
+    rng = np.random.RandomState(seed)
+    actions, _, extra = policy.compute_actions(obs)
+    batch = SampleBatch(
+        dict(
+            extra,
+            obs=obs,
+            new_obs=np.roll(obs, -1, axis=0),
+            actions=actions,
+            rewards=rng.randn(n).astype(np.float32),
+            dones=np.arange(n) == n - 1,
+            prev_actions=np.zeros_like(actions),
+            prev_rewards=np.zeros(n, dtype=np.float32),
+        )
+    )
+    batch = policy.postprocess_trajectory(batch)
+    weights = policy.get_weights()
+    stats = {}
+    for name in ("none", mode):
+        samples = MultiAgentBatch({"av": batch.copy()}, n)
+        if name != "none":
+            make_encoder(name)({"samples": samples})
+        policy.set_weights(weights)
+        builder = TFRunBuilder(policy._sess, "learn_on_batch")
+        fetches = builder.get(policy._build_learn_on_batch(builder, samples.policy_batches["av"]))
+        stats[name] = fetches.get("learner_stats", fetches)
+    return stats
+
+
+def learner_memory(data: dict, mode: str, queued: int) -> int:
+    """ @returns the bytes the learner holds while queued batches of data wait for
+    training, one of them decoded, as APPO's learner queue holds them
+    """
+    batches = [{column: np.copy(value) for column, value in data.items()} for _ in range(queued)]
+    if mode != "none":
+        codec = ObservationCodec(data["obs"].shape[1], mode)
+        for batch in batches:
+            encode_columns(batch, codec)
+    resident = sum(value.nbytes for batch in batches for value in batch.values())
+    tracemalloc.start()
+    try:
+        decode_columns(batches[0], data["obs"].shape[1])
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return resident + peak
+
+
+def measure(obs: np.ndarray, mode: str, network, queued: int = 16) -> dict:
+    """ @returns the bytes per sample of the observations and of a pickled sample
+    batch before and after encoding, the learner memory per sample, the encoding and
+    decoding time per sample, the max error of every feature group, the max change of
+    the network's outputs on the decoded observations and validate_ppo
+    """
+    codec = ObservationCodec(obs.shape[1], mode)
+    start = time.perf_counter()
+    codes = codec.encode(obs)
+    encode_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    decoded = codec.decode(codes)
+    decode_seconds = time.perf_counter() - start
+    errors = np.abs(decoded - obs)
+
+    data = sample_batch_columns(obs, network)
+    encoded = dict(data)
+    encode_columns(encoded, codec)
+    n = len(obs)
+    result = {
+        "mode": mode,
+        "obs_bytes_before": obs.shape[1] * 4,
+        "obs_bytes_after": codes.nbytes // n,
+        "batch_bytes_before": len(pickle.dumps(data, protocol=4)) / n,
+        "batch_bytes_after": len(pickle.dumps(encoded, protocol=4)) / n,
+        "learner_bytes_before": learner_memory(data, "none", queued) / (queued * n),
+        "learner_bytes_after": learner_memory(data, mode, queued) / (queued * n),
+        "encode_us": encode_seconds / n * 1e6,
+        "decode_us": decode_seconds / n * 1e6,
+        "max_action_drift": float(np.abs(network(decoded) - network(obs)).max()),
+        "ppo": validate_ppo(network, obs, mode),
+    }
+    for name, columns in codec.groups.items():
+        result[f"max_error_{name}"] = float(errors[:, columns].max())
+    return result
+
+
+if __name__ == "__main__":
+    import benchmark
+    from policy_server import PolicyNetwork, PolicyServer
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[3, 10, 30],
+                        help="Side lengths of the grids to take observations from")
+    parser.add_argument("--steps", type=int, default=20,
+                        help="Steps of observations per grid")
+    parser.add_argument("--checkpoint", help="Policy to measure the action drift of, "
+                        "a random network of the trained architecture by default")
+    parser.add_argument("--queued", type=int, default=16,
+                        help="Batches waiting for the learner, APPO's learner queue size")
+    parser.add_argument("--rllib", action="store_true",
+                        help="Also run the first PPO update with RLlib's PPOTFPolicy")
+    args = parser.parse_args()
+
+    benchmark.install_stand_in()
+    from basic_env import BasicEnv
+
+    for size in args.sizes:
+        env = benchmark.make_env(BasicEnv, size)
+        observations = []
+        for _ in range(args.steps):
+            # moves the stand-in's parked vehicles to fresh random edges and positions
+            env.k.vehicle = benchmark.StandInVehicles(env.k.network.get_edge_list(), env._rng)
+            env.direction = env._rng.randint(0, 2, env.direction.shape).astype(float)
+            observations.extend(env.get_state().values())
+        obs = np.array(observations, dtype=np.float32)
+        if args.checkpoint:
+            (network,) = PolicyServer.from_checkpoint(args.checkpoint).networks.values()
+        else:
+            network = PolicyNetwork.random(obs.shape[1])
+        for mode in COMPACT_MODES[1:]:
+            result = measure(obs, mode, network, args.queued)
+            errors = ", ".join(
+                f"{key[len('max_error_'):]} {value:.1e}"
+                for key, value in result.items()
+                if key.startswith("max_error_")
+            )
+            print(
+                f"{size:>3}x{size:<3} {mode:>7}: obs {result['obs_bytes_before']} -> "
+                f"{result['obs_bytes_after']} bytes/sample, pickled batch "
+                f"{result['batch_bytes_before']:.0f} -> {result['batch_bytes_after']:.0f}, "
+                f"learner {result['learner_bytes_before']:.0f} -> "
+                f"{result['learner_bytes_after']:.0f}, encode {result['encode_us']:.2f} us, "
+                f"decode {result['decode_us']:.2f} us"
+            )
+            print(f"          action drift {result['max_action_drift']:.1e}; max error {errors}")
+            for name, stats in result["ppo"].items():
+                print(
+                    f"          PPO {name:>9}: total_loss {stats['total_loss']:+.5f}, "
+                    f"policy_loss {stats['policy_loss']:+.5f}, kl {stats['kl']:.2e}, "
+                    f"max |ratio - 1| {stats['max_ratio_error']:.2e}"
+                )
+            if args.rllib:
+                for name, stats in rllib_update_check(obs, mode).items():
+                    print(
+                        f"          RLlib {name:>7}: "
+                        + ", ".join(
+                            f"{key} {stats[key]:.5g}"
+                            for key in ("total_loss", "policy_loss", "vf_loss", "kl")
+                        )
+                    )
@@ -0,0 +1,270 @@
+"""Grid size curriculum: train on small grids first and warm-start larger ones.
+
+All agents observe a fixed neighborhood, so the policies trained on a 3x3 grid have
+the shapes a 10x10 grid needs. Every stage trains one grid size until the mean
+episode reward plateaus, saves a checkpoint and hands its weights to the next,
+larger stage. The last stage trains until it plateaus too.
+
+    python curriculum.py --stages 3x3 5x5 10x10 --baseline --report curriculum.json
+
+Every stage reports its wall-clock time and samples. With --baseline, the largest
+grid is then also trained from scratch until it reaches the reward the curriculum
+ended with, and every stage reports the time and samples the curriculum saved so
+far against that. --baseline_report reuses the baseline of a previous report.
+"""
+
+import argparse
+import json
+import os
+import time
+from typing import List, Optional
+
+import numpy as np
+
+from run_experiment import (ENV_SHARING, N_CPUS, N_ROLLOUTS, get_agent_class,
+                            make_flow_params, setup_exps_APPO, setup_exps_PPO)
+
+
+class PlateauDetector:
+    """ Detects when the reward of a stage stops improving.
+
+    The reward has plateaued when the mean of the last window iterations improved
+    by less than min_improvement, relative to its magnitude, on the mean of the
+    window before, and at least min_iterations have run.
+    """
+
+    def __init__(self, window: int = 10, min_improvement: float = 0.01, min_iterations: int = 20):
+        self.window = window
+        self.min_improvement = min_improvement
+        self.min_iterations = max(min_iterations, 2 * window)
+        self.rewards: List[float] = []
+
+    def update(self, reward: float) -> bool:
+        """ @returns whether the reward has plateaued once reward is added """
+        if not np.isnan(reward):
+            self.rewards.append(reward)
+        if len(self.rewards) < self.min_iterations:
+            return False
+        current = np.mean(self.rewards[-self.window :])
+        previous = np.mean(self.rewards[-2 * self.window : -self.window])
+        return current - previous < self.min_improvement * max(abs(previous), 1e-8)
+
+    def smoothed(self) -> float:
+        """ @returns the mean reward of the last window iterations """
+        return float(np.mean(self.rewards[-self.window :])) if self.rewards else np.nan
+
+
+def make_trainer(args, rows: int, cols: int, version: int):
+    """ @returns a trainer for a rows x cols grid, set up like run_experiment.py """
+    flow_params = make_flow_params(
+        rows,
+        cols,
+        args.inflow_rate,
+        sharing=ENV_SHARING[args.env],
+        colight_k_nearest_neighbords=args.k_nearest,
+        colight_temperature=args.temp,
+        neighbor_weight=args.neighbor_weight,
+        simulator=args.simulator,
+    )
+    setup_exps = setup_exps_APPO if args.algo == "APPO" else setup_exps_PPO
+    alg_run, env_name, config = setup_exps(
+        flow_params,
+        num_workers=args.num_workers,
+        lr=args.lr,
+        version=version,
+        policy_classes=args.policy_classes,
+    )
+    # trained directly instead of through tune, which would resolve the lr search and
+    # unwrap the functions
+    config["lr"] = args.lr
+    config["callbacks"] = {
+        name: getattr(callback, "func", callback)
+        for name, callback in config["callbacks"].items()
+    }
+    multiagent = config["multiagent"]
+    multiagent["policy_mapping_fn"] = getattr(
+        multiagent["policy_mapping_fn"], "func", multiagent["policy_mapping_fn"]
+    )
+    return get_agent_class(alg_run)(env=env_name, config=config)
+
+
+def transfer_weights(weights: dict, trainer):
+    """ Loads the weights of the policies the previous stage trained into trainer and
+    its rollout workers
+    """
+    import ray
+
+    local_worker = trainer.workers.local_worker()
+    own = local_worker.get_weights()
+    shared = {policy_id: weights[policy_id] for policy_id in own if policy_id in weights}
+    missing = set(own) - set(shared)
+    if missing:
+        print(f"Policies {sorted(missing)} start from scratch, the previous stage had none.")
+    local_worker.set_weights(shared)
+    shared_id = ray.put(shared)
+    ray.get([worker.set_weights.remote(shared_id) for worker in trainer.workers.remote_workers()])
+
+
+def train_stage(
+    trainer, detector: PlateauDetector, max_iterations: int, target: Optional[float] = None
+) -> dict:
+    """ Trains until the reward plateaus, reaches target or max_iterations ran
+
+    @returns the wall-clock seconds, env steps and iterations it took and the final
+    smoothed reward
+    """
+    start = time.perf_counter()
+    timesteps = 0
+    iterations = 0
+    while iterations < max_iterations:
+        result = trainer.train()
+        iterations += 1
+        timesteps = result["timesteps_total"]
+        reward = result["episode_reward_mean"]
+        done = detector.update(reward)
+        print(
+            f"  iteration {iterations}: reward {reward:.2f}, "
+            f"smoothed {detector.smoothed():.2f}, {timesteps} steps",
+            flush=True,
+        )
+        if target is not None:
+            if detector.smoothed() >= target:
+                break
+        elif done:
+            break
+    return {
+        "seconds": time.perf_counter() - start,
+        "timesteps": int(timesteps),
+        "iterations": iterations,
+        "reward": detector.smoothed(),
+    }
+
+
+def parse_size(size: str):
+    rows, _, cols = size.partition("x")
+    return int(rows), int(cols or rows)
+
+
+def run_curriculum(args) -> List[dict]:
+    """ @returns the report of every stage """
+    weights = None
+    reports = []
+    for version, size in enumerate(args.stages):
+        rows, cols = parse_size(size)
+        print(f"Stage {version}: {rows}x{cols}", flush=True)
+        trainer = make_trainer(args, rows, cols, version)
+        if weights is not None:
+            transfer_weights(weights, trainer)
+        detector = PlateauDetector(args.window, args.min_improvement, args.min_iterations)
+        report = train_stage(trainer, detector, args.max_iterations)
+        report.update(
+            grid=size,
+            agent_steps=report["timesteps"] * rows * cols,
+            checkpoint=trainer.save(os.path.join(args.checkpoint_dir, f"stage_{version}_{size}")),
+        )
+        weights = trainer.workers.local_worker().get_weights()
+        trainer.stop()
+        reports.append(report)
+    return reports
+
+
+def run_baseline(args, target: float) -> dict:
+    """ Trains the largest grid from scratch until it reaches target """
+    rows, cols = parse_size(args.stages[-1])
+    print(f"Baseline: {rows}x{cols} from scratch", flush=True)
+    trainer = make_trainer(args, rows, cols, len(args.stages))
+    detector = PlateauDetector(args.window, args.min_improvement, args.min_iterations)
+    baseline = train_stage(trainer, detector, args.baseline_iterations, target)
+    trainer.stop()
+    baseline.update(
+        grid=args.stages[-1],
+        agent_steps=baseline["timesteps"] * rows * cols,
+        reached_target=bool(baseline["reward"] >= target),
+    )
+    return baseline
+
+
+def add_savings(reports: List[dict], baseline: dict):
+    """ Adds the seconds and samples saved so far against the baseline to every stage """
+    seconds = timesteps = agent_steps = 0
+    for report in reports:
+        seconds += report["seconds"]
+        timesteps += report["timesteps"]
+        agent_steps += report["agent_steps"]
+        report["seconds_saved"] = baseline["seconds"] - seconds
+        report["timesteps_saved"] = baseline["timesteps"] - timesteps
+        report["agent_steps_saved"] = baseline["agent_steps"] - agent_steps
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=__doc__.split("\n")[0],
+        epilog=__doc__.split("\n\n", 1)[1],
+    )
+    parser.add_argument("--stages", nargs="+", default=["3x3", "5x5", "10x10"],
+                        help="Grid sizes as ROWSxCOLS, smallest first")
+    parser.add_argument("--env", default="BasicEnv", choices=list(ENV_SHARING))
+    parser.add_argument("--algo", default="PPO", choices=["PPO", "APPO"])
+    parser.add_argument("--inflow_rate", type=int, default=300)
+    parser.add_argument("--k_nearest", type=int, default=5)
+    parser.add_argument("--temp", type=float, default=0.5)
+    parser.add_argument("--neighbor_weight", type=float, default=0.1)
+    parser.add_argument("--lr", type=float, default=1e-4)
+    parser.add_argument("--policy_classes", default="single")
+    parser.add_argument("--simulator", default="traci", choices=["traci", "stub"])
+    parser.add_argument("--num_workers", type=int, default=min(N_CPUS, N_ROLLOUTS))
+    parser.add_argument("--num_cpus", type=int, help="CPUs given to ray")
+    parser.add_argument("--window", type=int, default=10,
+                        help="Iterations averaged by the plateau detection")
+    parser.add_argument("--min_improvement", type=float, default=0.01,
+                        help="Relative improvement between windows below which a "
+                        "stage has plateaued")
+    parser.add_argument("--min_iterations", type=int, default=20,
+                        help="Iterations every stage trains at least")
+    parser.add_argument("--max_iterations", type=int, default=500,
+                        help="Iterations after which a stage is promoted anyway")
+    parser.add_argument("--baseline", action="store_true",
+                        help="Also train the largest grid from scratch to measure savings")
+    parser.add_argument("--baseline_iterations", type=int, default=2000,
+                        help="Iterations the baseline may take to reach the curriculum")
+    parser.add_argument("--baseline_report", help="Report of a previous run to take "
+                        "the baseline from")
+    parser.add_argument("--checkpoint_dir", default=os.path.expanduser("~/ray_results/curriculum"))
+    parser.add_argument("--report", help="JSON file to write the stage reports to")
+    args = parser.parse_args()
+
+    import ray
+
+    ray.init(num_cpus=args.num_cpus or args.num_workers + 1)
+    stages = run_curriculum(args)
+
+    baseline = None
+    if args.baseline_report:
+        with open(args.baseline_report, "r") as f:
+            baseline = json.load(f)["baseline"]
+    elif args.baseline:
+        baseline = run_baseline(args, stages[-1]["reward"])
+    if baseline is not None:
+        add_savings(stages, baseline)
+
+    print(f"\n{'stage':>8} {'iterations':>10} {'seconds':>10} {'steps':>10} {'reward':>10} "
+          f"{'s saved':>10} {'steps saved':>12}")
+    for report in stages:
+        print(
+            f"{report['grid']:>8} {report['iterations']:>10} {report['seconds']:10.0f} "
+            f"{report['timesteps']:>10} {report['reward']:10.2f} "
+            f"{report.get('seconds_saved', np.nan):10.0f} "
+            f"{report.get('timesteps_saved', np.nan):>12}"
+        )
+    if baseline is not None:
+        print(
+            f"baseline {baseline['grid']}: {baseline['iterations']} iterations, "
+            f"{baseline['seconds']:.0f}s, {baseline['timesteps']} steps, reward "
+            f"{baseline['reward']:.2f}" + ("" if baseline["reached_target"] else
+            ", did not reach the curriculum's reward")
+        )
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump({"stages": stages, "baseline": baseline}, f, indent=4)
+    ray.shutdown()
@@ -0,0 +1,258 @@
+"""Parallel evaluation of trained policies over a matrix of scenarios.
+
+Every combination of --envs, --sizes, --inflow_rates and --seeds is one scenario. The
+traffic of an episode does not depend on how rewards are shared, so the scenarios of
+envs evaluated with the same checkpoint share one rollout, which is then rescored
+with the sharing strategy of every env. Rollouts are spread over a process pool,
+one simulator per process, and every result is printed and appended to --output as
+soon as it completes, along with the running mean raw reward of its scenario.
+
+    python evaluate.py ~/ray_results/<exp>/<trial>/checkpoint_500 \
+        --envs BasicEnv RewardSharingEnvKNN --sizes 3x3 5x5 --inflow_rates 300 600 \
+        --seeds 0 1 2 3 --output eval.jsonl
+
+With --env_checkpoints, every env is evaluated with the policy trained for it, e.g.
+--env_checkpoints BasicEnv=<path> RewardSharingEnvKNN=<path>.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from run_experiment import ENV_SHARING, make_flow_params
+
+# PolicyServer of every checkpoint loaded by this process
+_servers = {}
+
+
+def parse_size(size: str) -> Tuple[int, int]:
+    rows, _, cols = size.partition("x")
+    return int(rows), int(cols or rows)
+
+
+def make_tasks(args) -> List[dict]:
+    """ @returns one rollout task per checkpoint, grid size, inflow rate and seed, each
+    listing the envs it is scored for
+    """
+    checkpoints = {env: args.checkpoint for env in args.envs}
+    for pair in args.env_checkpoints:
+        env, _, path = pair.partition("=")
+        if env not in ENV_SHARING:
+            raise ValueError(f"Unknown env {env} in --env_checkpoints.")
+        checkpoints[env] = path
+    missing = [env for env in args.envs if checkpoints[env] is None]
+    if missing and not args.random_weights:
+        raise ValueError(f"No checkpoint for {missing}.")
+
+    envs_by_checkpoint = defaultdict(list)
+    for env in args.envs:
+        envs_by_checkpoint[checkpoints[env]].append(env)
+    tasks = []
+    for (checkpoint, envs), size, inflow_rate, seed in itertools.product(
+        envs_by_checkpoint.items(), args.sizes, args.inflow_rates, args.seeds
+    ):
+        rows, cols = parse_size(size)
+        tasks.append(
+            {
+                "checkpoint": checkpoint,
+                "envs": envs,
+                "num_rows": rows,
+                "num_cols": cols,
+                "inflow_rate": inflow_rate,
+                "seed": seed,
+                "simulator": args.simulator,
+                "policy_classes": args.policy_classes,
+                "neighbor_weight": args.neighbor_weight,
+                "k_nearest": args.k_nearest,
+                "temp": args.temp,
+                "cache_dir": args.cache_dir,
+            }
+        )
+    return tasks
+
+
+def _policy_server(checkpoint, policy_classes):
+    from policy_server import DEFAULT_POLICY, PolicyNetwork, PolicyServer
+
+    if checkpoint not in _servers:
+        if checkpoint is None:
+            # flow's observation size with the default num_observed and local edges
+            _servers[checkpoint] = PolicyServer({DEFAULT_POLICY: PolicyNetwork.random(42)})
+        else:
+            _servers[checkpoint] = PolicyServer.from_checkpoint(checkpoint, policy_classes)
+    return _servers[checkpoint]
+
+
+def run_task(task: dict) -> List[dict]:
+    """ Records one episode and scores it for every env of the task
+
+    @returns one result per env with the episode's raw and shared reward totals and
+    their per-intersection sums, by agent id
+    """
+    from flow.utils.registry import make_create_env
+    from neighborhood import GridNeighborhood
+    from reward_sharing import make_strategy
+    from trajectory_cache import (TrajectoryCache, cached_trajectory, rescore,
+                                  record_seeded)
+
+    rows, cols = task["num_rows"], task["num_cols"]
+    start = time.perf_counter()
+    server = _policy_server(task["checkpoint"], task["policy_classes"])
+
+    def compute_actions(obs):
+        return server.compute_actions(obs, rows, cols)
+
+    flow_params = make_flow_params(
+        rows,
+        cols,
+        task["inflow_rate"],
+        simulator=task["simulator"],
+        neighbor_weight=task["neighbor_weight"],
+        colight_k_nearest_neighbords=task["k_nearest"],
+        colight_temperature=task["temp"],
+    )
+    create_env, _ = make_create_env(params=flow_params)
+    if task["cache_dir"] and task["checkpoint"] is not None:
+        trajectory = cached_trajectory(
+            TrajectoryCache(task["cache_dir"]),
+            flow_params,
+            task["seed"],
+            task["checkpoint"],
+            task["policy_classes"],
+            create_env,
+            compute_actions,
+        )
+    else:
+        trajectory = record_seeded(flow_params, task["seed"], create_env, compute_actions)
+    seconds = time.perf_counter() - start
+
+    additional_params = flow_params["env"].additional_params
+    neighborhood = GridNeighborhood(rows, cols)
+    raw_by_agent = trajectory.raw_rewards.sum(axis=0)
+    results = []
+    for env in task["envs"]:
+        shared = rescore(
+            trajectory, make_strategy(ENV_SHARING[env], additional_params), neighborhood
+        )
+        results.append(
+            {
+                "env": env,
+                "checkpoint": task["checkpoint"],
+                "num_rows": rows,
+                "num_cols": cols,
+                "inflow_rate": task["inflow_rate"],
+                "seed": task["seed"],
+                "steps": len(trajectory.raw_rewards),
+                "raw_reward": float(raw_by_agent.sum()),
+                "shared_reward": float(shared.sum()),
+                "raw_reward_by_agent": raw_by_agent.tolist(),
+                "shared_reward_by_agent": shared.sum(axis=0).tolist(),
+                "seconds": seconds,
+            }
+        )
+    return results
+
+
+def scenario(result: dict) -> tuple:
+    return result["env"], result["num_rows"], result["num_cols"], result["inflow_rate"]
+
+
+def summarize(results: List[dict]) -> Dict[tuple, dict]:
+    """ @returns the mean and std over seeds of the raw reward of every scenario, and
+    of the mean and worst intersection
+    """
+    grouped = defaultdict(list)
+    for result in results:
+        grouped[scenario(result)].append(result)
+    summary = {}
+    for key, group in sorted(grouped.items()):
+        raw = np.array([result["raw_reward"] for result in group])
+        by_agent = np.array([result["raw_reward_by_agent"] for result in group])
+        summary[key] = {
+            "seeds": len(group),
+            "raw_reward_mean": float(raw.mean()),
+            "raw_reward_std": float(raw.std()),
+            "intersection_mean": float(by_agent.mean()),
+            "intersection_worst": float(by_agent.min(axis=1).mean()),
+        }
+    return summary
+
+
+def evaluate(tasks: List[dict], processes: int, output: str = None) -> List[dict]:
+    """ Runs the tasks on a pool of processes, streaming every result as it completes """
+    results = []
+    running = defaultdict(list)
+    out = open(output, "a") if output else None
+    try:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = [pool.submit(run_task, task) for task in tasks]
+            for done, future in enumerate(as_completed(futures), 1):
+                for result in future.result():
+                    results.append(result)
+                    raw = running[scenario(result)]
+                    raw.append(result["raw_reward"])
+                    env, rows, cols, inflow_rate = scenario(result)
+                    print(
+                        f"[{done}/{len(tasks)}] {env} {rows}x{cols} inflow {inflow_rate} "
+                        f"seed {result['seed']}: raw_reward {result['raw_reward']:.2f}, "
+                        f"mean {np.mean(raw):.2f} over {len(raw)} seeds "
+                        f"({result['seconds']:.1f}s)",
+                        flush=True,
+                    )
+                    if out is not None:
+                        out.write(json.dumps(result) + "\n")
+                        out.flush()
+    finally:
+        if out is not None:
+            out.close()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=__doc__.split("\n")[0],
+        epilog=__doc__.split("\n\n", 1)[1],
+    )
+    parser.add_argument("checkpoint", nargs="?",
+                        help="checkpoint_<n> directory of the policy to evaluate")
+    parser.add_argument("--env_checkpoints", nargs="+", default=[], metavar="ENV=PATH",
+                        help="Checkpoint of every env that was trained separately")
+    parser.add_argument("--envs", nargs="+", default=["BasicEnv"], choices=list(ENV_SHARING))
+    parser.add_argument("--sizes", nargs="+", default=["3x3"],
+                        help="Grid sizes as ROWSxCOLS")
+    parser.add_argument("--inflow_rates", type=int, nargs="+", default=[300])
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0, 1, 2])
+    parser.add_argument("--processes", type=int, default=os.cpu_count(),
+                        help="Rollouts run in parallel, one simulator each")
+    parser.add_argument("--simulator", default="traci", choices=["traci", "stub"])
+    parser.add_argument("--policy_classes", default="single",
+                        help="--policy_classes the checkpoints were trained with")
+    parser.add_argument("--neighbor_weight", type=float, default=0.1)
+    parser.add_argument("--k_nearest", type=int, default=5)
+    parser.add_argument("--temp", type=float, default=0.5)
+    parser.add_argument("--cache_dir",
+                        help="Trajectory cache, see trajectory_cache.TrajectoryCache")
+    parser.add_argument("--output", help="JSON lines file the results are appended to")
+    parser.add_argument("--random_weights", action="store_true",
+                        help="Evaluate a random policy where no checkpoint is given")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    results = evaluate(make_tasks(args), args.processes, args.output)
+    print(f"\n{len(results)} results in {time.perf_counter() - start:.1f}s")
+    print(f"{'env':>24} {'grid':>6} {'inflow':>6} {'seeds':>5} "
+          f"{'raw_reward':>22} {'intersection':>12} {'worst':>10}")
+    for (env, rows, cols, inflow_rate), row in summarize(results).items():
+        print(
+            f"{env:>24} {rows:>3}x{cols:<2} {inflow_rate:>6} {row['seeds']:>5} "
+            f"{row['raw_reward_mean']:12.2f} +- {row['raw_reward_std']:7.2f} "
+            f"{row['intersection_mean']:12.2f} {row['intersection_worst']:10.2f}"
+        )
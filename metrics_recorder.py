@@ -0,0 +1,104 @@
+"""Streaming per-step, per-intersection metrics written as columnar .npz shards."""
+
+import atexit
+import itertools
+import os
+import queue
+import threading
+from typing import Dict
+
+import numpy as np
+
+# per-intersection columns and their dtypes, every row is one step
+COLUMNS = {
+    "raw_reward": np.float32,
+    "shared_reward": np.float32,
+    "queue_length": np.float32,
+    "direction": np.int8,
+    "yellow": np.int8,
+}
+# numbers the recorders of a process, which has one per env
+_instances = itertools.count()
+
+
+class MetricsRecorder:
+    """ Records one row of per-intersection arrays per step and streams them to disk.
+
+    Rows go into a preallocated chunk of chunk_size steps. Full chunks are written by a
+    background thread to directory/metrics_<pid>_<instance>_<shard>.npz, where
+    instance tells apart the recorders of the envs of one process, with one
+    (steps, num_agents) array per column of COLUMNS plus "episode" and "step" arrays
+    of length steps. At
+    most max_pending chunks wait for the writer, so memory stays bounded however long
+    the run is; if the disk falls behind, record blocks instead.
+
+    Load a run with e.g.
+        shards = [np.load(path) for path in sorted(glob.glob("metrics_*.npz"))]
+    and group them by the "metrics_<pid>_<instance>" prefix to follow one env.
+    """
+
+    def __init__(
+        self, directory: str, num_agents: int, chunk_size: int = 1000, max_pending: int = 4
+    ):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.num_agents = num_agents
+        self.chunk_size = chunk_size
+        self.instance = next(_instances)
+        self._prefix = os.path.join(directory, f"metrics_{os.getpid()}_{self.instance:03d}")
+        self._shard = 0
+        self._new_chunk()
+
+        self._pending: queue.Queue = queue.Queue(maxsize=max_pending)
+        self._writer = threading.Thread(target=self._write_chunks, daemon=True)
+        self._writer.start()
+        self._closed = False
+        atexit.register(self.close)
+
+    def record(self, episode: int, step: int, **columns: np.ndarray):
+        """ Records the arrays of one step, each of length num_agents and keyed by a
+        column of COLUMNS
+        """
+        row = self._rows
+        self._chunk["episode"][row] = episode
+        self._chunk["step"][row] = step
+        for column, values in columns.items():
+            self._chunk[column][row] = values
+        self._rows += 1
+        if self._rows == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """ Hands the recorded rows to the writer thread """
+        if self._rows == 0:
+            return
+        chunk = {column: values[: self._rows] for column, values in self._chunk.items()}
+        self._pending.put((f"{self._prefix}_{self._shard:06d}.npz", chunk))
+        self._shard += 1
+        self._new_chunk()
+
+    def close(self):
+        """ Writes the remaining rows and waits for the writer to finish """
+        if self._closed:
+            return
+        self._closed = True
+        self.flush()
+        self._pending.put(None)
+        self._writer.join()
+
+    def _new_chunk(self):
+        self._chunk: Dict[str, np.ndarray] = {
+            column: np.zeros((self.chunk_size, self.num_agents), dtype=dtype)
+            for column, dtype in COLUMNS.items()
+        }
+        self._chunk["episode"] = np.zeros(self.chunk_size, dtype=np.int64)
+        self._chunk["step"] = np.zeros(self.chunk_size, dtype=np.int64)
+        self._rows = 0
+
+    def _write_chunks(self):
+        while True:
+            item = self._pending.get()
+            if item is None:
+                return
+            path, chunk = item
+            np.savez(path, **chunk)
@@ -0,0 +1,226 @@
+"""Distances and neighbors between the signalized intersections of a network."""
+
+import heapq
+from typing import List, Sequence, Tuple
+
+import numpy as np
+from scipy import sparse
+
+
+def grid_adjacency(rows: int, cols: int) -> Tuple[sparse.csr_matrix, sparse.csr_matrix]:
+    """ Builds the neighbor matrices of a rows x cols traffic light grid.
+
+    Intersection center{i} sits at row i // cols and column i % cols, the same layout
+    _get_relative_node assumes. Entry (i, j) is 1 when j is a top/bottom (vertical)
+    or left/right (horizontal) neighbor of i, so agents on the border of the grid
+    simply have fewer entries.
+
+    @returns the (vertical, horizontal) adjacency matrices in CSR format
+    """
+    num_agents = rows * cols
+    ids = np.arange(num_agents).reshape(rows, cols)
+    vertical = _symmetric_adjacency(ids[1:, :], ids[:-1, :], num_agents)
+    horizontal = _symmetric_adjacency(ids[:, 1:], ids[:, :-1], num_agents)
+    return vertical, horizontal
+
+
+def _symmetric_adjacency(
+    sources: np.ndarray, targets: np.ndarray, num_agents: int
+) -> sparse.csr_matrix:
+    sources = sources.ravel()
+    targets = targets.ravel()
+    row = np.concatenate([sources, targets])
+    col = np.concatenate([targets, sources])
+    data = np.ones(row.size)
+    return sparse.csr_matrix((data, (row, col)), shape=(num_agents, num_agents))
+
+
+class NeighborhoodIndex:
+    """ Shortest path distances between the agents of an arbitrary road network.
+
+    The network is an undirected graph over all of its nodes, weighted by edge length
+    or by 1 per edge for hop counts. agent_nodes gives the graph node of every agent id.
+    Nothing is stored per pair of agents: k nearest lists come from one Dijkstra per
+    agent that stops after k agents, so memory stays O(num_agents * k).
+    """
+
+    def __init__(self, graph: sparse.csr_matrix, agent_nodes: Sequence[int]):
+        self.graph = sparse.csr_matrix(graph)
+        self.agent_nodes = np.asarray(agent_nodes)
+        self.num_agents = len(self.agent_nodes)
+        self._agent_of_node = np.full(self.graph.shape[0], -1)
+        self._agent_of_node[self.agent_nodes] = np.arange(self.num_agents)
+
+    @staticmethod
+    def from_network(network, agent_names: List[str], metric: str = "hops"):
+        """ Builds the index of a flow network from its node and edge specs.
+
+        @param agent_names the node id of every agent, by agent id
+        @param metric "hops" to count the edges, the unit the KNN temperature_factor is
+        tuned for, or "length" to measure distances along the edges in meters
+        """
+        assert metric in ("hops", "length"), f"Unknown metric {metric}."
+        node_ids = {node["id"]: i for i, node in enumerate(network.nodes)}
+        for edge in network.edges:
+            for end in (edge["from"], edge["to"]):
+                node_ids.setdefault(end, len(node_ids))
+
+        weights = {}
+        for edge in network.edges:
+            pair = tuple(sorted((node_ids[edge["from"]], node_ids[edge["to"]])))
+            weight = float(edge["length"]) if metric == "length" else 1.0
+            weights[pair] = min(weight, weights.get(pair, np.inf))
+
+        pairs = np.array(list(weights), dtype=np.int64).reshape(-1, 2)
+        data = np.array(list(weights.values()))
+        row = np.concatenate([pairs[:, 0], pairs[:, 1]])
+        col = np.concatenate([pairs[:, 1], pairs[:, 0]])
+        graph = sparse.csr_matrix(
+            (np.concatenate([data, data]), (row, col)),
+            shape=(len(node_ids), len(node_ids)),
+        )
+        return NeighborhoodIndex(graph, [node_ids[name] for name in agent_names])
+
+    def adjacency(self) -> sparse.csr_matrix:
+        """ @returns the matrix with a 1 at (i, j) when agent j can be reached from agent
+        i without passing another agent's intersection
+        """
+        rows, cols = [], []
+        for agent, source in enumerate(self.agent_nodes):
+            seen = {source}
+            frontier = [source]
+            while frontier:
+                node = frontier.pop()
+                for neighbor in self._neighbors(node)[0]:
+                    if neighbor in seen:
+                        continue
+                    seen.add(neighbor)
+                    other = self._agent_of_node[neighbor]
+                    if other >= 0:
+                        rows.append(agent)
+                        cols.append(other)
+                    else:
+                        frontier.append(neighbor)
+        return sparse.csr_matrix(
+            (np.ones(len(rows)), (rows, cols)), shape=(self.num_agents, self.num_agents)
+        )
+
+    def k_nearest(self, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """ Finds the k agents closest to every agent, including itself.
+
+        Ties are broken towards the agent whose node comes first in the graph.
+
+        @returns the (num_agents, k) ids and distances of the nearest agents, sorted by
+        distance
+        """
+        k = min(k, self.num_agents)
+        neighbors = np.empty((self.num_agents, k), dtype=np.int64)
+        distances = np.empty((self.num_agents, k))
+        for agent, source in enumerate(self.agent_nodes):
+            found = 0
+            for node, distance in self._dijkstra(source):
+                other = self._agent_of_node[node]
+                if other < 0:
+                    continue
+                neighbors[agent, found] = other
+                distances[agent, found] = distance
+                found += 1
+                if found == k:
+                    break
+            if found < k:
+                raise ValueError(f"Only {found} agents are reachable from agent {agent}.")
+        return neighbors, distances
+
+    def distance(self, source: int, target: int) -> float:
+        """ @returns the shortest path distance between two agents """
+        target_node = self.agent_nodes[target]
+        for node, distance in self._dijkstra(self.agent_nodes[source]):
+            if node == target_node:
+                return distance
+        return np.inf
+
+    def _neighbors(self, node: int) -> Tuple[np.ndarray, np.ndarray]:
+        start, end = self.graph.indptr[node], self.graph.indptr[node + 1]
+        return self.graph.indices[start:end], self.graph.data[start:end]
+
+    def _dijkstra(self, source: int):
+        """ Yields (node, distance) in order of increasing distance from source """
+        heap = [(0.0, source)]
+        done = set()
+        while heap:
+            distance, node = heapq.heappop(heap)
+            if node in done:
+                continue
+            done.add(node)
+            yield node, distance
+            for neighbor, weight in zip(*self._neighbors(node)):
+                if neighbor not in done:
+                    heapq.heappush(heap, (distance + weight, neighbor))
+
+
+class GridNeighborhood(NeighborhoodIndex):
+    """ Neighborhood of a rows x cols traffic light grid, measured in hops.
+
+    Hop distances on the grid are Manhattan distances, so k nearest lists are computed
+    from a window of offsets instead of with Dijkstra, and the grid also provides the
+    vertical and horizontal adjacency axis sharing needs.
+    """
+
+    def __init__(self, rows: int, cols: int):
+        self.rows = rows
+        self.cols = cols
+        self.vertical, self.horizontal = grid_adjacency(rows, cols)
+        super().__init__(self.vertical + self.horizontal, np.arange(rows * cols))
+        self.agent_rows, self.agent_cols = np.divmod(np.arange(self.num_agents), cols)
+
+    def adjacency(self) -> sparse.csr_matrix:
+        return self.graph
+
+    def k_nearest(self, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """ See NeighborhoodIndex.k_nearest, ties are broken towards the lower agent id.
+
+        Only the offsets within the smallest Manhattan radius that holds k agents even
+        around a corner are considered, so time and memory are O(num_agents * k).
+        """
+        k = min(k, self.num_agents)
+        radius = 0
+        while self._corner_count(radius) < k:
+            radius += 1
+
+        row_offsets, col_offsets = np.mgrid[-radius : radius + 1, -radius : radius + 1]
+        row_offsets, col_offsets = row_offsets.ravel(), col_offsets.ravel()
+        offset_distance = np.abs(row_offsets) + np.abs(col_offsets)
+        within = offset_distance <= radius
+        row_offsets = row_offsets[within]
+        col_offsets = col_offsets[within]
+        offset_distance = offset_distance[within]
+        # by distance, then by id, which grows with row_offset * cols + col_offset
+        order = np.lexsort((row_offsets * self.cols + col_offsets, offset_distance))
+        row_offsets = row_offsets[order]
+        col_offsets = col_offsets[order]
+        offset_distance = offset_distance[order]
+
+        candidate_rows = self.agent_rows[:, None] + row_offsets[None, :]
+        candidate_cols = self.agent_cols[:, None] + col_offsets[None, :]
+        valid = (
+            (candidate_rows >= 0)
+            & (candidate_rows < self.rows)
+            & (candidate_cols >= 0)
+            & (candidate_cols < self.cols)
+        )
+        nearest = np.argsort(~valid, axis=1, kind="stable")[:, :k]
+        neighbors = np.take_along_axis(
+            candidate_rows * self.cols + candidate_cols, nearest, axis=1
+        )
+        return neighbors, offset_distance[nearest].astype(float)
+
+    def _corner_count(self, radius: int) -> int:
+        """ @returns the number of agents within radius of a corner of the grid """
+        row_offsets = np.arange(min(radius, self.rows - 1) + 1)
+        return int(np.sum(np.minimum(radius - row_offsets, self.cols - 1) + 1))
+
+    def distance(self, source: int, target: int) -> float:
+        return float(
+            abs(self.agent_rows[source] - self.agent_rows[target])
+            + abs(self.agent_cols[source] - self.agent_cols[target])
+        )
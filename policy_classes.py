@@ -0,0 +1,47 @@
+"""Assignment of the traffic light agents of a grid to policy classes."""
+
+from typing import Callable, List, Tuple
+
+import numpy as np
+
+from agent_index import AgentIndex
+
+# "single" trains one policy for every agent, "position" one per corner, edge and
+# interior intersections, which see different numbers of neighbors and inflows
+POLICY_CLASSES = ("single", "position")
+POSITION_CLASSES = ("corner", "edge", "interior")
+
+
+def agent_classes(mode: str, rows: int, cols: int) -> List[str]:
+    """ @returns the policy class of every agent of a rows x cols grid, by agent id """
+    num_agents = rows * cols
+    if mode == "single":
+        return ["av"] * num_agents
+    if mode == "position":
+        agent_rows, agent_cols = np.divmod(np.arange(num_agents), cols)
+        on_border_row = (agent_rows == 0) | (agent_rows == rows - 1)
+        on_border_col = (agent_cols == 0) | (agent_cols == cols - 1)
+        return [
+            "corner" if row and col else "edge" if row or col else "interior"
+            for row, col in zip(on_border_row, on_border_col)
+        ]
+    raise ValueError(f"Unknown policy classes {mode}.")
+
+
+def make_policy_mapping(mode: str, rows: int, cols: int) -> Tuple[List[str], Callable]:
+    """ Builds the RLlib policy mapping of a grid.
+
+    Agent ids may carry a "<grid>/" prefix, see batched_env.BatchedGridEnv. RLlib
+    batches the forward passes of all agents of a policy, so every class still costs one
+    inference call per step and worker.
+
+    @returns the ids of the policies in use and the policy_mapping_fn
+    """
+    index = AgentIndex(rows, cols)
+    classes = agent_classes(mode, rows, cols)
+    by_name = dict(zip(index.names, classes))
+
+    def policy_mapping_fn(agent_id):
+        return by_name[agent_id.rsplit("/", 1)[-1]]
+
+    return sorted(set(classes)), policy_mapping_fn
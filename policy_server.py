@@ -0,0 +1,496 @@
+"""Standalone inference of trained traffic light policies from RLlib checkpoints.
+
+The weights of every policy are read straight from a checkpoint written by
+run_experiments and evaluated with numpy, so serving needs neither Ray, TensorFlow
+nor a cluster. All intersections of a grid are served by one batched forward pass
+per policy, and actions are deterministic, i.e. the mean of the Gaussian RLlib
+samples from during training.
+
+    python policy_server.py ~/ray_results/<exp>/<trial>/checkpoint_25 --serve
+    python policy_server.py ~/ray_results/<exp>/<trial>/checkpoint_25 --benchmark
+
+--serve answers requests of PolicyClient on a local socket, batching the requests
+that arrive together into one forward pass. --benchmark prints the p50 and p99
+latency of the in-process and the socket API for grids of --sizes.
+"""
+
+import argparse
+import glob
+import io
+import json
+import os
+import pickle
+import queue
+import re
+import socket
+import socketserver
+import struct
+import threading
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from policy_classes import make_policy_mapping
+
+DEFAULT_POLICY = "av"
+DEFAULT_ADDRESS = ("localhost", 9473)
+ACTIVATIONS = {
+    "tanh": np.tanh,
+    "relu": lambda x: np.maximum(x, 0),
+    "linear": lambda x: x,
+}
+# length prefix of the JSON header of every socket message
+HEADER = struct.Struct("!I")
+
+
+class _Stub:
+    """ Stands in for the Ray classes pickled into a checkpoint, keeping their state """
+
+
+class _CheckpointUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        if module == "ray" or module.startswith("ray."):
+            return type(name, (_Stub,), {})
+        return super().find_class(module, name)
+
+
+def _loads(data: bytes):
+    return _CheckpointUnpickler(io.BytesIO(data)).load()
+
+
+def checkpoint_file(path: str) -> str:
+    """ @returns the checkpoint file of a checkpoint_<n> directory, or path itself """
+    if os.path.isdir(path):
+        files = [
+            name
+            for name in glob.glob(os.path.join(path, "checkpoint-*"))
+            if not name.endswith(".tune_metadata")
+        ]
+        if len(files) != 1:
+            raise ValueError(f"Expected one checkpoint file in {path}, found {files}.")
+        return files[0]
+    return path
+
+
+def load_checkpoint(path: str) -> Tuple[dict, dict, dict]:
+    """ Reads a checkpoint of run_experiments without Ray.
+
+    @returns the weights and the observation filter of every policy, by policy id,
+    and the trial config from the params.json next to the checkpoint, or {}
+    """
+    path = checkpoint_file(path)
+    with open(path, "rb") as f:
+        trainer_state = _loads(f.read())
+    worker_state = _loads(trainer_state["worker"])
+    weights = {}
+    for policy_id, state in worker_state["state"].items():
+        # policies that keep more than their weights put the weights first
+        weights[policy_id] = state[0] if isinstance(state, (list, tuple)) else state
+
+    params = os.path.join(os.path.dirname(os.path.dirname(path)), "params.json")
+    config = {}
+    if os.path.exists(params):
+        with open(params, "r") as f:
+            config = json.load(f)
+    return weights, worker_state.get("filters", {}), config
+
+
+def _layer_order(prefix: str):
+    """ Sorts fc1, fc2, ..., fc10 numerically and the output layer last """
+    number = re.search(r"(\d+)$", prefix)
+    return (prefix.endswith("_out"), int(number.group(1)) if number else 0, prefix)
+
+
+class PolicyNetwork:
+    """ numpy forward pass of RLlib's fully connected policy network
+
+    @param layers the (kernel, bias) of every layer, input first
+    @param observation_filter the filter RLlib applied to observations, a NoFilter
+    or MeanStdFilter state from the checkpoint, or None
+    """
+
+    def __init__(
+        self, layers: List[Tuple[np.ndarray, np.ndarray]], activation="tanh",
+        observation_filter=None,
+    ):
+        self.layers = [
+            (np.asarray(kernel, dtype=np.float32), np.asarray(bias, dtype=np.float32))
+            for kernel, bias in layers
+        ]
+        self.activation = ACTIVATIONS[activation]
+        self.obs_dim = self.layers[0][0].shape[0]
+        # a diagonal Gaussian outputs a mean and a log std per action dimension
+        self.action_dim = self.layers[-1][0].shape[1] // 2
+        self.observation_filter = observation_filter
+
+    @staticmethod
+    def from_weights(weights: Dict[str, np.ndarray], activation="tanh", observation_filter=None):
+        """ Picks the policy layers out of the variables of an RLlib TF policy,
+        leaving out the value function branch
+        """
+        layers = {}
+        for name, value in weights.items():
+            prefix, _, kind = name.rpartition("/")
+            if kind in ("kernel", "bias") and "value" not in name:
+                layers.setdefault(prefix, {})[kind] = value
+        if not layers:
+            raise ValueError(f"No dense layers among the variables {sorted(weights)}.")
+        ordered = [layers[prefix] for prefix in sorted(layers, key=_layer_order)]
+        for previous, layer in zip(ordered, ordered[1:]):
+            if previous["kernel"].shape[1] != layer["kernel"].shape[0]:
+                raise ValueError(f"Unexpected policy layers {sorted(layers)}.")
+        return PolicyNetwork(
+            [(layer["kernel"], layer["bias"]) for layer in ordered],
+            activation,
+            observation_filter,
+        )
+
+    @staticmethod
+    def random(obs_dim: int, hiddens=(32, 32), action_dim: int = 1, seed: int = 0):
+        """ @returns a network of the trained architecture with random weights, to
+        benchmark without a checkpoint
+        """
+        rng = np.random.RandomState(seed)
+        sizes = [obs_dim] + list(hiddens) + [2 * action_dim]
+        return PolicyNetwork(
+            [(rng.randn(a, b) / np.sqrt(a), np.zeros(b)) for a, b in zip(sizes, sizes[1:])]
+        )
+
+    def _filter(self, obs: np.ndarray) -> np.ndarray:
+        observation_filter = self.observation_filter
+        if observation_filter is None or not hasattr(observation_filter, "rs"):
+            return obs
+        stat = observation_filter.rs
+        mean = stat._M
+        var = stat._S / (stat._n - 1) if stat._n > 1 else np.square(stat._M)
+        if observation_filter.demean:
+            obs = obs - mean
+        if observation_filter.destd:
+            obs = obs / (np.sqrt(var) + 1e-8)
+        if observation_filter.clip:
+            obs = np.clip(obs, -observation_filter.clip, observation_filter.clip)
+        return obs
+
+    def logits(self, obs: np.ndarray) -> np.ndarray:
+        """ @returns the (batch, 2 * action_dim) means and log stds of the Gaussian of
+        a (batch, obs_dim) batch
+        """
+        hidden = self._filter(np.asarray(obs, dtype=np.float32))
+        for kernel, bias in self.layers[:-1]:
+            hidden = self.activation(hidden @ kernel + bias)
+        kernel, bias = self.layers[-1]
+        return hidden @ kernel + bias
+
+    def __call__(self, obs: np.ndarray) -> np.ndarray:
+        """ @returns the (batch, action_dim) actions of a (batch, obs_dim) batch """
+        return self.logits(obs)[:, : self.action_dim]
+
+
+class PolicyServer:
+    """ Actions of every agent of a grid from its policy, one forward pass per policy
+
+    @param networks the PolicyNetwork of every policy id
+    @param policy_classes how agents were split into policies, see
+    policy_classes.POLICY_CLASSES
+    """
+
+    def __init__(self, networks: Dict[str, PolicyNetwork], policy_classes="single"):
+        obs_dims = {network.obs_dim for network in networks.values()}
+        if len(obs_dims) != 1:
+            raise ValueError(
+                f"Policies observe {sorted(obs_dims)} features, a grid is served with one."
+            )
+        self.networks = networks
+        self.policy_classes = policy_classes
+        (self.obs_dim,) = obs_dims
+        self._mappings = {}
+
+    @staticmethod
+    def from_checkpoint(path: str, policy_classes="single") -> "PolicyServer":
+        weights, filters, config = load_checkpoint(path)
+        activation = config.get("model", {}).get("fcnet_activation", "tanh")
+        networks = {
+            policy_id: PolicyNetwork.from_weights(
+                policy_weights, activation, filters.get(policy_id)
+            )
+            for policy_id, policy_weights in weights.items()
+        }
+        return PolicyServer(networks, policy_classes)
+
+    def policy_of(self, names: List[str], rows: int, cols: int) -> List[str]:
+        """ @returns the policy id of every agent of a rows x cols grid """
+        if len(self.networks) == 1:
+            return [next(iter(self.networks))] * len(names)
+        if rows <= 0 or cols <= 0:
+            raise ValueError(
+                f"The grid shape is needed to map agents to {len(self.networks)} policies, "
+                f"got {rows}x{cols}."
+            )
+        if (rows, cols) not in self._mappings:
+            self._mappings[rows, cols] = make_policy_mapping(self.policy_classes, rows, cols)[1]
+        mapping = self._mappings[rows, cols]
+        return [mapping(name) for name in names]
+
+    def check_batch(self, obs: np.ndarray, policy_ids: List[str] = None):
+        """ Raises a ValueError unless obs is a (batch, obs_dim) array with one policy
+        id per row, if policy ids are given
+        """
+        if obs.ndim != 2 or obs.shape[1] != self.obs_dim:
+            raise ValueError(
+                f"Expected observations of shape (batch, {self.obs_dim}), got {obs.shape}."
+            )
+        if policy_ids is not None and len(policy_ids) != len(obs):
+            raise ValueError(f"Got {len(policy_ids)} policy ids for {len(obs)} observations.")
+
+    def compute_batch(self, obs: np.ndarray, policy_ids: List[str] = None) -> np.ndarray:
+        """ @returns the actions of a (batch, obs_dim) array of observations, every
+        row evaluated by the network of its policy id, by default the only one
+        """
+        if policy_ids is None or len(self.networks) == 1:
+            (network,) = self.networks.values()
+            return network(obs)
+        policy_ids = np.asarray(policy_ids)
+        actions = None
+        for policy_id, network in self.networks.items():
+            rows = np.flatnonzero(policy_ids == policy_id)
+            if rows.size == 0:
+                continue
+            policy_actions = network(obs[rows])
+            if actions is None:
+                actions = np.zeros((len(obs), policy_actions.shape[1]), dtype=np.float32)
+            actions[rows] = policy_actions
+        return actions
+
+    def compute_actions(
+        self, observations: Dict[str, np.ndarray], rows: int = 0, cols: int = 0
+    ) -> Dict[str, np.ndarray]:
+        """ In-process API, with the observation and action dicts of the envs
+
+        rows and cols are only needed, and then required, when the agents of the grid
+        use different policies.
+        """
+        names = list(observations)
+        obs = np.stack([observations[name] for name in names])
+        policy_ids = self.policy_of(names, rows, cols) if len(self.networks) > 1 else None
+        return dict(zip(names, self.compute_batch(obs, policy_ids)))
+
+
+def _send(sock: socket.socket, header: dict, array: np.ndarray):
+    array = np.ascontiguousarray(array, dtype=np.float32)
+    header = dict(header, shape=array.shape)
+    encoded = json.dumps(header).encode()
+    sock.sendall(HEADER.pack(len(encoded)) + encoded + array.tobytes())
+
+
+def _receive_exactly(sock: socket.socket, size: int) -> bytes:
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise ConnectionError("Connection closed mid-message.")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def _receive(sock: socket.socket) -> Tuple[dict, np.ndarray]:
+    (length,) = HEADER.unpack(_receive_exactly(sock, HEADER.size))
+    header = json.loads(_receive_exactly(sock, length))
+    shape = tuple(header["shape"])
+    data = _receive_exactly(sock, int(np.prod(shape)) * 4)
+    return header, np.frombuffer(data, dtype=np.float32).reshape(shape)
+
+
+class _Batcher:
+    """ Runs the requests of concurrent connections through one forward pass
+
+    Requests that queued up during the previous pass are batched together, and the
+    first pending request waits up to max_wait seconds more for others to join it.
+    """
+
+    def __init__(self, server: PolicyServer, max_wait: float):
+        self.server = server
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        thread = threading.Thread(target=self._run, daemon=True)
+        thread.start()
+
+    def compute(self, obs: np.ndarray, policy_ids) -> np.ndarray:
+        """ @returns the actions of obs, raising the error of its batch if it failed """
+        # a malformed request would otherwise fail the batch it joins
+        self.server.check_batch(obs, policy_ids)
+        done = threading.Event()
+        request = [obs, policy_ids, done, None]
+        self.requests.put(request)
+        done.wait()
+        if isinstance(request[3], Exception):
+            raise request[3]
+        return request[3]
+
+    def _run(self):
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while True:
+                remaining = deadline - time.perf_counter()
+                try:
+                    if remaining > 0:
+                        batch.append(self.requests.get(timeout=remaining))
+                    else:
+                        batch.append(self.requests.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                obs = np.concatenate([request[0] for request in batch])
+                policy_ids = None
+                if batch[0][1] is not None:
+                    policy_ids = [policy_id for request in batch for policy_id in request[1]]
+                actions = self.server.compute_batch(obs, policy_ids)
+            except Exception as error:
+                # the requests of this batch fail, the thread goes on with the next one
+                for request in batch:
+                    request[3] = error
+                    request[2].set()
+                continue
+            start = 0
+            for request in batch:
+                request[3] = actions[start : start + len(request[0])]
+                start += len(request[0])
+                request[2].set()
+
+
+def serve(server: PolicyServer, address=DEFAULT_ADDRESS, max_wait: float = 0.0):
+    """ Socket API: answers PolicyClient requests on address until interrupted """
+    batcher = _Batcher(server, max_wait)
+
+    class Handler(socketserver.BaseRequestHandler):
+        def handle(self):
+            self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            while True:
+                try:
+                    header, obs = _receive(self.request)
+                except ConnectionError:
+                    return
+                try:
+                    policy_ids = None
+                    if len(server.networks) > 1:
+                        policy_ids = server.policy_of(
+                            header["names"], header["rows"], header["cols"]
+                        )
+                    actions = batcher.compute(obs, policy_ids)
+                except Exception as error:
+                    _send(self.request, {"error": f"{type(error).__name__}: {error}"}, obs[:0])
+                    continue
+                _send(self.request, {}, actions)
+
+    socketserver.ThreadingTCPServer.allow_reuse_address = True
+    with socketserver.ThreadingTCPServer(address, Handler) as tcp_server:
+        tcp_server.daemon_threads = True
+        tcp_server.serve_forever()
+
+
+class PolicyClient:
+    """ Client of the socket API, with the same compute_actions as PolicyServer """
+
+    def __init__(self, address=DEFAULT_ADDRESS):
+        self.sock = socket.create_connection(address)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def compute_actions(
+        self, observations: Dict[str, np.ndarray], rows: int = 0, cols: int = 0
+    ) -> Dict[str, np.ndarray]:
+        names = list(observations)
+        obs = np.stack([observations[name] for name in names])
+        _send(self.sock, {"names": names, "rows": rows, "cols": cols}, obs)
+        header, actions = _receive(self.sock)
+        if "error" in header:
+            raise RuntimeError(f"Policy server failed the request: {header['error']}")
+        return dict(zip(names, actions))
+
+    def close(self):
+        self.sock.close()
+
+
+def latency(compute_actions, observations: Dict[str, np.ndarray], repeats: int) -> dict:
+    """ @returns the p50 and p99 milliseconds of compute_actions(observations) """
+    compute_actions(observations)
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        compute_actions(observations)
+        durations.append(time.perf_counter() - start)
+    return {
+        "p50_ms": float(np.percentile(durations, 50) * 1e3),
+        "p99_ms": float(np.percentile(durations, 99) * 1e3),
+    }
+
+
+def run_benchmarks(server: PolicyServer, sizes, repeats: int, address) -> list:
+    """ Times both APIs on grids of sizes, against a server started on address """
+    thread = threading.Thread(target=serve, args=(server, address), daemon=True)
+    thread.start()
+    client = None
+    for _ in range(100):
+        try:
+            client = PolicyClient(address)
+            break
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+
+    obs_dim = next(iter(server.networks.values())).obs_dim
+    rng = np.random.RandomState(0)
+    results = []
+    for size in sizes:
+        observations = {
+            f"center{i}": rng.rand(obs_dim).astype(np.float32) for i in range(size * size)
+        }
+        for api, compute_actions in (
+            ("in-process", server.compute_actions),
+            ("socket", client.compute_actions),
+        ):
+            result = latency(
+                lambda obs: compute_actions(obs, size, size), observations, repeats
+            )
+            result.update(api=api, grid=f"{size}x{size}")
+            results.append(result)
+            print(
+                f"{api:>10} {size:>3}x{size:<3} p50 {result['p50_ms']:8.3f} ms "
+                f"p99 {result['p99_ms']:8.3f} ms"
+            )
+    client.close()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("checkpoint", nargs="?",
+                        help="checkpoint_<n> directory or checkpoint file of a trial")
+    parser.add_argument("--policy_classes", default="single",
+                        help="--policy_classes the checkpoint was trained with")
+    parser.add_argument("--serve", action="store_true", help="Serve the socket API")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="Print the p50/p99 latency of both APIs")
+    parser.add_argument("--host", default=DEFAULT_ADDRESS[0])
+    parser.add_argument("--port", type=int, default=DEFAULT_ADDRESS[1])
+    parser.add_argument("--max_wait", type=float, default=0.0,
+                        help="Seconds a request may wait for others to batch with")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[3, 10, 30],
+                        help="Side lengths of the grids to benchmark")
+    parser.add_argument("--repeats", type=int, default=2000)
+    parser.add_argument("--random_weights", type=int, metavar="OBS_DIM",
+                        help="Benchmark a random network of the trained architecture "
+                        "instead of a checkpoint")
+    args = parser.parse_args()
+
+    if args.checkpoint:
+        policy_server = PolicyServer.from_checkpoint(args.checkpoint, args.policy_classes)
+    elif args.random_weights:
+        policy_server = PolicyServer({DEFAULT_POLICY: PolicyNetwork.random(args.random_weights)})
+    else:
+        parser.error("Give a checkpoint or --random_weights.")
+
+    if args.benchmark:
+        run_benchmarks(policy_server, args.sizes, args.repeats, (args.host, args.port))
+    elif args.serve:
+        serve(policy_server, (args.host, args.port), args.max_wait)
@@ -0,0 +1,93 @@
+"""Opt-in wall-clock timing of the phases of an env step."""
+
+import itertools
+import json
+import os
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+PHASES = (
+    "step", "sim", "actions", "observation", "raw_reward", "sharing", "metrics", "reset"
+)
+# phases that are timed inside step; whatever step spends outside of them is "sim",
+# i.e. the SUMO step, the kernel update and flow's bookkeeping
+STEP_PHASES = ("actions", "observation", "raw_reward", "sharing", "metrics")
+# log spaced histogram bins from 10us to 10s
+HISTOGRAM_BINS = np.logspace(-5, 1, 25)
+# numbers the profilers of a process, which has one per env
+_instances = itertools.count()
+
+
+class StepProfiler:
+    """ Records the wall-clock time of every phase of the steps of an episode.
+
+    Envs keep a profiler only when profiling is enabled and check for None otherwise,
+    so a disabled profiler costs one attribute lookup per phase.
+
+    If trace_dir is given, every finished episode is appended as one JSON line with
+    per-phase totals and histograms to trace_dir/profile_<pid>_<instance>.jsonl, where
+    instance tells apart the envs of one process, e.g. the grids of a BatchedGridEnv.
+    """
+
+    def __init__(self, trace_dir: Optional[str] = None):
+        self.instance = next(_instances)
+        self.trace_path = None
+        if trace_dir is not None:
+            os.makedirs(trace_dir, exist_ok=True)
+            self.trace_path = os.path.join(
+                trace_dir, f"profile_{os.getpid()}_{self.instance:03d}.jsonl"
+            )
+        self.episode = 0
+        self._durations: Dict[str, List[float]] = {phase: [] for phase in PHASES}
+        self._step_phases = 0.0
+
+    def record(self, phase: str, start: float):
+        """ Records the time since start, a time.perf_counter() value, under phase """
+        duration = time.perf_counter() - start
+        self._durations[phase].append(duration)
+        if phase in STEP_PHASES:
+            self._step_phases += duration
+
+    def begin_step(self):
+        self._step_phases = 0.0
+
+    def end_step(self, start: float):
+        duration = time.perf_counter() - start
+        self._durations["step"].append(duration)
+        self._durations["sim"].append(duration - self._step_phases)
+
+    def episode_metrics(self) -> Dict[str, float]:
+        """ @returns the total seconds and mean and p99 milliseconds per call of every
+        phase of the current episode, suited for RLlib custom_metrics
+        """
+        metrics = {}
+        for phase, durations in self._durations.items():
+            if not durations:
+                continue
+            durations = np.array(durations)
+            metrics[f"time_{phase}_total_s"] = float(durations.sum())
+            metrics[f"time_{phase}_mean_ms"] = float(durations.mean() * 1e3)
+            metrics[f"time_{phase}_p99_ms"] = float(np.percentile(durations, 99) * 1e3)
+        return metrics
+
+    def end_episode(self):
+        """ Writes the current episode to the trace file and starts a new one """
+        if self.trace_path is not None and self._durations["step"]:
+            trace = {
+                "pid": os.getpid(),
+                "instance": self.instance,
+                "episode": self.episode,
+                "metrics": self.episode_metrics(),
+                "histogram_bins": HISTOGRAM_BINS.tolist(),
+                "histograms": {
+                    phase: np.histogram(durations, HISTOGRAM_BINS)[0].tolist()
+                    for phase, durations in self._durations.items()
+                },
+            }
+            with open(self.trace_path, "a") as f:
+                f.write(json.dumps(trace) + "\n")
+        self.episode += 1
+        for durations in self._durations.values():
+            durations.clear()
@@ -0,0 +1,234 @@
+"""In-process queue model of the traffic light grid, a fast stand-in for SUMO.
+
+QueueGridEnv exposes the parts of MultiTrafficLightGridPOEnv the project's envs use
+(grid shape, light state, observations, actions, rewards, step and reset) without
+starting SUMO or building the network files, so an episode takes milliseconds. It is
+meant for CI, smoke runs of run_experiment.py, hyperparameter pre-screening and
+debugging the sharing logic, not for results.
+
+Every intersection has one queue per incoming approach, fed by Poisson inflows on the
+border of the grid. A green approach discharges up to the saturation flow per second,
+and vehicles drive straight on to the queue of the next intersection or leave the grid.
+Travel times between intersections are ignored.
+"""
+
+import gym
+import numpy as np
+from gym.spaces.box import Box
+from gym.spaces.discrete import Discrete
+from ray.rllib.env.multi_agent_env import MultiAgentEnv
+
+from agent_index import AgentIndex
+from sharing_env import SharingMixin
+
+# approaches of an intersection, by the side vehicles come from
+FROM_BOTTOM, FROM_TOP, FROM_LEFT, FROM_RIGHT = range(4)
+SATURATION_FLOW = 0.5  # vehicles per second leaving a green approach
+VEHICLE_SPACING = 7.5  # meters taken by a queued vehicle
+
+
+class QueueGridEnv(MultiAgentEnv, gym.Env):
+    """ Queue model of a rows x cols traffic light grid with one agent per light.
+
+    Lights follow the same green/yellow/switch rules as MultiTrafficLightGridPOEnv:
+    direction 0 serves the top and bottom approaches, 1 the left and right ones, and a
+    positive action, or with the "discrete" additional param an action of 1, switches
+    the light through a yellow phase of switch_time seconds.
+    Observations have the layout and size of MultiTrafficLightGridPOEnv's. The raw
+    reward of an agent is minus the vehicles queued at its intersection, scaled by the
+    capacity of its approaches.
+    """
+
+    def __init__(self, env_params, sim_params, network, simulator="stub"):
+        self.env_params = env_params
+        self.sim_params = sim_params
+        self.network = network
+        self.net_params = network.net_params
+        grid_array = self.net_params.additional_params["grid_array"]
+        self.rows = grid_array["row_num"]
+        self.cols = grid_array["col_num"]
+        self.num_traffic_lights = self.rows * self.cols
+
+        additional_params = env_params.additional_params
+        self.min_switch_time = additional_params["switch_time"]
+        self.discrete = additional_params.get("discrete", False)
+        self.num_observed = additional_params.get("num_observed", 2)
+        self.num_local_edges = additional_params.get("num_local_edges", 4)
+        self.num_local_lights = additional_params.get("num_local_lights", 4)
+        assert (
+            self.num_local_edges == 4 and self.num_local_lights == 4
+        ), "The queue model only supports the four local edges and lights of a grid."
+        self.sim_step = getattr(sim_params, "sim_step", 1)
+
+        self.max_dist = max(
+            grid_array["short_length"], grid_array["long_length"], grid_array["inner_length"]
+        )
+        self.queue_capacity = grid_array["inner_length"] / VEHICLE_SPACING
+        self.arrival_rate = self._arrival_rate() * self.sim_step
+
+        index = AgentIndex(self.rows, self.cols)
+        self._agent_index = index
+        n = self.num_traffic_lights
+        # neighbor ids in the order self, top, bottom, left, right; n is the padding id
+        self._local_lights = np.stack(
+            [
+                np.arange(n),
+                np.where(index.agent_rows < self.rows - 1, np.arange(n) + self.cols, n),
+                np.where(index.agent_rows > 0, np.arange(n) - self.cols, n),
+                np.where(index.agent_cols > 0, np.arange(n) - 1, n),
+                np.where(index.agent_cols < self.cols - 1, np.arange(n) + 1, n),
+            ],
+            axis=1,
+        )
+
+        self._rng = np.random.RandomState(getattr(sim_params, "seed", None))
+        self.time_counter = 0
+        self.step_counter = 0
+        self._reset_state()
+
+    @property
+    def observation_space(self):
+        return Box(
+            low=0.0,
+            high=1,
+            shape=(
+                3 * 4 * self.num_observed
+                + 2 * self.num_local_edges
+                + 2 * (1 + self.num_local_lights),
+            ),
+            dtype=np.float32,
+        )
+
+    @property
+    def action_space(self):
+        if self.discrete:
+            return Discrete(2)
+        return Box(low=-1, high=1, shape=(1,), dtype=np.float32)
+
+    def _arrival_rate(self) -> np.ndarray:
+        """ @returns the vehicles per second entering each approach from outside """
+        inflows = self.net_params.inflows.get()
+        vehs_per_hour = inflows[0]["vehsPerHour"] if inflows else 0
+        rate = np.zeros((self.rows, self.cols, 4))
+        rate[0, :, FROM_BOTTOM] = vehs_per_hour / 3600
+        rate[-1, :, FROM_TOP] = vehs_per_hour / 3600
+        rate[:, 0, FROM_LEFT] = vehs_per_hour / 3600
+        rate[:, -1, FROM_RIGHT] = vehs_per_hour / 3600
+        return rate
+
+    def _reset_state(self):
+        n = self.num_traffic_lights
+        self.queues = np.zeros((self.rows, self.cols, 4))
+        self.last_change = np.zeros((n, 1))
+        self.direction = np.zeros((n, 1))
+        self.currently_yellow = np.zeros((n, 1))
+
+    def _apply_rl_actions(self, rl_actions):
+        for rl_id, rl_action in rl_actions.items():
+            i = self._agent_index.id_num(rl_id)
+            # a discrete action of 1 or a continuous one above 0 switches the light
+            action = int(rl_action) == 1 if self.discrete else rl_action > 0.0
+            if self.currently_yellow[i] == 1:
+                self.last_change[i] += self.sim_step
+                if self.last_change[i] >= self.min_switch_time:
+                    self.currently_yellow[i] = 0
+            elif action:
+                self.last_change[i] = 0.0
+                self.direction[i] = not self.direction[i]
+                self.currently_yellow[i] = 1
+
+    def _simulation_step(self):
+        queues = self.queues
+        direction = self.direction.reshape(self.rows, self.cols)
+        green = np.zeros_like(queues, dtype=bool)
+        green[..., [FROM_BOTTOM, FROM_TOP]] = (direction == 0)[..., None]
+        green[..., [FROM_LEFT, FROM_RIGHT]] = (direction == 1)[..., None]
+        green &= (self.currently_yellow.reshape(self.rows, self.cols) == 0)[..., None]
+
+        served = np.where(green, np.minimum(queues, SATURATION_FLOW * self.sim_step), 0)
+        queues -= served
+        queues[1:, :, FROM_BOTTOM] += served[:-1, :, FROM_BOTTOM]
+        queues[:-1, :, FROM_TOP] += served[1:, :, FROM_TOP]
+        queues[:, 1:, FROM_LEFT] += served[:, :-1, FROM_LEFT]
+        queues[:, :-1, FROM_RIGHT] += served[:, 1:, FROM_RIGHT]
+        queues += self._rng.poisson(self.arrival_rate)
+
+    def get_state(self):
+        n = self.num_traffic_lights
+        queues = self.queues.reshape(n, 4)
+
+        # the closest num_observed vehicles of every approach are queued, so they
+        # stand still, one vehicle spacing apart; missing vehicles are padded like flow
+        slots = np.arange(self.num_observed)
+        observed = slots[None, None, :] < queues[..., None]
+        speeds = np.where(observed, 0.0, 1.0)
+        dists = np.where(observed, slots * VEHICLE_SPACING / self.max_dist, 1.0)
+        edge_numbers = np.where(
+            observed, np.arange(n * 4).reshape(n, 4, 1) / (n * 4 - 1), 0.0
+        )
+
+        density = np.minimum(queues / self.queue_capacity, 1)
+        velocity_avg = np.zeros((n, 4))
+
+        direction = np.append(self.direction.ravel(), [0])[self._local_lights]
+        currently_yellow = np.append(self.currently_yellow.ravel(), [1])[
+            self._local_lights
+        ]
+
+        obs = np.concatenate(
+            [
+                speeds.reshape(n, -1),
+                dists.reshape(n, -1),
+                edge_numbers.reshape(n, -1),
+                density,
+                velocity_avg,
+                direction,
+                currently_yellow,
+            ],
+            axis=1,
+        )
+        return dict(zip(self._agent_index.names, obs))
+
+    def compute_reward(self, rl_actions, **kwargs):
+        if rl_actions is None:
+            return {}
+        queued = self.queues.reshape(self.num_traffic_lights, 4).sum(axis=1)
+        rewards = -queued / (4 * self.queue_capacity)
+        return {rl_id: rewards[self._agent_index.id_num(rl_id)] for rl_id in rl_actions}
+
+    def queue_lengths(self) -> np.ndarray:
+        return self.queues.reshape(self.num_traffic_lights, 4).sum(axis=1)
+
+    def step(self, rl_actions):
+        for _ in range(self.env_params.sims_per_step):
+            self.time_counter += 1
+            self.step_counter += 1
+            if rl_actions:
+                self._apply_rl_actions(rl_actions)
+            self._simulation_step()
+
+        states = self.get_state()
+        done = {
+            "__all__": self.time_counter
+            >= self.env_params.sims_per_step
+            * (self.env_params.warmup_steps + self.env_params.horizon)
+        }
+        reward = self.compute_reward(rl_actions)
+        infos = {key: {} for key in states}
+        return states, reward, done, infos
+
+    def reset(self):
+        self.time_counter = 0
+        self._reset_state()
+        for _ in range(self.env_params.warmup_steps):
+            self._simulation_step()
+        return self.get_state()
+
+    def terminate(self):
+        pass
+
+
+class StubSharingEnv(SharingMixin, QueueGridEnv):
+    """ Multiagent traffic light grid environment with a pluggable reward sharing strategy,
+    simulated by the in-process queue model
+    """
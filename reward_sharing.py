@@ -0,0 +1,177 @@
+"""Precomputed reward sharing operators for the traffic light grid."""
+
+import numpy as np
+from scipy import sparse
+
+from neighborhood import GridNeighborhood, NeighborhoodIndex
+
+
+def knn_importance(neighborhood: NeighborhoodIndex, k: int, tau: float) -> sparse.csr_matrix:
+    """ Builds the Colight style k-nearest-neighbor importance matrix of a network.
+
+    Row i holds a softmax over the negative distances (scaled by the temperature tau)
+    of the k intersections closest to i, including i itself, as given by
+    neighborhood.k_nearest.
+
+    On a grid, ties at the k-th distance are broken towards the lower agent id. The
+    previous per-agent scan kept whichever tied candidate survived its insertion order,
+    so the chosen neighbor set can differ from it on ties; the importance of every kept
+    neighbor only depends on its distance, which is unchanged.
+
+    @returns a CSR matrix with k entries per row, such that importance.dot(rewards)
+    gives every agent's shared reward
+    """
+    num_agents = neighborhood.num_agents
+    neighbors, distances = neighborhood.k_nearest(k)
+    k = neighbors.shape[1]
+
+    logits = -distances / tau
+    logits -= logits.max(axis=1, keepdims=True)
+    weights = np.exp(logits)
+    weights /= weights.sum(axis=1, keepdims=True)
+
+    indptr = np.arange(0, num_agents * k + 1, k)
+    return sparse.csr_matrix(
+        (weights.ravel(), neighbors.ravel(), indptr), shape=(num_agents, num_agents)
+    )
+
+
+class SharingStrategy:
+    """ Maps the raw rewards of every agent to its sharing adjusted rewards.
+
+    A strategy is compiled once for the neighborhood of a network, so that share only
+    does array math on a vector of rewards indexed by agent id.
+    """
+
+    def compile(self, neighborhood: NeighborhoodIndex):
+        self.neighborhood = neighborhood
+
+    def share(self, rewards: np.ndarray, directions: np.ndarray) -> np.ndarray:
+        """ @returns the shared rewards of all agents given their raw rewards and the
+        current direction of their lights
+
+        Both arrays are indexed by agent id along their first axis. Any further axes,
+        e.g. the steps of a recorded episode, are shared independently.
+        """
+        raise NotImplementedError
+
+
+class NoSharing(SharingStrategy):
+    """ Every agent keeps its own reward """
+
+    def share(self, rewards: np.ndarray, directions: np.ndarray) -> np.ndarray:
+        return rewards
+
+
+class MatrixSharing(SharingStrategy):
+    """ Shares rewards with a fixed (num_agents x num_agents) matrix.
+
+    Subclasses build the matrix from the neighborhood in _build_matrix; the default
+    uses the matrix given to the constructor, which must match the compiled network.
+    """
+
+    def __init__(self, matrix=None):
+        self.matrix = matrix
+
+    def compile(self, neighborhood: NeighborhoodIndex):
+        super().compile(neighborhood)
+        self._matrix = sparse.csr_matrix(self._build_matrix(neighborhood))
+        num_agents = neighborhood.num_agents
+        assert self._matrix.shape == (
+            num_agents,
+            num_agents,
+        ), "Sharing matrix must be num_agents x num_agents."
+
+    def _build_matrix(self, neighborhood: NeighborhoodIndex):
+        return self.matrix
+
+    def share(self, rewards: np.ndarray, directions: np.ndarray) -> np.ndarray:
+        return self._matrix.dot(rewards)
+
+
+class NeighborSharing(MatrixSharing):
+    """ Adds the weighted rewards of the direct neighbors, on a grid the top, bottom, left
+    and right ones
+    """
+
+    def __init__(self, neighbor_weight: float):
+        assert isinstance(neighbor_weight, float), "Neighbor weight must be a float."
+        self.neighbor_weight = neighbor_weight
+
+    def _build_matrix(self, neighborhood: NeighborhoodIndex):
+        identity = sparse.identity(neighborhood.num_agents, format="csr")
+        return identity + self.neighbor_weight * neighborhood.adjacency()
+
+
+class KNNSharing(MatrixSharing):
+    """ Colight style softmax sharing over the k nearest intersections, see
+    knn_importance
+    """
+
+    def __init__(self, k_nearest_neighbor: int, temperature_factor: float):
+        assert isinstance(k_nearest_neighbor, int), "Neighbor count k must be an integer."
+        assert isinstance(
+            temperature_factor, float
+        ), "Temperature factor must be a float."
+        self.k_nearest_neighbor = k_nearest_neighbor
+        self.temperature_factor = temperature_factor
+
+    def _build_matrix(self, neighborhood: NeighborhoodIndex):
+        return knn_importance(
+            neighborhood, self.k_nearest_neighbor, self.temperature_factor
+        )
+
+
+class AxisSharing(SharingStrategy):
+    """ Shares along the axis traffic currently flows through each light.
+
+    Agents whose light lets traffic flow top to bottom add the weighted rewards of their
+    top and bottom neighbors, the others those of their left and right neighbors. One
+    matrix is kept per direction and the product is picked per agent, since directions
+    flip every few steps. Only grids have axes, so it needs a GridNeighborhood.
+    """
+
+    def __init__(self, neighbor_weight: float):
+        assert isinstance(neighbor_weight, float), "Neighbor weight must be a float."
+        self.neighbor_weight = neighbor_weight
+
+    def compile(self, neighborhood: NeighborhoodIndex):
+        if not isinstance(neighborhood, GridNeighborhood):
+            raise ValueError("Axis sharing is only defined on a grid.")
+        super().compile(neighborhood)
+        identity = sparse.identity(neighborhood.num_agents, format="csr")
+        self._vertical = (identity + self.neighbor_weight * neighborhood.vertical).tocsr()
+        self._horizontal = (
+            identity + self.neighbor_weight * neighborhood.horizontal
+        ).tocsr()
+
+    def share(self, rewards: np.ndarray, directions: np.ndarray) -> np.ndarray:
+        return np.where(
+            directions == 0, self._vertical.dot(rewards), self._horizontal.dot(rewards)
+        )
+
+
+SHARING_STRATEGIES = ("none", "axis", "neighbors", "knn")
+
+
+def make_strategy(sharing, additional_params: dict) -> SharingStrategy:
+    """ Builds the sharing strategy named by sharing from the env additional params.
+
+    sharing is one of "none", "axis", "neighbors" or "knn", or an already built
+    SharingStrategy, which is returned as is.
+    """
+    if isinstance(sharing, SharingStrategy):
+        return sharing
+    if sharing == "none":
+        return NoSharing()
+    if sharing == "axis":
+        return AxisSharing(additional_params["neighbor_weight"])
+    if sharing == "neighbors":
+        return NeighborSharing(additional_params["neighbor_weight"])
+    if sharing == "knn":
+        return KNNSharing(
+            additional_params["k_nearest_neighbor"],
+            additional_params["temperature_factor"],
+        )
+    raise ValueError(f"Unknown reward sharing strategy {sharing}.")
+
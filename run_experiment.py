@@ -1,31 +1,17 @@
-"""Multi-agent traffic light example (single shared policy)."""
+"""Multi-agent traffic light example (single shared policy).
+
+Ray, RLlib, TensorFlow and flow are only imported by the functions that use
+them, so --help, argument checking and sweep expansion start instantly, and
+workers that unpickle the callbacks do not pay for unused modules.
+"""
 
 import argparse
 import json
+import os
 
-import ray
-from ray import tune
-from ray.rllib.agents.ppo.ppo_policy import PPOTFPolicy
-from ray.tune import run_experiments
-from ray.tune.registry import register_env
-
-from flow.controllers import GridRouter, SimCarFollowingController
-from flow.core.params import (EnvParams, InFlows, InitialConfig, NetParams,
-                              SumoCarFollowingParams, SumoParams,
-                              VehicleParams)
-from flow.networks import TrafficLightGridNetwork
-from flow.utils.registry import make_create_env
-from flow.utils.rllib import FlowParamsEncoder
-from reward_sharing_env import RewardSharingEnv
-from reward_sharing_env_neighborhoods import RewardSharingEnvSimple
-from reward_sharing_env_knn import RewardSharingEnvKNN
-from flow.envs.multiagent.traffic_light_grid import MultiTrafficLightGridPOEnv
-from basic_env import BasicEnv
-
-try:
-    from ray.rllib.agents.agent import get_agent_class
-except ImportError:
-    from ray.rllib.agents.registry import get_agent_class
+from compact_batch import COMPACT_MODES
+from policy_classes import POLICY_CLASSES
+from sweep import SWEEP_KEYS, expand_sweep, load_sweep, run_tag
 
 
 # Experiment parameters
@@ -41,8 +27,17 @@ SHORT_LENGTH = 300  # length of edges that vehicles start on
 # number of vehicles originating in the left, right, top, and bottom edges
 N_LEFT, N_RIGHT, N_TOP, N_BOTTOM = 1, 1, 1, 1
 
+# reward sharing strategy (see reward_sharing.make_strategy) used by each --env choice
+ENV_SHARING = {
+    "BasicEnv": "none",
+    "RewardSharingEnv": "axis",
+    "RewardSharingEnvSimple": "neighbors",
+    "RewardSharingEnvKNN": "knn",
+    "RewardSharingEnvColight": "knn",
+}
+
 
-def make_flow_params(n_rows, n_columns, edge_inflow, exp_env=BasicEnv, colight_k_nearest_neighbords=5, colight_temperature=0.5, neighbor_weight=0.1):
+def make_flow_params(n_rows, n_columns, edge_inflow, exp_env=None, sharing="none", colight_k_nearest_neighbords=5, colight_temperature=0.5, neighbor_weight=0.1, profile=False, profile_dir=None, simulator="traci", restart_every=1, metrics_dir=None, observation_order="flow"):
     """
     Generate the flow params for the experiment.
 
@@ -53,13 +48,49 @@ def make_flow_params(n_rows, n_columns, edge_inflow, exp_env=BasicEnv, colight_k
     n_columns : int
         number of columns in the traffic light grid
     edge_inflow : float
-
+        inflow rate (veh/hr) of every outer edge
+    exp_env : type
+        environment class, SharingEnv (the default) or one of its subclasses
+    sharing : str or reward_sharing.SharingStrategy
+        reward sharing strategy used by SharingEnv
+    profile : bool
+        whether SharingEnv times the phases of every step
+    profile_dir : str
+        directory the step timings are written to, if profiling
+    simulator : str
+        "traci" to simulate with SUMO or "stub" for the in-process queue
+        model of queue_sim.py, which runs exp_env's sharing strategy on a
+        StubSharingEnv
+    restart_every : int
+        number of episodes a SUMO instance is reused for before it is
+        restarted, see sharing_env.SharingEnv
+    metrics_dir : str
+        directory per-step, per-intersection metrics are streamed to, see
+        metrics_recorder.MetricsRecorder
+    observation_order : str
+        "flow" to observe the edges flow's get_state does, or "agent" to
+        observe every agent's own edges, see observation_cache.ObservationCache
 
     Returns
     -------
     dict
         flow_params object
     """
+    from flow.controllers import GridRouter, SimCarFollowingController
+    from flow.core.params import (EnvParams, InFlows, InitialConfig, NetParams,
+                                  SumoCarFollowingParams, SumoParams,
+                                  VehicleParams)
+    from flow.networks import TrafficLightGridNetwork
+    from sharing_env import SharingEnv
+
+    if exp_env is None:
+        exp_env = SharingEnv
+    if simulator == "stub":
+        from queue_sim import StubSharingEnv
+
+        sharing = exp_env.SHARING or sharing
+        exp_env = StubSharingEnv
+
     # we place a sufficient number of vehicles to ensure they confirm with the
     # total number specified above. We also use a "right_of_way" speed mode to
     # support traffic light compliance
@@ -104,7 +135,7 @@ def make_flow_params(n_rows, n_columns, edge_inflow, exp_env=BasicEnv, colight_k
         # name of the network class the experiment is running on
         network=TrafficLightGridNetwork,
         # simulator that is used by the experiment
-        simulator="traci",
+        simulator=simulator,
         # sumo-related parameters (see flow.core.params.SumoParams)
         sim=SumoParams(restart_instance=True, sim_step=1, render=False,),
         # environment related parameters (see flow.core.params.EnvParams)
@@ -118,9 +149,15 @@ def make_flow_params(n_rows, n_columns, edge_inflow, exp_env=BasicEnv, colight_k
                 "tl_type": "static",
                 "num_local_edges": 4,
                 "num_local_lights": 4,
+                "sharing": sharing,
                 "neighbor_weight": neighbor_weight,
                 "k_nearest_neighbor": colight_k_nearest_neighbords,
-                "temperature_factor": colight_temperature
+                "temperature_factor": colight_temperature,
+                "profile": profile,
+                "profile_dir": profile_dir,
+                "restart_every": restart_every,
+                "metrics_dir": metrics_dir,
+                "observation_order": observation_order,
             },
         ),
         # network-related parameters (see flow.core.params.NetParams and the
@@ -154,17 +191,64 @@ def make_flow_params(n_rows, n_columns, edge_inflow, exp_env=BasicEnv, colight_k
     return flow_params
 
 def on_episode_end(info):
-    env = info['env'].get_unwrapped()[0]
-    episode = info['episode']
-    episode.custom_metrics['raw_reward'] = env.raw_reward
+    """
+    Logs the raw reward of the episode and, if profiling, its step times.
 
-def setup_exps_PPO(flow_params):
+    A worker may step several envs, and the callback does not tell which
+    one the episode ran in, so the totals are taken from the last infos of
+    the episode's agents, see sharing_env.SharingMixin.
+    """
+    import numpy as np
+
+    episode = info['episode']
+    agent_ids = [agent_id for agent_id, _ in episode.agent_rewards]
+    infos = [episode.last_info_for(agent_id) or {} for agent_id in agent_ids]
+    raw_rewards = np.array([agent_info.get('raw_reward', 0.0) for agent_info in infos])
+    # agents of the grids of a BatchedGridEnv are named "<grid>/center<i>"
+    num_grids = len({agent_id.rpartition('/')[0] for agent_id in agent_ids})
+    episode.custom_metrics['raw_reward'] = raw_rewards.sum() / max(num_grids, 1)
+    classes = np.array([episode.policy_for(agent_id) for agent_id in agent_ids])
+    if len(set(classes)) > 1:
+        for policy_class in set(classes):
+            # mean per agent, since classes have different numbers of agents
+            episode.custom_metrics['raw_reward_' + policy_class] = np.mean(
+                raw_rewards[classes == policy_class])
+    profiles = [agent_info['profile'] for agent_info in infos if 'profile' in agent_info]
+    for key in set().union(*profiles):
+        # averaged over the grids of a BatchedGridEnv
+        episode.custom_metrics[key] = np.mean(
+            [profile[key] for profile in profiles if key in profile])
+
+def setup_exps_PPO(flow_params, num_workers=min(N_CPUS, N_ROLLOUTS), lr=1e-4, version=0, grids_per_env=1, policy_classes="single", num_envs_per_worker=1, train_batch_size=HORIZON * N_ROLLOUTS, compact_batches="none"):
     """
     Experiment setup with PPO using RLlib.
 
+    The learner waits for every worker to finish its rollouts before each
+    training iteration.
+
     Parameters
     ----------
     flow_params : dictionary of flow parameters
+    num_workers : int
+        number of rollout workers, the trial uses num_workers + 1 CPUs
+    lr : float
+        learning rate
+    version : int
+        version of the registered gym environment, experiments that run
+        together need different versions
+    grids_per_env : int
+        number of independent grids stepped together by every env of a
+        worker, see batched_env.BatchedGridEnv
+    policy_classes : str
+        how agents are split into separately trained policies, see
+        policy_classes.POLICY_CLASSES
+    num_envs_per_worker : int
+        number of envs every worker steps, their agents share one forward pass
+    train_batch_size : int
+        number of env steps per training batch
+    compact_batches : str
+        encoding of the sample batches workers send to the learner, see
+        compact_batch.COMPACT_MODES
 
     Returns
     -------
@@ -175,49 +259,124 @@ def setup_exps_PPO(flow_params):
     dict
         training configuration parameters
     """
+    from ray.rllib.agents.ppo.ppo_policy import PPOTFPolicy
+
     alg_run = "PPO"
     agent_cls = get_agent_class(alg_run)
     config = agent_cls._default_config.copy()
-    config["num_workers"] = min(N_CPUS, N_ROLLOUTS)
-    config["train_batch_size"] = HORIZON * N_ROLLOUTS
+    config["num_workers"] = num_workers
+    config["num_envs_per_worker"] = num_envs_per_worker
+    config["train_batch_size"] = train_batch_size
     config["simple_optimizer"] = True
+
+    return setup_multiagent(alg_run, PPOTFPolicy, config, flow_params, lr,
+                            version, grids_per_env, policy_classes, compact_batches)
+
+
+def setup_exps_APPO(flow_params, num_workers=min(N_CPUS, N_ROLLOUTS), lr=1e-4, version=0, grids_per_env=1, policy_classes="single", num_envs_per_worker=1, train_batch_size=HORIZON * N_ROLLOUTS, compact_batches="none"):
+    """
+    Experiment setup with asynchronous PPO (APPO) using RLlib.
+
+    Workers keep sampling while the learner trains on the fragments they
+    already sent, so a slow SUMO rollout no longer stalls an iteration.
+    Takes the same parameters and returns the same values as setup_exps_PPO.
+    """
+    from ray.rllib.agents.ppo.appo_policy import AsyncPPOTFPolicy
+
+    alg_run = "APPO"
+    agent_cls = get_agent_class(alg_run)
+    config = agent_cls._default_config.copy()
+    config["num_workers"] = num_workers
+    config["num_envs_per_worker"] = num_envs_per_worker
+    config["train_batch_size"] = train_batch_size
+    # rollout fragments workers send to the learner, a quarter of an episode
+    config["sample_batch_size"] = HORIZON // 4
+    # APPO inherits num_gpus: 1 from IMPALA; train on the CPU like PPO does
+    config["num_gpus"] = 0
+
+    return setup_multiagent(alg_run, AsyncPPOTFPolicy, config, flow_params, lr,
+                            version, grids_per_env, policy_classes, compact_batches)
+
+
+def get_agent_class(alg_run):
+    try:
+        from ray.rllib.agents.agent import get_agent_class
+    except ImportError:
+        from ray.rllib.agents.registry import get_agent_class
+    return get_agent_class(alg_run)
+
+
+def setup_multiagent(alg_run, policy_cls, config, flow_params, lr, version, grids_per_env, policy_classes, compact_batches="none"):
+    """
+    Fills in the training, env and multiagent settings every algorithm
+    shares and registers the env, see setup_exps_PPO for the parameters.
+
+    Returns
+    -------
+    str
+        name of the training algorithm
+    str
+        name of the gym environment to be trained
+    dict
+        training configuration parameters
+    """
+    from ray import tune
+    from ray.tune.registry import register_env
+    from flow.utils.registry import make_create_env
+    from flow.utils.rllib import FlowParamsEncoder
+    from batched_env import BatchedGridEnv
+    from policy_classes import make_policy_mapping
+
     config["gamma"] = 0.999  # discount rate
     config["model"].update({"fcnet_hiddens": [32, 32]})
-    config["lr"] = tune.grid_search([1e-4])
+    config["lr"] = tune.grid_search([lr])
     config["horizon"] = HORIZON
     config["clip_actions"] = False  # FIXME(ev) temporary ray bug
     config["observation_filter"] = "NoFilter"
     config["callbacks"] = {'on_episode_end':tune.function(on_episode_end)}
+    if compact_batches != "none":
+        from compact_batch import compact_policy, make_encoder
+
+        policy_cls = compact_policy(policy_cls)
+        config["callbacks"]["on_sample_end"] = tune.function(make_encoder(compact_batches))
 
     # save the flow params for replay
     flow_json = json.dumps(flow_params, cls=FlowParamsEncoder, sort_keys=True, indent=4)
     config["env_config"]["flow_params"] = flow_json
     config["env_config"]["run"] = alg_run
 
-    create_env, env_name = make_create_env(params=flow_params, version=0)
-
-    # Register as rllib env
-    register_env(env_name, create_env)
+    create_env, env_name = make_create_env(params=flow_params, version=version)
 
+    # only the spaces are needed, the driver keeps no simulator running
     test_env = create_env()
     obs_space = test_env.observation_space
     act_space = test_env.action_space
+    test_env.terminate()
 
-    def gen_policy():
-        return PPOTFPolicy, obs_space, act_space, {}
+    if grids_per_env > 1:
+        create_grid_env = create_env
 
-    # Setup PG with a single policy graph for all agents
-    policy_graphs = {"av": gen_policy()}
+        def create_env(*_):
+            return BatchedGridEnv(create_grid_env, grids_per_env)
 
-    def policy_mapping_fn(_):
-        return "av"
+    # Register as rllib env
+    register_env(env_name, create_env)
+
+    def gen_policy():
+        return policy_cls, obs_space, act_space, {}
+
+    # Setup PG with one policy graph per class of agents
+    grid_array = flow_params["net"].additional_params["grid_array"]
+    policy_ids, policy_mapping_fn = make_policy_mapping(
+        policy_classes, grid_array["row_num"], grid_array["col_num"])
+    policy_graphs = {policy_id: gen_policy() for policy_id in policy_ids}
 
     config.update(
         {
             "multiagent": {
                 "policies": policy_graphs,
                 "policy_mapping_fn": tune.function(policy_mapping_fn),
-                "policies_to_train": ["av"],
+                "policies_to_train": policy_ids,
             }
         }
     )
@@ -247,10 +406,13 @@ if __name__ == "__main__":
         "--run_mode",
         type=str,
         default="local",
-        help="Experiment run mode (local | cluster)",
+        choices=["local", "cluster", "local_cluster"],
+        help="Run on this machine, on a multi-node cluster, or on several Ray nodes "
+        "started on this machine to try the cluster setup",
     )
     parser.add_argument(
-        "--algo", type=str, default="PPO", help="RL method to use (PPO)"
+        "--algo", type=str, default="PPO", choices=["PPO", "APPO"],
+        help="RL method to use (PPO | APPO)"
     )
     parser.add_argument(
         "--num_rows",
@@ -272,7 +434,7 @@ if __name__ == "__main__":
     )
     parser.add_argument('--env',
             default='BasicEnv',
-            choices=['BasicEnv', 'RewardSharingEnv', 'RewardSharingEnvSimple', 'RewardSharingEnvColight'],
+            choices=list(ENV_SHARING),
             help='The environment to use to run the simulation')
     parser.add_argument('--k_nearest',
             type=int,
@@ -286,52 +448,240 @@ if __name__ == "__main__":
             type=float,
             default=0.1,
             help='The neighbor weight used for reward sharing')
+    parser.add_argument('--lr',
+            type=float,
+            default=1e-4,
+            help='The learning rate')
+    parser.add_argument('--sweep',
+            help='JSON sweep spec (see sweep.py) to run a grid or random search '
+                 'over the other options instead of a single experiment')
+    parser.add_argument('--num_cpus',
+            type=int,
+            help='CPUs to pack experiments onto in local mode, defaults to '
+                 'all cores for a sweep and N_CPUS + 1 otherwise')
+    parser.add_argument('--workers_per_trial',
+            type=int,
+            default=min(N_CPUS, N_ROLLOUTS),
+            help='Rollout workers of every experiment of a sweep')
+    parser.add_argument('--grids_per_worker',
+            type=int,
+            default=1,
+            help='Independent grids stepped together by every rollout worker')
+    parser.add_argument('--profile',
+            action='store_true',
+            help='Report the time spent in every phase of an env step as custom metrics')
+    parser.add_argument('--profile_dir',
+            help='Directory to also write per-episode step timings to when profiling')
+    parser.add_argument('--simulator',
+            default='traci',
+            choices=['traci', 'stub'],
+            help='Simulate with SUMO (traci) or the in-process queue model (stub)')
+    parser.add_argument('--restart_every',
+            type=int,
+            default=1,
+            help='Episodes to reuse a SUMO instance for before restarting it')
+    parser.add_argument('--metrics_dir',
+            help='Directory to stream per-step, per-intersection metrics to')
+    parser.add_argument('--observation_order',
+            default='flow',
+            choices=['flow', 'agent'],
+            help="Observe the edges flow does, which on grids of more than 10 "
+            "intersections belong to another intersection, or every agent's own")
+    parser.add_argument('--policy_classes',
+            default='single',
+            choices=POLICY_CLASSES,
+            help='Train one shared policy or one per corner, edge and interior intersections')
+    parser.add_argument('--auto_config',
+            action='store_true',
+            help='Size workers, envs per worker and batches from the detected '
+                 'cores and memory and a short calibration rollout')
+    parser.add_argument('--num_workers',
+            type=int,
+            help='Rollout workers, overrides N_CPUS and --auto_config')
+    parser.add_argument('--envs_per_worker',
+            type=int,
+            help='Envs stepped by every worker, overrides --auto_config')
+    parser.add_argument('--train_batch_size',
+            type=int,
+            help='Env steps per training batch, overrides --auto_config')
+    parser.add_argument('--compact_batches',
+            default='none',
+            choices=COMPACT_MODES,
+            help='Encode the observations workers send to the learner as uint8 '
+            'or float16, see compact_batch.py')
     parser.add_argument('--password',
             default='password.txt',
-            help='Password file to be used for redis')
+            help='Password file to be used for redis, generated if missing')
+    parser.add_argument('--cluster',
+            help='JSON cluster spec, see cluster.py. With --run_mode cluster its '
+            'nodes are started and stopped again at the end, with local_cluster '
+            'they are started on this machine')
+    parser.add_argument('--redis_address',
+            default='localhost:6379',
+            help='Head of an already running cluster, for --run_mode cluster '
+            'without --cluster')
+    parser.add_argument('--checkpoint_freq',
+            type=int,
+            default=25,
+            help='Training iterations between checkpoints, the most progress a '
+            'trial loses when a node goes down')
+    parser.add_argument('--resume',
+            action='store_true',
+            help='Resume the experiments of a previous run from their checkpoints')
+    parser.add_argument('--kill_node_after',
+            type=float,
+            help='With --run_mode local_cluster, kill a worker node after this '
+            'many seconds to try the recovery from node loss')
     args = parser.parse_args()
-    envs = {'BasicEnv':BasicEnv,
-            'RewardSharingEnv': RewardSharingEnv,
-            'RewardSharingEnvSimple':RewardSharingEnvSimple,
-            'RewardSharingEnvKNN':RewardSharingEnvKNN
-            }
-
-    EDGE_INFLOW = args.inflow_rate  # inflow rate of vehicles at every edge
-    N_ROWS = args.num_rows  # number of row of bidirectional lanes
-    N_COLUMNS = args.num_cols  # number of columns of bidirectional lanes
 
-    flow_params = make_flow_params(N_ROWS, N_COLUMNS, EDGE_INFLOW, exp_env=envs[args.env])
+    defaults = {key: getattr(args, key) for key in SWEEP_KEYS}
+    if args.sweep:
+        runs = expand_sweep(load_sweep(args.sweep), defaults, ENV_SHARING)
+        num_workers = args.workers_per_trial
+        num_cpus = args.num_cpus or os.cpu_count()
+    else:
+        runs = [defaults]
+        num_workers = min(N_CPUS, N_ROLLOUTS)
+        num_cpus = args.num_cpus or N_CPUS + 1
 
     upload_dir = args.upload_dir
     RUN_MODE = args.run_mode
     ALGO = args.algo
 
-    if ALGO == "PPO":
-        alg_run, env_name, config = setup_exps_PPO(flow_params)
-    else:
-        raise NotImplementedError
+    N_ITER = 1000 if RUN_MODE == "local" else 2000
+    cluster_spec = None
+    if args.cluster:
+        from cluster import load_cluster
+
+        cluster_spec = load_cluster(args.cluster)
+    # only the nodes started here advertise SUMO slots; an existing cluster at
+    # --redis_address has none, and trials asking for one would queue forever
+    starts_cluster = RUN_MODE == "local_cluster" or (
+        RUN_MODE == "cluster" and cluster_spec is not None
+    )
+
+    def run_flow_params(run):
+        return make_flow_params(
+            run["num_rows"],
+            run["num_cols"],
+            run["inflow_rate"],
+            sharing=ENV_SHARING[run["env"]],
+            colight_k_nearest_neighbords=run["k_nearest"],
+            colight_temperature=run["temp"],
+            neighbor_weight=run["neighbor_weight"],
+            profile=args.profile,
+            profile_dir=args.profile_dir,
+            simulator=args.simulator,
+            restart_every=args.restart_every,
+            metrics_dir=args.metrics_dir,
+            observation_order=args.observation_order,
+        )
+
+    num_envs_per_worker = 1
+    train_batch_size = HORIZON * N_ROLLOUTS
+    if args.auto_config:
+        from flow.utils.registry import make_create_env
+        from autoconfig import calibrate, plan
+
+        # calibrate on the largest grid, it has the most expensive steps
+        largest = max(runs, key=lambda run: run["num_rows"] * run["num_cols"])
+        create_env, _ = make_create_env(params=run_flow_params(largest))
+        sizes = plan(calibrate(create_env), HORIZON, num_cpus=args.num_cpus)
+        print("Auto config:", sizes)
+        num_cpus = sizes["num_cpus"]
+        num_envs_per_worker = sizes["num_envs_per_worker"]
+        if args.sweep:
+            # trials share the machine, so only the per-worker sizes apply
+            train_batch_size = num_workers * num_envs_per_worker * HORIZON
+        else:
+            num_workers = sizes["num_workers"]
+            train_batch_size = sizes["train_batch_size"]
+    if args.num_workers is not None:
+        num_workers = args.num_workers
+    if args.envs_per_worker is not None:
+        num_envs_per_worker = args.envs_per_worker
+    if args.train_batch_size is not None:
+        train_batch_size = args.train_batch_size
+    if not args.sweep and args.num_cpus is None:
+        num_cpus = max(num_cpus, num_workers + 1)
+
+    experiments = {}
+    for version, run in enumerate(runs):
+        flow_params = run_flow_params(run)
+
+        if ALGO == "PPO":
+            setup_exps = setup_exps_PPO
+        elif ALGO == "APPO":
+            setup_exps = setup_exps_APPO
+        else:
+            raise NotImplementedError
+        alg_run, env_name, config = setup_exps(
+            flow_params,
+            num_workers=num_workers,
+            lr=run["lr"],
+            version=version,
+            grids_per_env=args.grids_per_worker,
+            policy_classes=args.policy_classes,
+            num_envs_per_worker=num_envs_per_worker,
+            train_batch_size=train_batch_size,
+            compact_batches=args.compact_batches,
+        )
+
+        exp_tag = {
+            "run": alg_run,
+            "env": env_name,
+            "checkpoint_freq": args.checkpoint_freq,
+            "checkpoint_at_end": True,
+            "max_failures": 10,
+            "stop": {"training_iteration": N_ITER},
+            "config": config,
+            "num_samples": 1,
+        }
+
+        if upload_dir:
+            exp_tag["upload_dir"] = "s3://{}".format(upload_dir)
+        if starts_cluster:
+            from cluster import SUMO_RESOURCE
+
+            # every rollout worker runs SUMO, so it must land on a node with a slot
+            config["custom_resources_per_worker"] = {SUMO_RESOURCE: 1}
+        if cluster_spec is not None and "local_dir" in cluster_spec:
+            exp_tag["local_dir"] = cluster_spec["local_dir"]
+
+        name = run_tag(run) if args.sweep else flow_params["exp_tag"]
+        experiments[name] = exp_tag
 
-    with open('password.txt' ,'r') as f:
-        password = f.readline()
+    import ray
+    from ray.tune import run_experiments
+    from cluster import (LocalCluster, local_spec, read_password, start_cluster,
+                         stop_cluster)
 
+    password = read_password(args.password)
+    local_cluster = None
+    started_spec = None
     if RUN_MODE == "local":
-        ray.init(num_cpus=N_CPUS + 1, redis_password=password)
-        N_ITER = 1000
+        # Tune queues the experiments and runs as many as fit in num_cpus, each
+        # trial reserving num_workers + 1 CPUs
+        ray.init(num_cpus=num_cpus, redis_password=password)
     elif RUN_MODE == "cluster":
-        ray.init(redis_address="localhost:6379")
-        N_ITER = 2000
-
-    exp_tag = {
-        "run": alg_run,
-        "env": env_name,
-        "checkpoint_freq": 25,
-        "max_failures": 10,
-        "stop": {"training_iteration": N_ITER},
-        "config": config,
-        "num_samples": 1,
-    }
-
-    if upload_dir:
-        exp_tag["upload_dir"] = "s3://{}".format(upload_dir)
-
-    run_experiments({flow_params["exp_tag"]: exp_tag},)
+        redis_address = args.redis_address
+        if cluster_spec is not None:
+            redis_address = start_cluster(cluster_spec, password)
+            started_spec = cluster_spec
+        ray.init(redis_address=redis_address, redis_password=password)
+    elif RUN_MODE == "local_cluster":
+        local_cluster = LocalCluster(cluster_spec or local_spec(num_cpus), password)
+        if args.kill_node_after is not None:
+            local_cluster.kill_worker_after(args.kill_node_after)
+        ray.init(redis_address=local_cluster.redis_address, redis_password=password)
+
+    try:
+        # on a cluster started here, trials wait for nodes to come back instead of
+        # failing when a lost node leaves too few resources
+        run_experiments(experiments, resume=args.resume, queue_trials=starts_cluster)
+    finally:
+        ray.shutdown()
+        if local_cluster is not None:
+            local_cluster.shutdown()
+        if started_spec is not None:
+            stop_cluster(started_spec)
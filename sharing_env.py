@@ -0,0 +1,347 @@
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+import traci.constants as tc
+from traci.exceptions import FatalTraCIError, TraCIException
+from flow.envs.multiagent.traffic_light_grid import MultiTrafficLightGridPOEnv
+from flow.utils.exceptions import FatalFlowError
+
+from agent_index import AgentIndex
+from metrics_recorder import MetricsRecorder
+from neighborhood import GridNeighborhood, NeighborhoodIndex
+from observation_cache import CachedObservationMixin
+from profiling import StepProfiler
+from reward_sharing import SharingStrategy, make_strategy
+
+
+class SharingMixin:
+    """ Reward sharing on top of a MultiTrafficLightGridPOEnv compatible env class
+
+    The strategy is taken from the "sharing" additional param, either the name of one
+    of reward_sharing.SHARING_STRATEGIES or a SharingStrategy instance. Subclasses can
+    pin a strategy by setting SHARING.
+
+    Setting the "profile" additional param times every phase of a step with a
+    profiling.StepProfiler, which writes a trace to "profile_dir" if that is set.
+
+    Setting the "metrics_dir" additional param streams the raw and shared reward, queue
+    length and light state of every intersection at every step there with a
+    metrics_recorder.MetricsRecorder. The base env must then implement queue_lengths.
+
+    Distances between intersections are grid hops by default. With the "neighborhood"
+    additional param set to "network", they are measured along the edges of the
+    network instead, see neighborhood.NeighborhoodIndex, in hops or, with the
+    "neighborhood_metric" additional param set to "length", in meters. The KNN
+    temperature_factor divides these distances, so a value tuned for hops must be
+    scaled by the typical edge length for meters.
+
+    Every step reports the episode's raw reward of every agent so far under
+    "raw_reward" in the agent's info, and the last step of an episode the step
+    profile under "profile" in the info of agent 0. RLlib's episode callbacks do not
+    tell which env of a worker an episode ran in, but they do see its infos.
+    """
+
+    SHARING = None
+
+    def __init__(self, env_params, sim_params, network, simulator="traci"):
+        super().__init__(env_params, sim_params, network, simulator)
+        additional_params = env_params.additional_params
+        sharing = self.SHARING or additional_params.get("sharing", "none")
+        self.agent_index = AgentIndex(self.rows, self.cols)
+        self.sharing_strategy: SharingStrategy = make_strategy(sharing, additional_params)
+        if additional_params.get("neighborhood", "grid") == "network":
+            self.neighborhood = NeighborhoodIndex.from_network(
+                network,
+                self.agent_index.names,
+                additional_params.get("neighborhood_metric", "hops"),
+            )
+        else:
+            self.neighborhood = GridNeighborhood(self.rows, self.cols)
+        self.sharing_strategy.compile(self.neighborhood)
+        self.raw_reward = 0
+        self.last_raw_rewards = np.zeros(self.agent_index.num_agents)
+        # episode sums of the raw reward of every agent, by agent id
+        self.raw_rewards_by_agent = np.zeros(self.agent_index.num_agents)
+        self.last_directions = np.zeros(self.agent_index.num_agents)
+
+        self.profiler = None
+        if additional_params.get("profile", False):
+            self.profiler = StepProfiler(additional_params.get("profile_dir"))
+
+        self.recorder = None
+        self.episode = 0
+        if additional_params.get("metrics_dir") is not None:
+            self.recorder = MetricsRecorder(
+                additional_params["metrics_dir"], self.agent_index.num_agents
+            )
+
+    def step(self, rl_actions):
+        profiler = self.profiler
+        if profiler is None:
+            result = super().step(rl_actions)
+        else:
+            profiler.begin_step()
+            start = time.perf_counter()
+            result = super().step(rl_actions)
+            profiler.end_step(start)
+        self._report_episode(result[3], result[2]["__all__"])
+        return result
+
+    def _report_episode(self, infos: Dict[str, dict], done: bool):
+        """ Adds the episode totals the on_episode_end callback reads to infos """
+        for name, raw_reward in zip(self.agent_index.names, self.raw_rewards_by_agent.tolist()):
+            info = infos.get(name)
+            if info is not None:
+                info["raw_reward"] = raw_reward
+        first = infos.get(self.agent_index.names[0])
+        if done and self.profiler is not None and first is not None:
+            first["profile"] = self.profiler.episode_metrics()
+
+    def _apply_rl_actions(self, rl_actions):
+        profiler = self.profiler
+        if profiler is None:
+            return super()._apply_rl_actions(rl_actions)
+        start = time.perf_counter()
+        super()._apply_rl_actions(rl_actions)
+        profiler.record("actions", start)
+
+    def get_state(self):
+        profiler = self.profiler
+        if profiler is None:
+            return super().get_state()
+        start = time.perf_counter()
+        obs = super().get_state()
+        profiler.record("observation", start)
+        return obs
+
+    def compute_reward(self, rl_actions, **kwargs):
+        """ Adjusts the raw reward to include the rewards of other agents, as given by
+        the sharing strategy.
+
+        @returns a mapping from an agent's name to its sharing adjusted reward
+        """
+        profiler = self.profiler
+        if profiler is not None:
+            start = time.perf_counter()
+        raw_rewards: Dict[str, float] = super().compute_reward(rl_actions, **kwargs)
+        if profiler is not None:
+            profiler.record("raw_reward", start)
+        if not raw_rewards:
+            return {}
+
+        if profiler is not None:
+            start = time.perf_counter()
+        id_nums, rewards = self.agent_index.to_array(raw_rewards)
+        self.raw_reward += np.sum(rewards)
+        self.raw_rewards_by_agent += rewards
+        directions = self.direction.ravel()
+        # inputs of the last sharing, by agent id, kept for trajectory recording
+        self.last_raw_rewards = rewards
+        self.last_directions = directions
+
+        adjusted_rewards = self.sharing_strategy.share(rewards, directions)
+        adjusted = self.agent_index.to_dict(adjusted_rewards, id_nums)
+        if profiler is not None:
+            profiler.record("sharing", start)
+
+        if self.recorder is not None:
+            if profiler is not None:
+                start = time.perf_counter()
+            self.recorder.record(
+                self.episode,
+                self.time_counter,
+                raw_reward=rewards,
+                shared_reward=adjusted_rewards,
+                queue_length=self.queue_lengths(),
+                direction=directions,
+                yellow=self.currently_yellow.ravel(),
+            )
+            if profiler is not None:
+                profiler.record("metrics", start)
+        return adjusted
+
+    def reset(self):
+        profiler = self.profiler
+        if profiler is None:
+            obs = self._reset_simulation()
+        else:
+            profiler.end_episode()
+            start = time.perf_counter()
+            obs = self._reset_simulation()
+            profiler.record("reset", start)
+        self.raw_reward = 0
+        self.raw_rewards_by_agent = np.zeros(self.agent_index.num_agents)
+        self.episode += 1
+        return obs
+
+    def _reset_simulation(self):
+        """ Resets the simulated grid, without the per-episode bookkeeping of reset
+
+        @returns the first observations of the new episode
+        """
+        return super().reset()
+
+    def terminate(self):
+        if self.recorder is not None:
+            self.recorder.close()
+        super().terminate()
+
+
+class SharingEnv(SharingMixin, CachedObservationMixin, MultiTrafficLightGridPOEnv):
+    """ Multiagent traffic light grid environment with a pluggable reward sharing strategy,
+    simulated by SUMO
+
+    Observations are built by an observation_cache.ObservationCache.
+
+    One SUMO process serves up to the "restart_every" additional param episodes (1 by
+    default). In between, reset reuses the running process with flow's in-place reset,
+    which removes every vehicle and re-adds the initial ones, and puts the lights back
+    into the state, in SUMO and in the env, the first episode on the process started
+    from. SUMO's clock keeps running across reused episodes, so an instance is only
+    reused while the next episode ends before the inflows do. If the reset leaves
+    vehicles of the previous episode behind, a backlog of vehicles waiting to be
+    inserted or other lights, or the TraCI connection fails, the instance is
+    restarted after all.
+
+    flow already subscribes to the vehicle and traffic light variables it reads. The
+    edge variables read here are subscribed to once per SUMO instance as well, so
+    their values arrive with the simulation step instead of one TraCI round trip per
+    edge and step.
+    """
+
+    def __init__(self, env_params, sim_params, network, simulator="traci"):
+        super().__init__(env_params, sim_params, network, simulator)
+        self.restart_every: int = env_params.additional_params.get("restart_every", 1)
+        assert self.restart_every >= 1, "restart_every must be at least 1."
+        # the instance started by flow's __init__ has not run an episode yet
+        self._episodes_on_instance = 0
+        # SUMO and env light state at the start of the first episode on the instance
+        self._initial_lights = None
+        self._initial_light_arrays = None
+
+        # incoming edges of every intersection and the agent id they belong to
+        self._queue_edges = []
+        queue_agents = []
+        for node_id, edges in self.network.node_mapping:
+            self._queue_edges.extend(edges)
+            queue_agents.extend([self.agent_index.id_num(node_id)] * len(edges))
+        self._queue_agents = np.array(queue_agents, dtype=np.int64)
+        # the TraCI connection the edge subscriptions were made on
+        self._subscribed_api = None
+
+    def _reset_simulation(self):
+        obs = None
+        if self._episodes_on_instance < self.restart_every:
+            self.sim_params.restart_instance = False
+            try:
+                obs = self._reset_in_place()
+            except (FatalFlowError, FatalTraCIError, TraCIException):
+                obs = None
+
+        if obs is None:
+            self.sim_params.restart_instance = True
+            obs = super()._reset_simulation()
+            self._episodes_on_instance = 0
+            self._save_initial_lights()
+        self._episodes_on_instance += 1
+        if self.k.kernel_api is not self._subscribed_api:
+            self._subscribe()
+        return obs
+
+    def _reset_in_place(self) -> Optional[dict]:
+        """ Resets without restarting SUMO
+
+        @returns the first observations, or None if the episode would not start like
+        on a fresh instance
+        """
+        kernel_api = self.k.kernel_api
+        if not self._episode_fits(kernel_api.simulation.getTime()):
+            return None
+        previous_ids = set(kernel_api.vehicle.getIDList())
+        obs = super()._reset_simulation()
+        if self._initial_lights is None:
+            # the first episode on the instance started by flow's __init__
+            self._save_initial_lights()
+            return obs
+        self._restore_initial_lights()
+        if not self._is_clean_start(previous_ids):
+            return None
+        # observed again, with the restored lights
+        return self.get_state()
+
+    def _episode_fits(self, now: float) -> bool:
+        """ @returns whether an episode starting at now ends before the first inflow
+        stops, SUMO's clock keeps running across reused episodes
+        """
+        env_params = self.env_params
+        episode_seconds = (
+            self.sim_params.sim_step
+            * env_params.sims_per_step
+            * (env_params.warmup_steps + env_params.horizon)
+        )
+        inflow_end = min(
+            (float(inflow.get("end", np.inf)) for inflow in self.net_params.inflows.get()),
+            default=np.inf,
+        )
+        return now + episode_seconds <= inflow_end
+
+    def _light_states(self) -> List[str]:
+        trafficlight = self.k.kernel_api.trafficlight
+        return [trafficlight.getRedYellowGreenState(name) for name in self.agent_index.names]
+
+    def _save_initial_lights(self):
+        self._initial_lights = self._light_states()
+        self._initial_light_arrays = [
+            np.copy(array) for array in (self.direction, self.currently_yellow, self.last_change)
+        ]
+
+    def _restore_initial_lights(self):
+        trafficlight = self.k.kernel_api.trafficlight
+        for name, state in zip(self.agent_index.names, self._initial_lights):
+            trafficlight.setRedYellowGreenState(name, state)
+        for array, initial in zip(
+            (self.direction, self.currently_yellow, self.last_change), self._initial_light_arrays
+        ):
+            array[:] = initial
+
+    def _subscribe(self):
+        """ Subscribes to the edge variables read every step, on a new SUMO instance """
+        edge = self.k.kernel_api.edge
+        for edge_id in self._queue_edges:
+            edge.subscribe(edge_id, [tc.LAST_STEP_VEHICLE_HALTING_NUMBER])
+        self._subscribed_api = self.k.kernel_api
+
+    def queue_lengths(self) -> np.ndarray:
+        """ @returns the number of halting vehicles on the incoming edges of every
+        intersection, by agent id
+        """
+        edge = self.k.kernel_api.edge
+        results = edge.getAllSubscriptionResults()
+        halting = [
+            # before the first step of a new instance, nothing has been delivered yet
+            results[edge_id][tc.LAST_STEP_VEHICLE_HALTING_NUMBER]
+            if edge_id in results
+            else edge.getLastStepHaltingNumber(edge_id)
+            for edge_id in self._queue_edges
+        ]
+        return np.bincount(
+            self._queue_agents, weights=halting, minlength=self.agent_index.num_agents
+        )
+
+    def _is_clean_start(self, previous_ids: set) -> bool:
+        """ Checks that a reset without restart gives the initial conditions of a fresh
+        SUMO instance.
+
+        @returns whether no vehicle but the initial ones survived the reset, at most one
+        vehicle per inflow is waiting to be inserted and the lights show the state the
+        first episode on the instance started from
+        """
+        kernel_api = self.k.kernel_api
+        vehicle_ids = set(kernel_api.vehicle.getIDList())
+        if (vehicle_ids & previous_ids) - set(self.initial_ids):
+            return False
+        pending = kernel_api.simulation.getMinExpectedNumber() - len(vehicle_ids)
+        if pending > len(self.net_params.inflows.get()):
+            return False
+        return self._light_states() == self._initial_lights
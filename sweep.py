@@ -0,0 +1,103 @@
+"""Expansion of experiment sweep specs into the configurations of single runs.
+
+A sweep spec is a JSON object with an optional "search" ("grid" or "random"), an
+optional "num_samples" and "seed" for random search, and a value list for any of
+SWEEP_KEYS, e.g.
+
+    {"search": "grid", "env": ["BasicEnv", "RewardSharingEnvKNN"], "num_rows": [3, 5],
+     "num_cols": [3, 5], "temp": [0.1, 0.5, 1.0]}
+
+Keys that are missing keep their command line value. Random search picks a value
+from each list, or samples uniformly from {"low": ..., "high": ...} for float keys.
+"""
+
+import itertools
+import json
+import random
+from typing import Dict, List
+
+SWEEP_KEYS = (
+    "env",
+    "num_rows",
+    "num_cols",
+    "inflow_rate",
+    "neighbor_weight",
+    "k_nearest",
+    "temp",
+    "lr",
+)
+FLOAT_KEYS = ("neighbor_weight", "temp", "lr")
+INT_KEYS = ("num_rows", "num_cols", "inflow_rate", "k_nearest")
+
+# sweep keys that change the result of each reward sharing strategy
+SHARING_KEYS = {
+    "none": (),
+    "axis": ("neighbor_weight",),
+    "neighbors": ("neighbor_weight",),
+    "knn": ("k_nearest", "temp"),
+}
+
+
+def load_sweep(path: str) -> dict:
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def expand_sweep(spec: dict, defaults: dict, env_sharing: Dict[str, str]) -> List[dict]:
+    """ Expands a sweep spec into one configuration per run.
+
+    Sharing params the strategy of a run's env ignores are reset to their default, so
+    that e.g. BasicEnv is not trained once per neighbor_weight.
+
+    @returns a list of mappings from every key of SWEEP_KEYS to its value
+    """
+    unknown = set(spec) - set(SWEEP_KEYS) - {"search", "num_samples", "seed"}
+    if unknown:
+        raise ValueError(f"Unknown sweep keys {sorted(unknown)}.")
+    axes = {key: spec.get(key, [defaults[key]]) for key in SWEEP_KEYS}
+
+    search = spec.get("search", "grid")
+    if search == "grid":
+        for key, values in axes.items():
+            if not isinstance(values, list):
+                raise ValueError(f"Grid search values of {key} must be a list.")
+        runs = [dict(zip(axes, values)) for values in itertools.product(*axes.values())]
+    elif search == "random":
+        rng = random.Random(spec.get("seed"))
+        runs = [
+            {key: _sample(key, values, rng) for key, values in axes.items()}
+            for _ in range(spec.get("num_samples", 1))
+        ]
+    else:
+        raise ValueError(f"Unknown search {search}, expected grid or random.")
+
+    configs = []
+    for run in runs:
+        if run["env"] not in env_sharing:
+            raise ValueError(f"Unknown env {run['env']}.")
+        for key in FLOAT_KEYS:
+            run[key] = float(run[key])
+        for key in INT_KEYS:
+            run[key] = int(run[key])
+        relevant = SHARING_KEYS[env_sharing[run["env"]]]
+        for key in ("neighbor_weight", "k_nearest", "temp"):
+            if key not in relevant:
+                run[key] = defaults[key]
+        if run not in configs:
+            configs.append(run)
+    return configs
+
+
+def run_tag(run: dict) -> str:
+    """ @returns an experiment name that tells the runs of a sweep apart """
+    return "_".join(f"{key}{run[key]}" for key in SWEEP_KEYS)
+
+
+def _sample(key: str, values, rng: random.Random):
+    if isinstance(values, dict):
+        if key not in FLOAT_KEYS:
+            raise ValueError(f"Only {FLOAT_KEYS} can be sampled from a range.")
+        return rng.uniform(values["low"], values["high"])
+    if isinstance(values, list):
+        return rng.choice(values)
+    return values
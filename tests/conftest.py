@@ -0,0 +1,34 @@
+import os
+import sys
+
+import pytest
+
+# the project's modules live flat at the top of the repository
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import benchmark  # noqa: E402
+
+
+def project_modules():
+    return {
+        name
+        for name, module in list(sys.modules.items())
+        if os.path.dirname(os.path.abspath(getattr(module, "__file__", None) or "/")) == ROOT
+    }
+
+
+@pytest.fixture
+def stand_in(monkeypatch):
+    """ Installs benchmark's stand-in for flow and TraCI for one test.
+
+    Project modules imported during the test are built on the stand-in, so they are
+    dropped along with it once the test ends. Modules that import flow are therefore
+    imported inside the tests that need them.
+    """
+    for name, module in benchmark.stand_in_modules().items():
+        monkeypatch.setitem(sys.modules, name, module)
+    imported = project_modules()
+    yield
+    for name in project_modules() - imported:
+        del sys.modules[name]
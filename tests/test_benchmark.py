@@ -0,0 +1,11 @@
+import os
+
+import benchmark
+
+
+def test_run_experiment_imports_within_budget(monkeypatch):
+    """ Far above the 0.5 s of --import_budget, so busy CI machines pass, but an eager
+    import of ray, RLlib or flow still fails on the loaded HEAVY_MODULES
+    """
+    monkeypatch.chdir(os.path.dirname(os.path.abspath(benchmark.__file__)))
+    assert benchmark.check_import_budget(2.0)
@@ -0,0 +1,106 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from compact_batch import (QUANTIZATION_RANGES, ObservationCodec, compact_policy,
+                           make_encoder, validate_ppo)
+from policy_server import PolicyNetwork
+
+
+def observations(n=500, obs_dim=42, seed=0):
+    rng = np.random.RandomState(seed)
+    codec = ObservationCodec(obs_dim, "uint8")
+    obs = np.empty((n, obs_dim), dtype=np.float32)
+    for name, columns in codec.groups.items():
+        if name == "lights":
+            obs[:, columns] = rng.randint(0, 2, (n, len(columns)))
+        else:
+            obs[:, columns] = rng.rand(n, len(columns)) * QUANTIZATION_RANGES[name]
+    return obs
+
+
+def test_uint8_round_trip_is_within_half_a_step():
+    obs = observations()
+    codec = ObservationCodec(obs.shape[1], "uint8")
+    codes = codec.encode(obs)
+    assert codes.dtype == np.uint8 and codes.shape == (len(obs), 42)
+    errors = np.abs(codec.decode(codes) - obs)
+    for name, columns in codec.groups.items():
+        if name == "lights":
+            assert errors[:, columns].max() == 0
+        else:
+            step = QUANTIZATION_RANGES[name] / (65535 if name == "edge_number" else 255)
+            assert errors[:, columns].max() <= step / 2 + 1e-6
+
+
+def test_float16_round_trip():
+    obs = observations()
+    codec = ObservationCodec(obs.shape[1], "float16")
+    np.testing.assert_allclose(codec.decode(codec.encode(obs)), obs, atol=1e-3)
+
+
+def test_encoder_drops_new_obs_of_every_policy_batch():
+    obs = observations()
+    batches = {
+        policy_id: SimpleNamespace(data={"obs": obs.copy(), "new_obs": obs.copy()})
+        for policy_id in ("corner", "interior")
+    }
+    make_encoder("uint8")({"samples": SimpleNamespace(policy_batches=batches)})
+    for batch in batches.values():
+        assert set(batch.data) == {"obs"}
+        assert batch.data["obs"].dtype == np.uint8
+
+
+class FakeTFPolicy:
+    """ Takes the loss inputs from the batch like RLlib's TFPolicy """
+
+    observation_space = SimpleNamespace(shape=(42,))
+
+    def _get_loss_inputs_dict(self, batch, shuffle):
+        return {"obs": batch["obs"], "actions": batch["actions"]}
+
+
+def test_loss_sees_decoded_observations():
+    obs = observations()
+    batch = {"obs": obs.copy(), "actions": np.zeros((len(obs), 1), dtype=np.float32)}
+    make_encoder("uint8")({"samples": SimpleNamespace(data=batch)})
+    assert batch["obs"].dtype == np.uint8
+
+    feed_dict = compact_policy(FakeTFPolicy)()._get_loss_inputs_dict(batch, shuffle=False)
+    assert feed_dict["obs"].dtype == np.float32
+    np.testing.assert_allclose(feed_dict["obs"], obs, atol=QUANTIZATION_RANGES["speed"] / 255)
+    # decoded in place, for the next SGD iterations
+    assert batch["obs"] is feed_dict["obs"]
+
+
+def test_encoded_column_never_reaches_the_loss():
+    class LeakyPolicy(FakeTFPolicy):
+        def _get_loss_inputs_dict(self, batch, shuffle):
+            return {"obs": batch["obs"], "codes": np.zeros((1, 42), dtype=np.uint8)}
+
+    batch = {"obs": observations()}
+    with pytest.raises(AssertionError):
+        compact_policy(LeakyPolicy)()._get_loss_inputs_dict(batch, shuffle=False)
+
+
+@pytest.mark.parametrize("mode", ["uint8", "float16"])
+def test_first_ppo_update_barely_changes(mode):
+    stats = validate_ppo(PolicyNetwork.random(42), observations(), mode)
+    assert stats["none"]["kl"] == 0
+    assert stats[mode]["kl"] < 1e-4
+    assert abs(stats[mode]["total_loss"] - stats["none"]["total_loss"]) < 1e-3
+    if mode == "uint8":
+        # what the loss would report if the codes reached it undecoded
+        assert stats["undecoded"]["kl"] > 100 * stats[mode]["kl"]
+
+
+def test_rllib_ppo_update_on_decoded_batch():
+    pytest.importorskip("ray")
+    pytest.importorskip("tensorflow")
+    from compact_batch import rllib_update_check
+
+    stats = rllib_update_check(observations(), "uint8")
+    for key in ("total_loss", "policy_loss", "vf_loss"):
+        assert abs(stats["uint8"][key] - stats["none"][key]) < 1e-2 * max(1, abs(stats["none"][key]))
+    assert stats["uint8"]["kl"] < 1e-4
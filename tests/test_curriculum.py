@@ -0,0 +1,42 @@
+import numpy as np
+
+from curriculum import PlateauDetector
+
+
+def feed(detector, rewards):
+    """ @returns the iteration at which the detector first reports a plateau, or None """
+    for iteration, reward in enumerate(rewards):
+        if detector.update(reward):
+            return iteration
+    return None
+
+
+def test_improving_reward_does_not_plateau():
+    rewards = -100.0 + 5.0 * np.arange(100)
+    assert feed(PlateauDetector(window=10, min_improvement=0.01), rewards) is None
+
+
+def test_flat_reward_plateaus_after_min_iterations():
+    detector = PlateauDetector(window=5, min_improvement=0.01, min_iterations=12)
+    assert feed(detector, np.full(50, -100.0)) == 11
+
+
+def test_min_iterations_covers_two_windows():
+    detector = PlateauDetector(window=10, min_iterations=5)
+    assert detector.min_iterations == 20
+    assert feed(detector, np.full(50, -100.0)) == 19
+
+
+def test_reward_plateaus_once_it_stops_improving():
+    # reaches 190 at iteration 29; iteration 38 is the first whose previous window
+    # lies entirely on the plateau, before that the windows still differ by over 1%
+    rewards = np.minimum(-100.0 + 10.0 * np.arange(60), 190.0)
+    assert feed(PlateauDetector(window=5, min_improvement=0.01), rewards) == 38
+
+
+def test_nan_rewards_are_skipped():
+    detector = PlateauDetector(window=2, min_iterations=4)
+    assert feed(detector, [np.nan] * 10 + [-1.0] * 3) is None
+    assert np.isnan(PlateauDetector().smoothed())
+    assert detector.update(-1.0)
+    assert detector.smoothed() == -1.0
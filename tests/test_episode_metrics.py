@@ -0,0 +1,57 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import benchmark
+from run_experiment import on_episode_end
+
+
+@pytest.fixture
+def make_env(stand_in):
+    from basic_env import BasicEnv
+
+    return lambda size: benchmark.make_env(BasicEnv, size)
+
+
+class FakeEpisode:
+    """ The parts of RLlib's MultiAgentEpisode on_episode_end reads """
+
+    def __init__(self, infos, policy_for=lambda agent_id: "av"):
+        self.agent_rewards = {(agent_id, policy_for(agent_id)): 0.0 for agent_id in infos}
+        self.custom_metrics = {}
+        self._infos = infos
+        self.policy_for = policy_for
+
+    def last_info_for(self, agent_id):
+        return self._infos.get(agent_id)
+
+
+def run_episode(env, steps):
+    actions = {name: 1.0 for name in env.agent_index.names}
+    for _ in range(steps):
+        _, _, _, infos = env.step(actions)
+    return infos
+
+
+def test_metrics_come_from_the_env_of_the_episode(make_env):
+    envs = [make_env(3) for _ in range(2)]
+    infos = [run_episode(env, steps) for env, steps in zip(envs, (5, 2))]
+
+    for env, env_infos in zip(envs, infos):
+        episode = FakeEpisode(env_infos)
+        on_episode_end({"env": SimpleNamespace(), "episode": episode})
+        assert np.isclose(episode.custom_metrics["raw_reward"], env.raw_reward)
+    assert envs[0].raw_reward != envs[1].raw_reward
+
+
+def test_per_class_metrics_are_means_per_agent(make_env):
+    env = make_env(3)
+    infos = run_episode(env, 3)
+    corners = {"center0", "center2", "center6", "center8"}
+    episode = FakeEpisode(infos, lambda agent_id: "corner" if agent_id in corners else "other")
+    on_episode_end({"env": SimpleNamespace(), "episode": episode})
+    corner_ids = [env.agent_index.id_num(name) for name in sorted(corners)]
+    assert np.isclose(
+        episode.custom_metrics["raw_reward_corner"], env.raw_rewards_by_agent[corner_ids].mean()
+    )
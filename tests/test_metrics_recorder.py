@@ -0,0 +1,39 @@
+import glob
+import json
+import os
+
+import numpy as np
+
+from metrics_recorder import MetricsRecorder
+from profiling import StepProfiler
+
+
+def test_recorders_of_one_process_keep_their_own_shards(tmp_path):
+    recorders = [MetricsRecorder(str(tmp_path), num_agents=4, chunk_size=3) for _ in range(2)]
+    for value, recorder in enumerate(recorders):
+        for step in range(5):
+            recorder.record(0, step, raw_reward=np.full(4, value))
+        recorder.close()
+
+    prefixes = {}
+    for path in glob.glob(os.path.join(str(tmp_path), "metrics_*.npz")):
+        prefixes.setdefault(os.path.basename(path).rsplit("_", 1)[0], []).append(path)
+    assert len(prefixes) == 2
+    for paths in prefixes.values():
+        shards = [np.load(path) for path in sorted(paths)]
+        rewards = np.concatenate([shard["raw_reward"] for shard in shards])
+        assert rewards.shape == (5, 4)
+        assert len(np.unique(rewards)) == 1
+
+
+def test_profilers_of_one_process_keep_their_own_traces(tmp_path):
+    profilers = [StepProfiler(str(tmp_path)) for _ in range(2)]
+    for profiler in profilers:
+        profiler.begin_step()
+        profiler.end_step(0.0)
+        profiler.end_episode()
+
+    paths = sorted(glob.glob(os.path.join(str(tmp_path), "profile_*.jsonl")))
+    assert len(paths) == 2
+    instances = {json.loads(open(path).readline())["instance"] for path in paths}
+    assert instances == {profiler.instance for profiler in profilers}
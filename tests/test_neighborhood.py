@@ -0,0 +1,70 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import benchmark
+from neighborhood import GridNeighborhood, NeighborhoodIndex
+from reward_sharing import knn_importance
+
+
+def grid_network(rows, cols, inner_length=300.0, outer_length=500.0):
+    """ Node and edge specs laid out like flow's TrafficLightGridNetwork """
+    nodes = [{"id": f"center{i}"} for i in range(rows * cols)]
+    edges = []
+
+    def connect(a, b, length):
+        edges.append({"from": a, "to": b, "length": length})
+        edges.append({"from": b, "to": a, "length": length})
+
+    for row in range(rows):
+        for col in range(cols):
+            i = row * cols + col
+            if col + 1 < cols:
+                connect(f"center{i}", f"center{i + 1}", inner_length)
+            if row + 1 < rows:
+                connect(f"center{i}", f"center{i + cols}", inner_length)
+    for row in range(rows):
+        connect(f"left_row{row}", f"center{row * cols}", outer_length)
+        connect(f"right_row{row}", f"center{row * cols + cols - 1}", outer_length)
+    for col in range(cols):
+        connect(f"bot_col{col}", f"center{col}", outer_length)
+        connect(f"top_col{col}", f"center{(rows - 1) * cols + col}", outer_length)
+    nodes += [{"id": end} for edge in edges for end in (edge["from"],) if "center" not in end]
+    return SimpleNamespace(rows=rows, cols=cols, nodes=nodes, edges=edges)
+
+
+@pytest.mark.parametrize("rows, cols", [(1, 1), (2, 3), (3, 3), (4, 5)])
+def test_grid_matches_the_graph_of_its_network(rows, cols):
+    names = [f"center{i}" for i in range(rows * cols)]
+    grid = GridNeighborhood(rows, cols)
+    network = NeighborhoodIndex.from_network(grid_network(rows, cols), names)
+
+    assert (grid.adjacency() != network.adjacency()).nnz == 0
+    for k in range(1, rows * cols + 1):
+        grid_neighbors, grid_distances = grid.k_nearest(k)
+        neighbors, distances = network.k_nearest(k)
+        np.testing.assert_array_equal(grid_neighbors, neighbors)
+        np.testing.assert_array_equal(grid_distances, distances)
+    for source in range(rows * cols):
+        for target in range(rows * cols):
+            assert grid.distance(source, target) == network.distance(source, target)
+
+
+def test_length_metric_measures_meters():
+    names = [f"center{i}" for i in range(4)]
+    network = NeighborhoodIndex.from_network(grid_network(2, 2), names, metric="length")
+    assert network.distance(0, 3) == 600.0
+
+
+def test_network_neighborhood_keeps_knn_sharing_on_the_hop_scale(stand_in):
+    from basic_env import BasicEnv
+
+    params = dict(benchmark.ADDITIONAL_PARAMS, sharing="knn", neighborhood="network")
+    env = BasicEnv(SimpleNamespace(additional_params=params), None, grid_network(3, 3))
+    grid = GridNeighborhood(3, 3)
+    k, tau = params["k_nearest_neighbor"], params["temperature_factor"]
+    expected = knn_importance(grid, k, tau).toarray()
+    np.testing.assert_allclose(knn_importance(env.neighborhood, k, tau).toarray(), expected)
+    # neighbors keep a weight sharing can notice
+    assert expected[expected > 0].min() > 1e-3
@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+
+import benchmark
+from observation_cache import ObservationCache
+
+
+@pytest.fixture
+def make_env(stand_in):
+    from basic_env import BasicEnv
+
+    return lambda size: benchmark.make_env(BasicEnv, size)
+
+
+def flow_get_state(env, own_edges=False):
+    """ flow's MultiTrafficLightGridPOEnv.get_state on the stand-in's kernel, with the
+    edges of agent center{i} taken from node_mapping[i], or from its own entry
+    """
+    vehicle, network = env.k.vehicle, env.k.network
+    edges = network.get_edge_list()
+    max_speed = max(network.speed_limit(edge) for edge in edges)
+    max_dist = 100.0
+    by_edge = {edge: [v for v in vehicle.ids if vehicle.edges[v] == edge] for edge in edges}
+
+    def dist(veh_id):
+        return network.edge_length(vehicle.edges[veh_id]) - vehicle.positions[veh_id]
+
+    speeds, dists, numbers, observed_ids = [], [], [], []
+    for _, node_edges in env.network.node_mapping:
+        local_speeds, local_dists, local_numbers = [], [], []
+        for edge in node_edges:
+            ids = sorted(by_edge[edge], key=dist)[: env.num_observed]
+            observed_ids.append(ids)
+            local_speeds += [vehicle.speeds[v] / max_speed for v in ids]
+            local_dists += [dist(v) / max_dist for v in ids]
+            local_numbers += [
+                env._convert_edge(vehicle.edges[v]) / (network.network.num_edges - 1)
+                for v in ids
+            ]
+            missing = env.num_observed - len(ids)
+            local_speeds += [1] * missing
+            local_dists += [1] * missing
+            local_numbers += [0] * missing
+        speeds.append(local_speeds)
+        dists.append(local_dists)
+        numbers.append(local_numbers)
+
+    density = np.array(
+        [5 * len(by_edge[edge]) / network.edge_length(edge) for edge in edges]
+    )
+    velocity = np.array(
+        [
+            np.mean([vehicle.speeds[v] for v in by_edge[edge]]) / max_speed
+            if by_edge[edge] else 0
+            for edge in edges
+        ]
+    )
+    direction = np.append(env.direction.flatten(), [0])
+    yellow = np.append(env.currently_yellow.flatten(), [1])
+
+    positions = {node_id: i for i, (node_id, _) in enumerate(env.network.node_mapping)}
+    obs = {}
+    for i in range(env.num_traffic_lights):
+        rl_id = f"center{i}"
+        row = positions[rl_id] if own_edges else i
+        local_edges = [edges.index(e) for e in env.network.node_mapping[row][1]]
+        lights = [i] + [
+            env._get_relative_node(rl_id, side) for side in ("top", "bottom", "left", "right")
+        ]
+        obs[rl_id] = np.concatenate(
+            [
+                speeds[row], dists[row], numbers[row], density[local_edges],
+                velocity[local_edges], direction[lights], yellow[lights],
+            ]
+        )
+    return obs, observed_ids
+
+
+def observe(env, order):
+    for _ in range(3):
+        env.k.vehicle = benchmark.StandInVehicles(env.k.network.get_edge_list(), env._rng)
+        env.direction = env._rng.randint(0, 2, env.direction.shape).astype(float)
+        env.currently_yellow = env._rng.randint(0, 2, env.direction.shape).astype(float)
+        yield ObservationCache(env, order).observe(), env.observed_ids
+
+
+@pytest.mark.parametrize("size", [3, 4, 5])
+@pytest.mark.parametrize("order", ["flow", "agent"])
+def test_observations_match_flow(make_env, size, order):
+    env = make_env(size)
+    for obs, observed_ids in observe(env, order):
+        expected, expected_ids = flow_get_state(env, own_edges=order == "agent")
+        assert list(obs) == list(expected)
+        for name in expected:
+            np.testing.assert_allclose(obs[name], expected[name], rtol=1e-12)
+        if order == "flow":
+            assert observed_ids == expected_ids
+
+
+def test_orders_differ_beyond_ten_intersections(make_env):
+    env = make_env(4)
+    flow_obs = ObservationCache(env, "flow").observe()
+    agent_obs = ObservationCache(env, "agent").observe()
+    assert np.array_equal(flow_obs["center0"], agent_obs["center0"])
+    assert not np.array_equal(flow_obs["center2"], agent_obs["center2"])
@@ -0,0 +1,83 @@
+import socket
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from policy_server import PolicyClient, PolicyNetwork, PolicyServer, _Batcher, serve
+
+OBS_DIM = 42
+
+
+def position_server():
+    networks = {
+        policy_id: PolicyNetwork.random(OBS_DIM, seed=seed)
+        for seed, policy_id in enumerate(("corner", "edge", "interior"))
+    }
+    return PolicyServer(networks, "position")
+
+
+def observations(num_agents, seed=0):
+    rng = np.random.RandomState(seed)
+    return {f"center{i}": rng.rand(OBS_DIM).astype(np.float32) for i in range(num_agents)}
+
+
+def test_several_policies_need_the_grid_shape():
+    server = position_server()
+    with pytest.raises(ValueError):
+        server.compute_actions(observations(9))
+    assert len(server.compute_actions(observations(9), 3, 3)) == 9
+
+
+def test_policies_must_observe_the_same_features():
+    networks = {"corner": PolicyNetwork.random(OBS_DIM), "edge": PolicyNetwork.random(10)}
+    with pytest.raises(ValueError):
+        PolicyServer(networks, "position")
+
+
+def test_malformed_request_is_refused_before_batching():
+    batcher = _Batcher(PolicyServer({"av": PolicyNetwork.random(OBS_DIM)}), max_wait=0.0)
+    with pytest.raises(ValueError):
+        batcher.compute(np.zeros((4, OBS_DIM + 1), dtype=np.float32), None)
+    assert batcher.compute(np.zeros((4, OBS_DIM), dtype=np.float32), None).shape == (4, 1)
+
+
+def test_failed_batch_is_raised_to_its_callers_and_the_batcher_goes_on():
+    server = PolicyServer({"av": PolicyNetwork.random(OBS_DIM)})
+    compute_batch = server.compute_batch
+    failures = [RuntimeError("forward pass failed")]
+
+    def fail_once(obs, policy_ids=None):
+        if failures:
+            raise failures.pop()
+        return compute_batch(obs, policy_ids)
+
+    server.compute_batch = fail_once
+    batcher = _Batcher(server, max_wait=0.0)
+    obs = np.zeros((4, OBS_DIM), dtype=np.float32)
+    with pytest.raises(RuntimeError):
+        batcher.compute(obs, None)
+    np.testing.assert_allclose(batcher.compute(obs, None), compute_batch(obs))
+
+
+def test_socket_api_reports_errors_and_keeps_serving():
+    with socket.socket() as probe:
+        probe.bind(("localhost", 0))
+        address = probe.getsockname()
+    server = position_server()
+    threading.Thread(target=serve, args=(server, address), daemon=True).start()
+    for _ in range(100):
+        try:
+            client = PolicyClient(address)
+            break
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+
+    with pytest.raises(RuntimeError, match="grid shape"):
+        client.compute_actions(observations(9))
+    actions = client.compute_actions(observations(9), 3, 3)
+    expected = server.compute_actions(observations(9), 3, 3)
+    for name in expected:
+        np.testing.assert_allclose(actions[name], expected[name], rtol=1e-6)
+    client.close()
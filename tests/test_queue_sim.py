@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("gym")
+pytest.importorskip("ray")
+
+from agent_index import AgentIndex  # noqa: E402
+
+
+@pytest.fixture
+def lights(stand_in):
+    from queue_sim import QueueGridEnv
+
+    return lambda discrete: light_state(QueueGridEnv.__new__(QueueGridEnv), discrete)
+
+
+def light_state(env, discrete):
+    """ env, holding just the light state _apply_rl_actions reads """
+    env.discrete = discrete
+    env._agent_index = AgentIndex(1, 2)
+    env.sim_step = 1.0
+    env.min_switch_time = 3.0
+    env.direction = np.zeros(2)
+    env.currently_yellow = np.zeros(2)
+    env.last_change = np.zeros(2)
+    return env
+
+
+def test_discrete_action_one_switches_the_light(lights):
+    env = lights(discrete=True)
+    env._apply_rl_actions({"center0": 1, "center1": 0})
+    assert env.direction.tolist() == [1, 0]
+    assert env.currently_yellow.tolist() == [1, 0]
+
+
+def test_discrete_matches_continuous(lights):
+    discrete, continuous = lights(discrete=True), lights(discrete=False)
+    rng = np.random.RandomState(0)
+    for _ in range(20):
+        actions = rng.randint(0, 2, size=2)
+        discrete._apply_rl_actions({f"center{i}": a for i, a in enumerate(actions)})
+        continuous._apply_rl_actions(
+            {f"center{i}": np.array([a - 0.5]) for i, a in enumerate(actions)}
+        )
+        assert discrete.direction.tolist() == continuous.direction.tolist()
+        assert discrete.currently_yellow.tolist() == continuous.currently_yellow.tolist()
@@ -0,0 +1,159 @@
+import math
+import operator
+
+import numpy as np
+import pytest
+
+from neighborhood import GridNeighborhood
+from reward_sharing import AxisSharing, KNNSharing, NeighborSharing
+
+GRIDS = [(1, 1), (1, 4), (3, 3), (4, 5), (6, 2)]
+
+
+class OldLoops:
+    """ The per-agent reward sharing loops of the baseline RewardSharingEnv,
+    RewardSharingEnvSimple and RewardSharingEnvKNN, with flow's _get_relative_node
+    """
+
+    def __init__(self, rows, cols):
+        self.rows = rows
+        self.cols = cols
+
+    def _get_relative_node(self, agent_id, direction):
+        agent_id_num = int(agent_id.split("center")[1])
+        if direction == "top":
+            node = agent_id_num + self.cols
+            if node >= self.cols * self.rows:
+                node = -1
+        elif direction == "bottom":
+            node = agent_id_num - self.cols
+            if node < 0:
+                node = -1
+        elif direction == "left":
+            node = -1 if agent_id_num % self.cols == 0 else agent_id_num - 1
+        elif direction == "right":
+            node = -1 if agent_id_num % self.cols == self.cols - 1 else agent_id_num + 1
+        return node
+
+    def _add(self, adjusted, raw, rl_id, sides, weight):
+        for side in sides:
+            name = f"center{self._get_relative_node(rl_id, side)}"
+            if name != "center-1":
+                adjusted[rl_id] += raw[name] * weight
+
+    def axis(self, raw, directions, weight):
+        adjusted = {}
+        for rl_id in raw:
+            adjusted[rl_id] = raw[rl_id]
+            if directions[int(rl_id.split("center")[1])] == 0:
+                self._add(adjusted, raw, rl_id, ("top", "bottom"), weight)
+            else:
+                self._add(adjusted, raw, rl_id, ("left", "right"), weight)
+        return adjusted
+
+    def neighbors(self, raw, weight):
+        adjusted = {}
+        for rl_id in raw:
+            adjusted[rl_id] = raw[rl_id]
+            self._add(adjusted, raw, rl_id, ("top", "bottom", "left", "right"), weight)
+        return adjusted
+
+    def knn_importance(self, rl_id_num, raw, k, tau):
+        importance = {}
+        for rl_id in raw:
+            source = int(rl_id.split("center")[1])
+            distance = abs(source // self.cols - rl_id_num // self.cols) + abs(
+                source % self.cols - rl_id_num % self.cols
+            )
+            if len(importance) == k:
+                min_id = min(importance.items(), key=operator.itemgetter(1))[0]
+                if -distance > importance[min_id]:
+                    importance[rl_id] = -distance
+                    del importance[min_id]
+            else:
+                importance[rl_id] = -distance
+        normalizer = sum(math.exp(logit / tau) for logit in importance.values())
+        return {name: math.exp(logit / tau) / normalizer for name, logit in importance.items()}
+
+    def knn(self, raw, k, tau):
+        adjusted = {}
+        for rl_id in raw:
+            importance = self.knn_importance(int(rl_id.split("center")[1]), raw, k, tau)
+            adjusted[rl_id] = sum(raw[name] * weight for name, weight in importance.items())
+        return adjusted
+
+
+def random_rewards(num_agents, seed=0):
+    rewards = np.random.RandomState(seed).uniform(-1.0, 0.0, num_agents)
+    return rewards, {f"center{i}": reward for i, reward in enumerate(rewards)}
+
+
+def compiled(strategy, rows, cols):
+    strategy.compile(GridNeighborhood(rows, cols))
+    return strategy
+
+
+@pytest.mark.parametrize("rows, cols", GRIDS)
+def test_axis_sharing_matches_old_loop(rows, cols):
+    rewards, raw = random_rewards(rows * cols)
+    directions = np.random.RandomState(1).randint(0, 2, rows * cols)
+    shared = compiled(AxisSharing(0.4), rows, cols).share(rewards, directions)
+    expected = OldLoops(rows, cols).axis(raw, directions, 0.4)
+    np.testing.assert_allclose(shared, [expected[f"center{i}"] for i in range(rows * cols)])
+
+
+@pytest.mark.parametrize("rows, cols", GRIDS)
+def test_neighbor_sharing_matches_old_loop(rows, cols):
+    rewards, raw = random_rewards(rows * cols)
+    shared = compiled(NeighborSharing(0.4), rows, cols).share(rewards, None)
+    expected = OldLoops(rows, cols).neighbors(raw, 0.4)
+    np.testing.assert_allclose(shared, [expected[f"center{i}"] for i in range(rows * cols)])
+
+
+@pytest.mark.parametrize("rows, cols", GRIDS)
+@pytest.mark.parametrize("k", [1, 3, 5, 8])
+def test_knn_sharing_matches_old_loop_up_to_ties(rows, cols, k):
+    """ The neighbor sets only differ in which agent at the k-th distance is kept, so
+    the weights per row and the neighbors closer than the k-th distance must match
+    """
+    old = OldLoops(rows, cols)
+    _, raw = random_rewards(rows * cols)
+    matrix = compiled(KNNSharing(k, 0.5), rows, cols)._matrix
+    for i in range(rows * cols):
+        importance = old.knn_importance(i, raw, k, 0.5)
+        row = matrix.getrow(i)
+        np.testing.assert_allclose(np.sort(row.data), sorted(importance.values()))
+
+        weights = dict(zip(row.indices.tolist(), row.data))
+        cutoff = min(weights.values())
+        closer = {j for j, weight in weights.items() if weight > cutoff + 1e-12}
+        old_closer = {
+            int(name.split("center")[1])
+            for name, weight in importance.items()
+            if weight > cutoff + 1e-12
+        }
+        assert closer == old_closer
+
+
+@pytest.mark.parametrize("rows, cols", GRIDS)
+@pytest.mark.parametrize("k", [2, 4, 6])
+def test_knn_sharing_tie_difference_is_bounded(rows, cols, k):
+    """ Swapping tied neighbors changes an agent's shared reward by at most the weight
+    of the neighbors at the k-th distance times the spread of the rewards
+    """
+    rewards, raw = random_rewards(rows * cols)
+    matrix = compiled(KNNSharing(k, 0.5), rows, cols)._matrix
+    shared = matrix.dot(rewards)
+    expected = OldLoops(rows, cols).knn(raw, k, 0.5)
+    spread = rewards.max() - rewards.min()
+    for i in range(rows * cols):
+        row = matrix.getrow(i)
+        tied_weight = row.data[np.isclose(row.data, row.data.min())].sum()
+        assert abs(shared[i] - expected[f"center{i}"]) <= tied_weight * spread + 1e-12
+
+
+def test_knn_sharing_differs_on_ties():
+    rewards, raw = random_rewards(9)
+    shared = compiled(KNNSharing(2, 0.5), 3, 3).share(rewards, None)
+    expected = OldLoops(3, 3).knn(raw, 2, 0.5)
+    assert not np.allclose(shared, [expected[f"center{i}"] for i in range(9)])
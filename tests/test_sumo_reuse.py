@@ -0,0 +1,138 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import benchmark
+
+
+class FakeTraCI:
+    """ The TraCI calls SharingEnv.reset makes, on a SUMO instance whose clock and
+    lights persist until it is restarted
+    """
+
+    def __init__(self):
+        from traci.exceptions import FatalTraCIError
+
+        self.error = FatalTraCIError
+        self.time = 0.0
+        self.alive = True
+        self.lights = {}
+        self.simulation = SimpleNamespace(
+            getTime=self._call(lambda: self.time), getMinExpectedNumber=lambda: 0
+        )
+        self.vehicle = SimpleNamespace(getIDList=self._call(lambda: []))
+        self.trafficlight = SimpleNamespace(
+            getRedYellowGreenState=self._call(lambda name: self.lights.get(name, "GrGr")),
+            setRedYellowGreenState=self._call(self.lights.__setitem__),
+        )
+        self.edge = SimpleNamespace(subscribe=lambda *args: None)
+
+    def _call(self, fn):
+        def call(*args):
+            if not self.alive:
+                raise self.error("connection closed")
+            return fn(*args)
+
+        return call
+
+
+class FlowReset(benchmark.StandInGridEnv):
+    """ flow's reset: a new SUMO instance if restart_instance is set """
+
+    def __init__(self, env_params, sim_params, network, simulator="traci"):
+        super().__init__(env_params, sim_params, network, simulator)
+        self.sim_params = sim_params
+        self.net_params.inflows = SimpleNamespace(get=lambda: [{"end": network.inflow_end}])
+        self.initial_ids = []
+        self.k.kernel_api = FakeTraCI()
+        self.restarts = 0
+
+    def reset(self):
+        if self.sim_params.restart_instance:
+            self.k.kernel_api = FakeTraCI()
+            self.restarts += 1
+        return super().reset()
+
+
+@pytest.fixture
+def make_env(stand_in):
+    from sharing_env import SharingEnv
+
+    class ReusingEnv(SharingEnv, FlowReset):
+        pass
+
+    def make(restart_every, inflow_end=86400.0, **params):
+        return ReusingEnv(*env_args(restart_every, inflow_end, **params))
+
+    return make
+
+
+def env_args(restart_every, inflow_end, **params):
+    env_params = SimpleNamespace(
+        additional_params=dict(
+            benchmark.ADDITIONAL_PARAMS, restart_every=restart_every, **params
+        ),
+        sims_per_step=1,
+        warmup_steps=0,
+        horizon=400,
+    )
+    network = SimpleNamespace(rows=2, cols=2, inflow_end=inflow_end)
+    return env_params, SimpleNamespace(sim_step=1.0), network
+
+
+def run_episode(env, switch_lights=False):
+    env.reset()
+    env.k.kernel_api.time += 400
+    if switch_lights:
+        env.direction[:] = 1
+        env.k.kernel_api.lights["center0"] = "rGrG"
+
+
+def test_instance_is_reused_restart_every_episodes(make_env):
+    env = make_env(restart_every=3)
+    for _ in range(7):
+        run_episode(env)
+    # episodes 4 and 7 start on a new instance
+    assert env.restarts == 2
+
+
+def test_instance_is_restarted_before_its_inflows_end(make_env):
+    env = make_env(restart_every=100, inflow_end=1000.0)
+    for _ in range(4):
+        run_episode(env)
+    # episodes ending at 400s and 800s fit, the third would end at 1200s
+    assert env.restarts == 1
+    assert env.k.kernel_api.time == 400 + 400
+
+
+def test_reused_episode_starts_from_the_initial_lights(make_env):
+    env = make_env(restart_every=3)
+    run_episode(env, switch_lights=True)
+    obs = env.reset()
+    assert env.restarts == 0
+    assert env.k.kernel_api.lights["center0"] == "GrGr"
+    np.testing.assert_array_equal(env.direction, 0)
+    assert obs["center0"][-10] == 0
+
+
+def test_dead_connection_restarts_the_instance(make_env):
+    env = make_env(restart_every=3)
+    run_episode(env)
+    env.k.kernel_api.alive = False
+    env.reset()
+    assert env.restarts == 1
+    assert env.k.kernel_api.alive
+
+
+def test_refused_reuse_counts_one_episode(make_env):
+    env = make_env(restart_every=3, profile=True)
+    run_episode(env)
+    # a backlog of vehicles waiting to be inserted makes the in-place reset refuse
+    env.k.kernel_api.simulation.getMinExpectedNumber = lambda: 100
+    run_episode(env)
+    run_episode(env)
+    assert env.restarts == 1
+    assert env.episode == env.profiler.episode == 3
+    # the refused attempt and the restart are timed as one reset
+    assert len(env.profiler._durations["reset"]) == 1
@@ -0,0 +1,83 @@
+import json
+
+import pytest
+
+from run_experiment import ENV_SHARING
+from sweep import SWEEP_KEYS, expand_sweep, load_sweep, run_tag
+
+DEFAULTS = {
+    "env": "BasicEnv",
+    "num_rows": 3,
+    "num_cols": 3,
+    "inflow_rate": 300,
+    "neighbor_weight": 0.5,
+    "k_nearest": 3,
+    "temp": 1.0,
+    "lr": 1e-4,
+}
+
+
+def test_grid_search_is_the_product_of_the_values():
+    spec = {"num_rows": [3, 5], "num_cols": [3, 5], "lr": [1e-4, 1e-3]}
+    runs = expand_sweep(spec, DEFAULTS, ENV_SHARING)
+    assert len(runs) == 8
+    assert {(run["num_rows"], run["num_cols"], run["lr"]) for run in runs} == {
+        (rows, cols, lr) for rows in (3, 5) for cols in (3, 5) for lr in (1e-4, 1e-3)
+    }
+    for run in runs:
+        assert set(run) == set(SWEEP_KEYS)
+        assert run["inflow_rate"] == DEFAULTS["inflow_rate"]
+
+
+def test_ignored_sharing_params_are_not_swept():
+    spec = {
+        "env": ["BasicEnv", "RewardSharingEnv", "RewardSharingEnvKNN"],
+        "neighbor_weight": [0.1, 0.5],
+        "temp": [0.1, 1.0],
+    }
+    runs = expand_sweep(spec, DEFAULTS, ENV_SHARING)
+    counts = {env: sum(run["env"] == env for run in runs) for env in spec["env"]}
+    assert counts == {"BasicEnv": 1, "RewardSharingEnv": 2, "RewardSharingEnvKNN": 2}
+    for run in runs:
+        if run["env"] != "RewardSharingEnv":
+            assert run["neighbor_weight"] == DEFAULTS["neighbor_weight"]
+        if run["env"] != "RewardSharingEnvKNN":
+            assert run["temp"] == DEFAULTS["temp"]
+
+
+def test_random_search_is_seeded_and_typed():
+    spec = {
+        "search": "random",
+        "num_samples": 5,
+        "seed": 7,
+        "num_rows": [3, 4.0],
+        "lr": {"low": 1e-5, "high": 1e-3},
+    }
+    runs = expand_sweep(spec, DEFAULTS, ENV_SHARING)
+    assert runs == expand_sweep(spec, DEFAULTS, ENV_SHARING)
+    for run in runs:
+        assert 1e-5 <= run["lr"] <= 1e-3
+        assert isinstance(run["num_rows"], int)
+
+
+@pytest.mark.parametrize(
+    "spec",
+    [
+        {"num_layers": [1, 2]},
+        {"search": "bayes"},
+        {"num_rows": 3},
+        {"env": ["NoSuchEnv"]},
+        {"search": "random", "num_rows": {"low": 3, "high": 5}},
+    ],
+)
+def test_invalid_specs_are_rejected(spec):
+    with pytest.raises(ValueError):
+        expand_sweep(spec, DEFAULTS, ENV_SHARING)
+
+
+def test_run_tags_are_unique(tmp_path):
+    path = tmp_path / "sweep.json"
+    spec = {"env": ["RewardSharingEnvKNN"], "num_rows": [3, 5], "temp": [0.1, 1.0]}
+    path.write_text(json.dumps(spec))
+    runs = expand_sweep(load_sweep(str(path)), DEFAULTS, ENV_SHARING)
+    assert len({run_tag(run) for run in runs}) == len(runs) == 4
@@ -0,0 +1,213 @@
+"""Disk cache of evaluation episodes, so sharing schemes can be compared without SUMO.
+
+The traffic an evaluation sees only depends on the flow params, the seed and the
+policy, not on how rewards are shared afterwards. A cached Trajectory keeps the raw
+reward and light direction of every agent at every step, so rescore recomputes the
+shared rewards of any SharingStrategy with array math alone.
+"""
+
+import hashlib
+import json
+import os
+import random
+from typing import Callable, Dict, Optional
+
+import numpy as np
+from flow.utils.rllib import FlowParamsEncoder
+
+from neighborhood import NeighborhoodIndex
+from reward_sharing import SharingStrategy
+
+# additional params that do not change the simulated traffic
+NON_TRAFFIC_PARAMS = (
+    "sharing",
+    "neighbor_weight",
+    "k_nearest_neighbor",
+    "temperature_factor",
+    "profile",
+    "profile_dir",
+    "restart_every",
+    "metrics_dir",
+    "neighborhood",
+    "neighborhood_metric",
+)
+
+
+class Trajectory:
+    """ One recorded episode, every array indexed by step and then agent id """
+
+    def __init__(
+        self,
+        observations: np.ndarray,
+        actions: np.ndarray,
+        raw_rewards: np.ndarray,
+        directions: np.ndarray,
+    ):
+        self.observations = observations
+        self.actions = actions
+        self.raw_rewards = raw_rewards
+        self.directions = directions
+
+    def save(self, path: str):
+        np.savez_compressed(
+            path,
+            observations=self.observations,
+            actions=self.actions,
+            raw_rewards=self.raw_rewards,
+            directions=self.directions,
+        )
+
+    @staticmethod
+    def load(path: str) -> "Trajectory":
+        with np.load(path) as data:
+            return Trajectory(
+                data["observations"], data["actions"], data["raw_rewards"], data["directions"]
+            )
+
+
+def trajectory_key(
+    flow_params: dict, seed: int, checkpoint: str, policy_classes: str
+) -> str:
+    """ @returns a hash of everything that determines the traffic of an episode, with
+    policy_classes the split of the agents into the policies of the checkpoint
+    """
+    env_params = flow_params["env"]
+    additional_params = {
+        key: value
+        for key, value in env_params.additional_params.items()
+        if key not in NON_TRAFFIC_PARAMS
+    }
+    traffic_params = dict(flow_params, env=dict(vars(env_params), additional_params=additional_params))
+    # the env class only matters through its base simulator, not its sharing
+    traffic_params["env_name"] = flow_params["simulator"]
+    encoded = json.dumps(
+        [traffic_params, seed, os.path.abspath(checkpoint), policy_classes],
+        cls=FlowParamsEncoder,
+        sort_keys=True,
+    )
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+class TrajectoryCache:
+    """ Size bounded least recently used cache of trajectories in a local directory.
+
+    Every trajectory is one .npz file named after its key. Reads refresh the file's
+    modification time, and writes evict the least recently used files until the
+    directory holds at most max_bytes.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 10 * 2 ** 30):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def get(self, key: str) -> Optional[Trajectory]:
+        path = self._path(key)
+        try:
+            trajectory = Trajectory.load(path)
+        except FileNotFoundError:
+            return None
+        os.utime(path)
+        return trajectory
+
+    def put(self, key: str, trajectory: Trajectory):
+        # write under a temporary name so readers never see a partial file
+        tmp_path = self._path(key) + f".{os.getpid()}.tmp.npz"
+        trajectory.save(tmp_path)
+        os.replace(tmp_path, self._path(key))
+        self._evict()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.npz")
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".npz") and ".tmp" not in entry.name:
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def record_trajectory(env, compute_actions: Callable[[Dict], Dict]) -> Trajectory:
+    """ Runs one episode of a SharingMixin env.
+
+    @param compute_actions maps the observation dict of a step to the action dict
+    """
+    index = env.agent_index
+    obs = env.reset()
+    observations, actions, raw_rewards, directions = [], [], [], []
+    done = False
+    while not done:
+        action = compute_actions(obs)
+        observations.append(np.stack([obs[name] for name in index.names]))
+        actions.append(np.stack([np.asarray(action[name]) for name in index.names]))
+        obs, _, dones, _ = env.step(action)
+        raw_rewards.append(np.array(env.last_raw_rewards))
+        directions.append(np.array(env.last_directions))
+        done = dones["__all__"]
+    return Trajectory(
+        np.array(observations, dtype=np.float32),
+        np.array(actions, dtype=np.float32),
+        np.array(raw_rewards),
+        np.array(directions),
+    )
+
+
+def cached_trajectory(
+    cache: TrajectoryCache,
+    flow_params: dict,
+    seed: int,
+    checkpoint: str,
+    policy_classes: str,
+    create_env: Callable,
+    compute_actions: Callable[[Dict], Dict],
+) -> Trajectory:
+    """ @returns the cached episode of the policies in checkpoint, split into
+    policy_classes, on flow_params with seed, recording it first if it is not cached
+
+    create_env must come from make_create_env(flow_params), recording sets the seed of
+    flow_params["sim"] before calling it.
+    """
+    key = trajectory_key(flow_params, seed, checkpoint, policy_classes)
+    trajectory = cache.get(key)
+    if trajectory is None:
+        trajectory = record_seeded(flow_params, seed, create_env, compute_actions)
+        cache.put(key, trajectory)
+    return trajectory
+
+
+def record_seeded(
+    flow_params: dict, seed: int, create_env: Callable, compute_actions: Callable[[Dict], Dict]
+) -> Trajectory:
+    """ Records one episode in a new env from create_env, seeded with seed.
+
+    create_env must come from make_create_env(flow_params).
+    """
+    # flow reseeds SUMO from the random module on every restart
+    random.seed(seed)
+    np.random.seed(seed)
+    flow_params["sim"].seed = seed
+    env = create_env()
+    try:
+        return record_trajectory(env, compute_actions)
+    finally:
+        env.terminate()
+
+
+def rescore(
+    trajectory: Trajectory, strategy: SharingStrategy, neighborhood: NeighborhoodIndex
+) -> np.ndarray:
+    """ @returns the (steps, agents) shared rewards the strategy gives to the episode """
+    strategy.compile(neighborhood)
+    return np.asarray(
+        strategy.share(trajectory.raw_rewards.T, trajectory.directions.T)
+    ).T